@@ -0,0 +1,348 @@
+"""
+Capa de almacenamiento para access_logs.
+
+En PostgreSQL la tabla está particionada por rango de timestamp (diario o
+mensual). AccessLogStorage crea las particiones por adelantado, aplica la
+retención (borrar, separar o archivar a CSV las particiones viejas) y
+mantiene los rollups horarios por ruta y por usuario que usa /admin/puerta.
+En otros motores (SQLite en tests) la retención se hace con DELETE.
+
+Se ejecuta periódicamente con `python manage_access_logs.py mantenimiento`.
+"""
+import base64
+import gzip
+import logging
+import os
+import re
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+PARENT_TABLE = 'access_logs'
+DEFAULT_PARTITION = 'access_logs_default'
+PARTITION_RE = re.compile(r'^access_logs_p(\d{4})_(\d{2})(?:_(\d{2}))?$')
+
+
+class AccessLogStorage(object):
+    """Particiones, retención y rollups de access_logs."""
+
+    def __init__(self, db, partition='month', ahead=3, retention_days=365,
+                 retention_mode='drop', archive_dir=None):
+        """
+        partition: 'month' o 'day'.
+        ahead: cuántos periodos futuros se crean por adelantado.
+        retention_days: antigüedad máxima; 0 desactiva la retención.
+        retention_mode: 'drop' (borrar), 'detach' (separar la partición y
+            conservarla como tabla suelta) o 'archive' (volcar a CSV gzip en
+            `archive_dir` y borrar).
+        """
+        if partition not in ('month', 'day'):
+            raise ValueError("partition debe ser 'month' o 'day'")
+        if retention_mode not in ('drop', 'detach', 'archive'):
+            raise ValueError("retention_mode debe ser 'drop', 'detach' o 'archive'")
+        self.db = db
+        self.partition = partition
+        self.ahead = int(ahead)
+        self.retention_days = int(retention_days)
+        self.retention_mode = retention_mode
+        self.archive_dir = archive_dir
+
+    @classmethod
+    def from_env(cls, db):
+        return cls(
+            db,
+            partition=os.getenv('ACCESS_LOG_PARTITION', 'month'),
+            ahead=int(os.getenv('ACCESS_LOG_PARTITIONS_AHEAD', '3')),
+            retention_days=int(os.getenv('ACCESS_LOG_RETENTION_DAYS', '365')),
+            retention_mode=os.getenv('ACCESS_LOG_RETENTION_MODE', 'drop'),
+            archive_dir=os.getenv('ACCESS_LOG_ARCHIVE_DIR')
+        )
+
+    # ---- Utilidades ------------------------------------------------------------
+
+    @property
+    def is_postgres(self):
+        return self.db.engine.dialect.name == 'postgresql'
+
+    def is_partitioned(self):
+        if not self.is_postgres:
+            return False
+        row = self.db.session.execute(text(
+            "SELECT c.relkind FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace "
+            "WHERE c.relname = :t AND n.nspname = current_schema()"
+        ), {'t': PARENT_TABLE}).first()
+        return bool(row and row[0] == 'p')
+
+    def _period_start(self, dt):
+        if self.partition == 'day':
+            return datetime(dt.year, dt.month, dt.day)
+        return datetime(dt.year, dt.month, 1)
+
+    def _next_period(self, start):
+        if self.partition == 'day':
+            return start + timedelta(days=1)
+        if start.month == 12:
+            return datetime(start.year + 1, 1, 1)
+        return datetime(start.year, start.month + 1, 1)
+
+    def _partition_name(self, start):
+        if self.partition == 'day':
+            return start.strftime('access_logs_p%Y_%m_%d')
+        return start.strftime('access_logs_p%Y_%m')
+
+    def list_partitions(self):
+        """Devuelve [(nombre, inicio, fin)] de las particiones con nombre estándar."""
+        rows = self.db.session.execute(text(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = :t"
+        ), {'t': PARENT_TABLE}).fetchall()
+        result = []
+        for (name,) in rows:
+            m = PARTITION_RE.match(name)
+            if not m:
+                continue
+            year, month, day = int(m.group(1)), int(m.group(2)), m.group(3)
+            if day:
+                start = datetime(year, month, int(day))
+                end = start + timedelta(days=1)
+            else:
+                start = datetime(year, month, 1)
+                end = datetime(year + 1, 1, 1) if month == 12 else datetime(year, month + 1, 1)
+            result.append((name, start, end))
+        return sorted(result, key=lambda r: r[1])
+
+    # ---- Particiones ----------------------------------------------------------
+
+    def ensure_partitions(self, now=None):
+        """Crea las particiones del periodo actual y de los `ahead` siguientes."""
+        if not self.is_partitioned():
+            logger.info("[ACCESS_LOG] access_logs no está particionada; se omite creación de particiones")
+            return []
+        now = now or datetime.utcnow()
+        existing = {name for name, _, _ in self.list_partitions()}
+        created = []
+        start = self._period_start(now)
+        for _ in range(self.ahead + 1):
+            end = self._next_period(start)
+            name = self._partition_name(start)
+            if name not in existing:
+                self._create_partition(name, start, end)
+                created.append(name)
+            start = end
+        return created
+
+    def _create_partition(self, name, start, end):
+        """Crea la partición fuera del padre, mueve las filas que hubieran caído
+        en la partición DEFAULT y la adjunta (evita el conflicto con DEFAULT)."""
+        params = {'desde': start, 'hasta': end}
+        session = self.db.session
+        try:
+            session.execute(text(f'CREATE TABLE "{name}" (LIKE {PARENT_TABLE} INCLUDING DEFAULTS)'))
+            session.execute(text(
+                f'INSERT INTO "{name}" SELECT * FROM {DEFAULT_PARTITION} '
+                'WHERE timestamp >= :desde AND timestamp < :hasta'
+            ), params)
+            session.execute(text(
+                f'DELETE FROM {DEFAULT_PARTITION} WHERE timestamp >= :desde AND timestamp < :hasta'
+            ), params)
+            session.execute(text(
+                f"ALTER TABLE {PARENT_TABLE} ATTACH PARTITION \"{name}\" "
+                f"FOR VALUES FROM ('{start.isoformat(sep=' ')}') TO ('{end.isoformat(sep=' ')}')"
+            ))
+            session.commit()
+            logger.info(f"[ACCESS_LOG] Partición creada: {name} [{start} - {end})")
+        except Exception:
+            session.rollback()
+            raise
+
+    # ---- Retención --------------------------------------------------------------
+
+    def apply_retention(self, now=None):
+        """Elimina (o archiva) los registros más antiguos que `retention_days`."""
+        if self.retention_days <= 0:
+            return []
+        cutoff = (now or datetime.utcnow()) - timedelta(days=self.retention_days)
+
+        if not self.is_partitioned():
+            deleted = self.db.session.execute(
+                text(f'DELETE FROM {PARENT_TABLE} WHERE timestamp < :cutoff'), {'cutoff': cutoff}
+            ).rowcount
+            self.db.session.commit()
+            logger.info(f"[ACCESS_LOG] Retención: {deleted} registros anteriores a {cutoff} borrados")
+            return []
+
+        processed = []
+        for name, start, end in self.list_partitions():
+            if end > cutoff:
+                continue
+            try:
+                if self.retention_mode == 'archive':
+                    self._archive_partition(name)
+                self.db.session.execute(text(f'ALTER TABLE {PARENT_TABLE} DETACH PARTITION "{name}"'))
+                if self.retention_mode != 'detach':
+                    self.db.session.execute(text(f'DROP TABLE "{name}"'))
+                self.db.session.commit()
+                processed.append(name)
+                logger.info(f"[ACCESS_LOG] Retención ({self.retention_mode}): {name}")
+            except Exception as e:
+                self.db.session.rollback()
+                logger.error(f"[ACCESS_LOG] Error aplicando retención a {name}: {e}", exc_info=True)
+        return processed
+
+    def _archive_partition(self, name):
+        if not self.archive_dir:
+            raise RuntimeError('ACCESS_LOG_ARCHIVE_DIR es requerido con retention_mode=archive')
+        os.makedirs(self.archive_dir, exist_ok=True)
+        path = os.path.join(self.archive_dir, f'{name}.csv.gz')
+        raw = self.db.session.connection().connection
+        with gzip.open(path, 'wt', encoding='utf-8') as fh:
+            cur = raw.cursor()
+            try:
+                cur.copy_expert(f'COPY "{name}" TO STDOUT WITH CSV HEADER', fh)
+            finally:
+                cur.close()
+        logger.info(f"[ACCESS_LOG] Partición {name} archivada en {path}")
+
+    # ---- Rollups ----------------------------------------------------------------
+
+    def _hour_bucket(self):
+        if self.is_postgres:
+            return "date_trunc('hour', timestamp)"
+        return "strftime('%Y-%m-%d %H:00:00', timestamp)"
+
+    def refresh_rollups(self, now=None):
+        """Recalcula los rollups desde la última hora registrada (incluida,
+        porque pudo quedar parcial) hasta ahora. Devuelve la hora de inicio."""
+        session = self.db.session
+        last = session.execute(text('SELECT max(hour) FROM access_log_rollups')).scalar()
+        if isinstance(last, str):
+            last = datetime.fromisoformat(last)
+        if last is None:
+            since = session.execute(text(f'SELECT min(timestamp) FROM {PARENT_TABLE}')).scalar()
+            if since is None:
+                return None
+            if isinstance(since, str):
+                since = datetime.fromisoformat(since)
+            since = since.replace(minute=0, second=0, microsecond=0)
+        else:
+            since = last
+        until = now or datetime.utcnow()
+        bucket = self._hour_bucket()
+        params = {'desde': since, 'hasta': until}
+        try:
+            session.execute(text('DELETE FROM access_log_rollups WHERE hour >= :desde'), {'desde': since})
+            session.execute(text(
+                'INSERT INTO access_log_rollups (hour, dimension, value, hits) '
+                f"SELECT {bucket}, 'path', path, count(*) FROM {PARENT_TABLE} "
+                'WHERE timestamp >= :desde AND timestamp < :hasta '
+                f'GROUP BY {bucket}, path'
+            ), params)
+            session.execute(text(
+                'INSERT INTO access_log_rollups (hour, dimension, value, hits) '
+                f"SELECT {bucket}, 'user', COALESCE(username, '-'), count(*) FROM {PARENT_TABLE} "
+                'WHERE timestamp >= :desde AND timestamp < :hasta '
+                f"GROUP BY {bucket}, COALESCE(username, '-')"
+            ), params)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        return since
+
+    def top_rollups(self, dimension, hours=24, limit=10, now=None):
+        """Top de rutas o usuarios en las últimas `hours` horas, desde los rollups."""
+        from models import AccessLogRollup
+        since = (now or datetime.utcnow()) - timedelta(hours=hours)
+        rows = (self.db.session.query(AccessLogRollup.value, self.db.func.sum(AccessLogRollup.hits))
+                .filter(AccessLogRollup.dimension == dimension, AccessLogRollup.hour >= since)
+                .group_by(AccessLogRollup.value)
+                .order_by(self.db.func.sum(AccessLogRollup.hits).desc())
+                .limit(limit).all())
+        return [{'value': r[0], 'hits': int(r[1] or 0)} for r in rows]
+
+    def maintain(self, now=None):
+        """Particiones + retención + rollups, en ese orden."""
+        return {
+            'particiones_creadas': self.ensure_partitions(now),
+            'retencion': self.apply_retention(now),
+            'rollups_desde': self.refresh_rollups(now)
+        }
+
+
+# ---- Consulta paginada (keyset) -----------------------------------------------
+
+FILTROS_LOG = ('ip', 'username', 'path', 'method', 'desde', 'hasta')
+
+
+def encode_cursor(timestamp, log_id):
+    """Cursor opaco a partir de la última fila devuelta: (timestamp, id)."""
+    raw = f"{timestamp.isoformat()}|{log_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Inverso de encode_cursor. Lanza ValueError si el cursor no es válido."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        ts, log_id = base64.urlsafe_b64decode(padded.encode()).decode().split('|', 1)
+        return datetime.fromisoformat(ts), int(log_id)
+    except Exception:
+        raise ValueError('cursor inválido')
+
+
+def parse_log_filters(args):
+    """Extrae los filtros de request.args. Lanza ValueError en fechas inválidas."""
+    filtros = {}
+    for key in FILTROS_LOG:
+        value = (args.get(key) or '').strip()
+        if not value:
+            continue
+        if key in ('desde', 'hasta'):
+            try:
+                value = datetime.fromisoformat(value)
+            except ValueError:
+                raise ValueError(f'{key} debe ser fecha ISO (YYYY-MM-DD[THH:MM:SS])')
+        elif key == 'method':
+            value = value.upper()
+        filtros[key] = value
+    return filtros
+
+
+def build_log_query(db, filtros, cursor=None):
+    """Query de AccessLog ordenada por (timestamp, id) DESC con filtros.
+
+    Cada filtro tiene un índice compuesto con timestamp (ver
+    migrations/access_logs_indexes.sql); `path` filtra por prefijo.
+    """
+    from models import AccessLog
+    q = AccessLog.query
+    if 'ip' in filtros:
+        q = q.filter(AccessLog.ip == filtros['ip'])
+    if 'username' in filtros:
+        q = q.filter(AccessLog.username == filtros['username'])
+    if 'path' in filtros:
+        q = q.filter(AccessLog.path.startswith(filtros['path'], autoescape=True))
+    if 'method' in filtros:
+        q = q.filter(AccessLog.method == filtros['method'])
+    if 'desde' in filtros:
+        q = q.filter(AccessLog.timestamp >= filtros['desde'])
+    if 'hasta' in filtros:
+        q = q.filter(AccessLog.timestamp < filtros['hasta'])
+    if cursor:
+        ts, log_id = decode_cursor(cursor)
+        q = q.filter(db.tuple_(AccessLog.timestamp, AccessLog.id) < db.tuple_(ts, log_id))
+    return q.order_by(AccessLog.timestamp.desc(), AccessLog.id.desc())
+
+
+def fetch_log_page(db, filtros, cursor=None, limit=50):
+    """Devuelve (logs, next_cursor). next_cursor es None en la última página."""
+    rows = build_log_query(db, filtros, cursor).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].timestamp, rows[-1].id)
+    return rows, next_cursor
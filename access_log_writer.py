@@ -0,0 +1,147 @@
+"""
+Escritor asíncrono por lotes para la tabla access_logs.
+
+Cada petición sólo encola un dict con los datos del acceso; un hilo en
+segundo plano los inserta en bloque (INSERT multi-fila) cada N registros o
+cada T milisegundos, lo que ocurra primero. Si la cola se llena, los
+registros se muestrean y finalmente se descartan para no frenar a los
+workers. Al apagar el worker (atexit / hook de gunicorn) se vacía la cola.
+"""
+import atexit
+import logging
+import os
+import queue
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class AccessLogWriter(object):
+    """Cola acotada + hilo de volcado para registros de acceso."""
+
+    def __init__(self, app=None, db=None, batch_size=200, flush_interval_ms=1000,
+                 max_queue=10000, sample_rate=0.1, high_watermark=0.75):
+        """
+        batch_size: registros máximos por INSERT.
+        flush_interval_ms: tiempo máximo que un registro espera en cola.
+        max_queue: tamaño de la cola; al llenarse se descartan registros.
+        sample_rate: fracción de registros aceptados cuando la cola supera
+            `high_watermark` (porcentaje de ocupación).
+        """
+        self.app = app
+        self.db = db
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval = max(0.01, flush_interval_ms / 1000.0)
+        self.max_queue = max(1, int(max_queue))
+        self.sample_rate = min(max(float(sample_rate), 0.0), 1.0)
+        self.high_watermark = int(self.max_queue * high_watermark)
+
+        self._queue = queue.Queue(maxsize=self.max_queue)
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._atexit_registered = False
+
+        self.stats = {'encolados': 0, 'escritos': 0, 'descartados': 0, 'muestreados': 0, 'errores': 0}
+
+    # ---- API pública -------------------------------------------------------
+
+    def submit(self, record):
+        """Encola un registro sin bloquear. Devuelve False si se descartó."""
+        self._ensure_started()
+
+        if self._queue.qsize() >= self.high_watermark and random.random() >= self.sample_rate:
+            self.stats['muestreados'] += 1
+            return False
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.stats['descartados'] += 1
+            return False
+        self.stats['encolados'] += 1
+        return True
+
+    def write_now(self, records):
+        """Inserta los registros de forma síncrona (modo testing / sync)."""
+        if records:
+            self._write_batch(list(records))
+
+    def flush(self):
+        """Vacía la cola en el hilo actual, en lotes de `batch_size`."""
+        while True:
+            batch = []
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not batch:
+                return
+            self._write_batch(batch)
+
+    def stop(self, timeout=5.0):
+        """Detiene el hilo y escribe lo pendiente. Es idempotente."""
+        self._stop.set()
+        thread = self._thread
+        if thread is not None and thread.is_alive() and self._pid == os.getpid():
+            thread.join(timeout)
+        self.flush()
+
+    # ---- Internos ------------------------------------------------------------
+
+    def _ensure_started(self):
+        # Tras un fork (gunicorn --preload) el hilo no existe en el hijo
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='access-log-writer', daemon=True)
+            self._thread.start()
+            if not self._atexit_registered:
+                atexit.register(self.stop)
+                self._atexit_registered = True
+
+    def _collect_batch(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+            if self._stop.is_set():
+                break
+        return batch
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._collect_batch()
+            if batch:
+                self._write_batch(batch)
+
+    def _write_batch(self, batch):
+        from models import AccessLog
+        with self.app.app_context():
+            try:
+                # executemany -> INSERT multi-fila (insertmanyvalues en psycopg2)
+                self.db.session.execute(AccessLog.__table__.insert(), batch)
+                self.db.session.commit()
+                self.stats['escritos'] += len(batch)
+            except Exception as e:
+                self.stats['errores'] += len(batch)
+                try:
+                    self.db.session.rollback()
+                except Exception:
+                    pass
+                logger.error(f"[ACCESS_LOG] Error escribiendo lote de {len(batch)} registros: {e}")
+            finally:
+                self.db.session.remove()
@@ -3,7 +3,7 @@
 Run with: python assign_permissions.py
 """
 from models import db, Role, Permission, Usuario
-from app import app
+from app import app, permission_index
 
 with app.app_context():
     # Create permissions
@@ -47,6 +47,8 @@ with app.app_context():
                                 Permission.query.filter_by(module='tickets', action='edit').first(),
                                 Permission.query.filter_by(module='tickets', action='export').first()]
 
+    # Avisar a los workers en marcha de que la matriz de permisos cambió
+    permission_index.invalidate()
     db.session.commit()
 
     # Assign support role to known engineer users (if exist)
@@ -0,0 +1,93 @@
+"""
+Contadores de versión compartidos entre workers (tabla cache_versions).
+
+Cada familia de datos cacheada en memoria tiene un nombre ('permisos',
+'productos', ...). Quien modifica esos datos incrementa su versión dentro de
+la misma transacción; los workers comparan get_version() con la versión que
+tienen cargada y recargan sólo cuando cambia.
+
+track_changes() incrementa la versión automáticamente en cada flush que
+inserte, modifique o borre instancias de los modelos indicados. Las
+operaciones masivas (query.update(), bulk_*) no pasan por el flush y deben
+llamar a bump_version() ellas mismas.
+"""
+from datetime import datetime
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from models import CacheVersion
+
+
+def _bump_statement(dialect_name, nombre):
+    tabla = CacheVersion.__table__
+    now = datetime.utcnow()
+    if dialect_name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect_name == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        return None
+    stmt = insert(tabla).values(nombre=nombre, version=1, fecha_actualizacion=now)
+    return stmt.on_conflict_do_update(
+        index_elements=[tabla.c.nombre],
+        set_={'version': tabla.c.version + 1, 'fecha_actualizacion': now}
+    )
+
+
+def _bump(connection, nombre):
+    stmt = _bump_statement(connection.dialect.name, nombre)
+    if stmt is not None:
+        connection.execute(stmt)
+        return
+    tabla = CacheVersion.__table__
+    result = connection.execute(
+        tabla.update().where(tabla.c.nombre == nombre)
+        .values(version=tabla.c.version + 1, fecha_actualizacion=datetime.utcnow())
+    )
+    if not result.rowcount:
+        connection.execute(tabla.insert().values(nombre=nombre, version=1, fecha_actualizacion=datetime.utcnow()))
+
+
+def get_version(db, nombre):
+    """Versión actual de `nombre` (0 si nunca se ha incrementado)."""
+    version = db.session.query(CacheVersion.version).filter_by(nombre=nombre).scalar()
+    return version or 0
+
+
+def get_versions(db, nombres):
+    """{nombre: (versión, fecha_actualizacion)} en una consulta; (0, None) si no existe."""
+    filas = db.session.query(CacheVersion.nombre, CacheVersion.version, CacheVersion.fecha_actualizacion) \
+        .filter(CacheVersion.nombre.in_(nombres)).all()
+    versiones = {nombre: (0, None) for nombre in nombres}
+    versiones.update((nombre, (version, fecha)) for nombre, version, fecha in filas)
+    return versiones
+
+
+def bump_version(db, nombre):
+    """Incrementa la versión de `nombre` en la transacción en curso (sin commit)."""
+    _bump(db.session.connection(), nombre)
+
+
+def track_changes(nombre, models, on_change=None):
+    """Incrementa `nombre` en cada flush que toque alguno de `models`.
+
+    on_change (opcional) se llama en el propio worker para invalidar su
+    caché sin esperar a la siguiente comprobación de versión.
+    """
+    models = tuple(models)
+
+    def _after_flush(session, flush_context):
+        # En after_flush new/dirty/deleted (y el historial de atributos) aún reflejan
+        # lo que se acaba de escribir. dirty incluye asignaciones sin cambio real
+        # (p. ej. p.precio = p.precio): esas no invalidan nada
+        cambiados = [o for o in session.dirty if isinstance(o, models) and session.is_modified(o)]
+        for obj in list(session.new) + cambiados + list(session.deleted):
+            if isinstance(obj, models):
+                _bump(session.connection(), nombre)
+                if on_change is not None:
+                    on_change()
+                return
+
+    event.listen(Session, 'after_flush', _after_flush)
+    return _after_flush
@@ -0,0 +1,228 @@
+"""
+Estadísticas del catálogo para /api/estadisticas.
+
+Los agregados por categoría (nº de productos, suma de precios, valor de
+inventario, stock y productos con stock bajo) viven en la tabla
+estadisticas_categoria y se actualizan de forma incremental en cada flush
+que inserte, modifique o borre productos, dentro de la misma transacción.
+Leer las estadísticas cuesta una consulta sobre esa tabla (una fila por
+categoría) más dos búsquedas por el índice de precio (más caro / más
+barato), en lugar de seis agregados sobre toda la tabla productos.
+
+Cada worker guarda además el resultado en memoria durante `ttl` segundos
+y lo recalcula sólo si cambió la versión 'productos' de cache_versions; esa
+versión es también el ETag de la respuesta.
+
+Las operaciones masivas (query.update(), bulk_*) no pasan por el flush y
+deben llamar a rebuild() al terminar.
+"""
+import logging
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import case, event, func, inspect
+from sqlalchemy.orm import Session
+
+from cache_versions import bump_version, get_version
+from models import EstadisticaCategoria, Producto
+from serializers import PRODUCTO
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = 'productos'
+# Mismo umbral que /api/productos/bajo-stock
+STOCK_BAJO = 5
+
+_COLUMNAS = ('productos', 'suma_precio', 'valor_inventario', 'stock', 'bajo_stock')
+
+
+def _aporte(precio, cantidad):
+    """Lo que suma un producto a los agregados de su categoría."""
+    precio = precio or 0
+    cantidad = cantidad or 0
+    return (1, precio, precio * cantidad, cantidad, 1 if cantidad < STOCK_BAJO else 0)
+
+
+def _valor_anterior(state, attr):
+    history = state.attrs[attr].history
+    if history.deleted:
+        return history.deleted[0]
+    if history.unchanged:
+        return history.unchanged[0]
+    return getattr(state.obj(), attr)
+
+
+def _anterior(state):
+    categoria = _valor_anterior(state, 'categoria')
+    return categoria or '', _aporte(_valor_anterior(state, 'precio'), _valor_anterior(state, 'cantidad'))
+
+
+def _actual(obj):
+    return obj.categoria or '', _aporte(obj.precio, obj.cantidad)
+
+
+def _sumar(deltas, categoria, aporte, signo):
+    actual = deltas.get(categoria, (0, 0.0, 0.0, 0, 0))
+    deltas[categoria] = tuple(a + signo * b for a, b in zip(actual, aporte))
+
+
+def compute_deltas(session):
+    """Cambios por categoría de los productos pendientes de flush."""
+    deltas = {}
+    for obj in session.new:
+        if isinstance(obj, Producto):
+            _sumar(deltas, *_actual(obj), 1)
+    for obj in session.deleted:
+        if isinstance(obj, Producto):
+            _sumar(deltas, *_anterior(inspect(obj)), -1)
+    for obj in session.dirty:
+        if not isinstance(obj, Producto) or obj in session.deleted:
+            continue
+        state = inspect(obj)
+        antes, despues = _anterior(state), _actual(obj)
+        if antes != despues:
+            _sumar(deltas, *antes, -1)
+            _sumar(deltas, *despues, 1)
+    return {cat: d for cat, d in deltas.items() if any(d)}
+
+
+def _upsert_statement(dialect_name, categoria, delta):
+    tabla = EstadisticaCategoria.__table__
+    if dialect_name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect_name == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        return None
+    now = datetime.utcnow()
+    stmt = insert(tabla).values(categoria=categoria, fecha_actualizacion=now, **dict(zip(_COLUMNAS, delta)))
+    set_ = {col: tabla.c[col] + stmt.excluded[col] for col in _COLUMNAS}
+    set_['fecha_actualizacion'] = now
+    return stmt.on_conflict_do_update(index_elements=[tabla.c.categoria], set_=set_)
+
+
+def apply_deltas(connection, deltas):
+    tabla = EstadisticaCategoria.__table__
+    for categoria, delta in deltas.items():
+        stmt = _upsert_statement(connection.dialect.name, categoria, delta)
+        if stmt is not None:
+            connection.execute(stmt)
+            continue
+        valores = {col: tabla.c[col] + d for col, d in zip(_COLUMNAS, delta)}
+        result = connection.execute(
+            tabla.update().where(tabla.c.categoria == categoria)
+            .values(fecha_actualizacion=datetime.utcnow(), **valores)
+        )
+        if not result.rowcount:
+            connection.execute(tabla.insert().values(
+                categoria=categoria, fecha_actualizacion=datetime.utcnow(), **dict(zip(_COLUMNAS, delta))
+            ))
+    # Categorías que se han quedado sin productos
+    connection.execute(tabla.delete().where(tabla.c.productos <= 0))
+
+
+def track_product_stats():
+    """Mantiene estadisticas_categoria en cada flush que toque productos."""
+
+    def _before_flush(session, flush_context, instances):
+        deltas = compute_deltas(session)
+        if deltas:
+            apply_deltas(session.connection(), deltas)
+
+    def _set(target, value, oldvalue, initiator):
+        return value
+
+    # active_history: al asignar un atributo no cargado se lee antes su valor
+    # anterior, para poder restarlo de los agregados
+    for attr in ('categoria', 'precio', 'cantidad'):
+        event.listen(getattr(Producto, attr), 'set', _set, active_history=True, retval=True)
+    event.listen(Session, 'before_flush', _before_flush)
+    return _before_flush
+
+
+def rebuild(db):
+    """Recalcula estadisticas_categoria desde productos (sin commit)."""
+    tabla = EstadisticaCategoria.__table__
+    categoria = func.coalesce(Producto.categoria, '')
+    cantidad = func.coalesce(Producto.cantidad, 0)
+    filas = db.session.query(
+        categoria,
+        func.count(Producto.id),
+        func.coalesce(func.sum(Producto.precio), 0),
+        func.coalesce(func.sum(Producto.precio * cantidad), 0),
+        func.coalesce(func.sum(cantidad), 0),
+        func.coalesce(func.sum(case((cantidad < STOCK_BAJO, 1), else_=0)), 0),
+    ).group_by(categoria).all()
+    connection = db.session.connection()
+    connection.execute(tabla.delete())
+    now = datetime.utcnow()
+    if filas:
+        connection.execute(tabla.insert(), [
+            dict(zip(('categoria',) + _COLUMNAS, fila), fecha_actualizacion=now) for fila in filas
+        ])
+    bump_version(db, VERSION_KEY)
+    logger.info(f"[ESTADISTICAS] Agregados recalculados ({len(filas)} categorías)")
+    return len(filas)
+
+
+class CatalogStats(object):
+    """Resultado de /api/estadisticas cacheado por worker."""
+
+    def __init__(self, db, ttl=5.0):
+        self.db = db
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._version = None
+        self._payload = None
+        self._expires = 0.0
+
+    def mark_stale(self):
+        """Fuerza comprobar la versión en la próxima lectura."""
+        self._expires = 0.0
+
+    def reset(self):
+        with self._lock:
+            self._version = None
+            self._payload = None
+            self._expires = 0.0
+
+    def snapshot(self):
+        """(versión, estadísticas) vigentes."""
+        now = time.monotonic()
+        with self._lock:
+            if self._payload is not None and now < self._expires:
+                return self._version, self._payload
+        version = get_version(self.db, VERSION_KEY)
+        with self._lock:
+            if self._payload is None or version != self._version:
+                self._payload = self._compute()
+                self._version = version
+            self._expires = now + self.ttl
+            return self._version, self._payload
+
+    def _extremo(self, orden):
+        fila = PRODUCTO.prepare(self.db.session.query(Producto)).order_by(orden, Producto.id).first()
+        return PRODUCTO.dump(fila) if fila else None
+
+    def _compute(self):
+        categorias = EstadisticaCategoria.query.filter(EstadisticaCategoria.productos > 0) \
+            .order_by(EstadisticaCategoria.categoria).all()
+        total = sum(c.productos for c in categorias)
+        return {
+            'total_productos': total,
+            'valor_total_inventario': float(sum(c.valor_inventario for c in categorias)),
+            'stock_total': sum(c.stock for c in categorias),
+            'productos_bajo_stock': sum(c.bajo_stock for c in categorias),
+            'categorias': [
+                {
+                    'categoria': c.categoria or 'Sin categoría',
+                    'cantidad': c.productos,
+                    'precio_promedio': c.suma_precio / c.productos,
+                }
+                for c in categorias
+            ],
+            'productos_por_categoria': {c.categoria or 'Sin categoría': c.productos for c in categorias},
+            'producto_mas_caro': self._extremo(Producto.precio.desc()) if total else None,
+            'producto_mas_barato': self._extremo(Producto.precio.asc()) if total else None,
+        }
@@ -1,4 +1,5 @@
 from app import app, db, Usuario
+from catalog_stats import rebuild as rebuild_estadisticas
 
 if __name__ == '__main__':
     with app.app_context():
@@ -19,4 +20,7 @@ if __name__ == '__main__':
         except Exception as e:
             db.session.rollback()
             print(f"ℹ Usuario admin ya existe o error: {e}")
+        # Agregados de /api/estadisticas a partir de los productos existentes
+        rebuild_estadisticas(db)
+        db.session.commit()
         print('DB inicializada correctamente')
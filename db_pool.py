@@ -0,0 +1,168 @@
+"""
+Configuración e instrumentación del pool de conexiones de SQLAlchemy.
+
+engine_options_from_env() genera SQLALCHEMY_ENGINE_OPTIONS a partir de
+variables de entorno. Con gunicorn cada worker tiene su propio pool, así que
+el máximo de conexiones es  workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW),
+que debe quedar por debajo de `max_connections` de PostgreSQL.
+
+DB_POOL_MODE=pgbouncer desactiva el pool local (NullPool) y los prepared
+statements, para trabajar detrás de PgBouncer en modo transaction.
+
+PoolStats cuenta checkouts, conexiones nuevas, invalidaciones, esperas y
+timeouts del pool del proceso actual (ver /internal/pool).
+"""
+import os
+import threading
+import time
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import NullPool, QueuePool
+
+
+def _env_bool(name, default):
+    return os.getenv(name, default).lower() in ('1', 'true', 'yes', 'on')
+
+
+class PoolStats(object):
+    """Contadores del pool del worker actual."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.pid = os.getpid()
+        self.connects = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.invalidations = 0
+        self.timeouts = 0
+        self.waits = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def _check_pid(self):
+        # Tras un fork el worker hereda los contadores del maestro
+        if self.pid != os.getpid():
+            self.reset()
+
+    def record_wait(self, seconds):
+        with self._lock:
+            self._check_pid()
+            self.waits += 1
+            self.wait_total += seconds
+            if seconds > self.wait_max:
+                self.wait_max = seconds
+
+    def incr(self, name):
+        with self._lock:
+            self._check_pid()
+            setattr(self, name, getattr(self, name) + 1)
+
+    def to_dict(self):
+        with self._lock:
+            self._check_pid()
+            return {
+                'pid': self.pid,
+                'connects': self.connects,
+                'checkouts': self.checkouts,
+                'checkins': self.checkins,
+                'invalidations': self.invalidations,
+                'timeouts': self.timeouts,
+                'wait_avg_ms': round(self.wait_total / self.waits * 1000, 3) if self.waits else 0.0,
+                'wait_max_ms': round(self.wait_max * 1000, 3),
+            }
+
+
+pool_stats = PoolStats()
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool que mide cuánto espera cada checkout por una conexión libre."""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            pool_stats.incr('timeouts')
+            raise
+        finally:
+            pool_stats.record_wait(time.perf_counter() - start)
+
+
+def engine_options_from_env(database_url):
+    """Opciones de create_engine según DB_POOL_* (sólo para PostgreSQL).
+
+    Para SQLite se devuelve {} y Flask-SQLAlchemy elige su propio pool.
+    """
+    if not database_url.startswith('postgresql'):
+        return {}
+
+    mode = os.getenv('DB_POOL_MODE', 'pool').lower()
+    connect_args = {'connect_timeout': int(os.getenv('DB_CONNECT_TIMEOUT', '10'))}
+
+    if mode == 'pgbouncer':
+        # PgBouncer (transaction pooling) ya reparte las conexiones: no
+        # guardar conexiones en el worker ni usar prepared statements, que
+        # no sobreviven a un cambio de conexión de servidor.
+        if database_url.startswith('postgresql+psycopg:'):
+            connect_args['prepare_threshold'] = None
+        return {
+            'poolclass': NullPool,
+            'pool_pre_ping': False,
+            'connect_args': connect_args,
+        }
+
+    statement_timeout = os.getenv('DB_STATEMENT_TIMEOUT_MS')
+    if statement_timeout:
+        connect_args['options'] = f'-c statement_timeout={int(statement_timeout)}'
+
+    return {
+        'poolclass': InstrumentedQueuePool,
+        'pool_size': int(os.getenv('DB_POOL_SIZE', '5')),
+        'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', '10')),
+        'pool_timeout': int(os.getenv('DB_POOL_TIMEOUT', '30')),
+        'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', '1800')),
+        'pool_pre_ping': _env_bool('DB_POOL_PRE_PING', 'true'),
+        'pool_use_lifo': _env_bool('DB_POOL_USE_LIFO', 'true'),
+        'connect_args': connect_args,
+    }
+
+
+def instrument_engine(engine):
+    """Registra los eventos del pool que alimentan pool_stats."""
+    if getattr(engine, '_pool_instrumented', False):
+        return
+    engine._pool_instrumented = True
+
+    @event.listens_for(engine, 'connect')
+    def _on_connect(dbapi_conn, conn_record):
+        pool_stats.incr('connects')
+
+    @event.listens_for(engine, 'checkout')
+    def _on_checkout(dbapi_conn, conn_record, conn_proxy):
+        pool_stats.incr('checkouts')
+
+    @event.listens_for(engine, 'checkin')
+    def _on_checkin(dbapi_conn, conn_record):
+        pool_stats.incr('checkins')
+
+    @event.listens_for(engine, 'invalidate')
+    def _on_invalidate(dbapi_conn, conn_record, exception):
+        pool_stats.incr('invalidations')
+
+
+def pool_status(engine):
+    """Estado actual del pool + contadores acumulados del worker."""
+    pool = engine.pool
+    data = {'pool': type(pool).__name__}
+    for name in ('size', 'checkedin', 'checkedout', 'overflow'):
+        fn = getattr(pool, name, None)
+        if callable(fn):
+            data[name] = fn()
+    data['max_overflow'] = getattr(pool, '_max_overflow', None)
+    data['timeout'] = getattr(pool, '_timeout', None)
+    data.update(pool_stats.to_dict())
+    return data
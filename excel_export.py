@@ -0,0 +1,71 @@
+"""
+Exportación del catálogo a XLSX con imágenes incrustadas.
+
+Descargar y redimensionar cientos de imágenes tarda minutos, así que no se
+hace dentro de la petición: POST /api/productos/exportar-excel encola un
+trabajo 'exportar_excel' (jobs.py), exportar_catalogo() lo ejecuta en un hilo
+de trabajos informando del progreso por producto y el fichero resultante se
+descarga desde /api/jobs/<id>/descargar.
+"""
+import logging
+import os
+
+from models import Producto
+from streaming_export import BATCH_SIZE
+from xlsx_writer import XlsxWriter
+
+logger = logging.getLogger(__name__)
+
+TIPO = 'exportar_excel'
+FILENAME = 'catalogo_productos.xlsx'
+
+HEADERS = ['ID', 'Nombre', 'Descripción', 'Categoría', 'Precio', 'Stock', 'Imagen', 'Fecha Creación']
+COLUMN_WIDTHS = [8, 25, 35, 15, 12, 10, 20, 18]
+# Miniatura de 200 px (thumbnails.SIZES) para que quepan en Excel; se muestran a 150x150
+THUMBNAIL_SIZE = 200
+IMAGE_CELL_SIZE = 150
+IMAGE_ROW_HEIGHT = 120
+
+
+def exportar_catalogo(ctx, pipeline):
+    """Handler del trabajo: escribe el XLSX en ctx.output_path().
+
+    Las imágenes se obtienen y redimensionan en paralelo con `pipeline`
+    (image_pipeline.ImagePipeline), reutilizando las miniaturas cacheadas, y
+    llegan en el orden de los productos. Los productos se leen por lotes y
+    el libro se escribe en modo write_only (xlsx_writer), así que la memoria
+    no crece con el tamaño del catálogo.
+    """
+    total = Producto.query.count()
+    ctx.progress(0, total, 'Generando Excel', force=True)
+
+    columnas = (Producto.id, Producto.nombre, Producto.descripcion, Producto.categoria, Producto.precio,
+                Producto.cantidad, Producto.imagen_url, Producto.fecha_creacion)
+    productos = Producto.query.with_entities(*columnas).order_by(Producto.id).yield_per(BATCH_SIZE)
+
+    path = ctx.output_path(FILENAME)
+    writer = XlsxWriter('Catálogo', HEADERS, COLUMN_WIDTHS, tmp_dir=os.path.dirname(path))
+    sin_imagen = 0
+    with writer:
+        filas = pipeline.imap(productos, lambda p: p.imagen_url, THUMBNAIL_SIZE)
+        for n, (p, png, error) in enumerate(filas, start=1):
+            if not p.imagen_url:
+                imagen = 'Sin imagen'
+            elif error is not None:
+                # Si falla la descarga, dejar la URL como texto
+                imagen = p.imagen_url
+                sin_imagen += 1
+                logger.warning(f"[EXPORT] No se pudo insertar imagen de {p.nombre}: {error}")
+            else:
+                imagen = None
+            fila = writer.append([
+                p.id, p.nombre, p.descripcion or '', p.categoria or '', p.precio, p.cantidad, imagen,
+                p.fecha_creacion.isoformat() if p.fecha_creacion else ''
+            ], height=IMAGE_ROW_HEIGHT if png is not None else None)
+            if png is not None:
+                writer.add_image(png, f'G{fila}', IMAGE_CELL_SIZE, IMAGE_CELL_SIZE)
+            ctx.progress(n, total)
+
+        ctx.progress(total, total, 'Guardando fichero', force=True)
+        writer.save(path)
+    return {'productos': total, 'imagenes_fallidas': sin_imagen}
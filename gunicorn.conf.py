@@ -0,0 +1,41 @@
+"""
+Configuración de Gunicorn.
+
+Gunicorn carga este archivo automáticamente desde el directorio de trabajo
+(o con `-c gunicorn.conf.py`). Los parámetros de línea de comando (-w, -b)
+siguen teniendo prioridad.
+"""
+import os
+import shutil
+
+
+def on_starting(server):
+    """Limpia los ficheros de métricas de una ejecución anterior (modo multiproceso)."""
+    path = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+    if path:
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path, exist_ok=True)
+
+
+def worker_exit(server, worker):
+    """Vacía la cola de access_logs y para los hilos de trabajos antes de que el worker termine."""
+    try:
+        from app import access_log_writer
+        access_log_writer.stop()
+    except Exception as e:
+        server.log.warning(f"No se pudo vaciar access_log_writer: {e}")
+    try:
+        from app import image_pipeline, job_queue
+        job_queue.stop()
+        image_pipeline.shutdown()
+    except Exception as e:
+        server.log.warning(f"No se pudieron parar los hilos de trabajos: {e}")
+
+
+def child_exit(server, worker):
+    """Descarta las métricas 'live' (peticiones en curso) del worker que terminó."""
+    try:
+        from metrics import mark_process_dead
+        mark_process_dead(worker.pid)
+    except Exception as e:
+        server.log.warning(f"No se pudieron limpiar las métricas del worker {worker.pid}: {e}")
@@ -0,0 +1,80 @@
+"""
+Validadores HTTP (ETag / Last-Modified) para endpoints JSON de lectura.
+
+Cada endpoint declara de qué familias de datos depende ('productos',
+'proveedores', ...). El ETag se construye con sus contadores de
+cache_versions, que track_changes() incrementa en cada flush que toque los
+modelos de la familia, y Last-Modified con la fecha del último incremento.
+Obtenerlos cuesta una consulta por clave primaria, así que una petición
+condicional que no ha cambiado se responde con 304 antes de ejecutar la
+consulta y la serialización del endpoint.
+
+Cache-Control:
+- public=True: `public, max-age=<public_max_age>` (HTTP_CACHE_PUBLIC_MAX_AGE), para que nginx
+  (proxy_cache en /public/) y los navegadores reutilicen la respuesta unos
+  segundos y después revaliden.
+- resto: `private, no-cache` (el navegador guarda la copia pero revalida
+  siempre).
+"""
+import os
+from datetime import timezone
+from functools import wraps
+
+from flask import make_response, request
+
+from cache_versions import get_versions
+
+
+def _validadores(db, familias):
+    versiones = get_versions(db, familias)
+    etag = '-'.join(f'{nombre}.{versiones[nombre][0]}' for nombre in familias)
+    fechas = [fecha for _, fecha in versiones.values() if fecha is not None]
+    last_modified = max(fechas).replace(microsecond=0, tzinfo=timezone.utc) if fechas else None
+    return etag, last_modified
+
+
+def _no_modificado(etag, last_modified):
+    # Si llega If-None-Match, If-Modified-Since se ignora (RFC 9110 13.2.2)
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if last_modified is not None and request.if_modified_since is not None:
+        return last_modified <= request.if_modified_since
+    return False
+
+
+class HttpCache(object):
+    """Fábrica del decorador conditional() ligado a la BD de la app."""
+
+    def __init__(self, db, public_max_age=10):
+        self.db = db
+        self.public_max_age = public_max_age
+
+    @classmethod
+    def from_env(cls, db):
+        return cls(db, public_max_age=int(os.getenv('HTTP_CACHE_PUBLIC_MAX_AGE', '10')))
+
+    def conditional(self, *familias, public=False):
+        """ETag/Last-Modified por familias y 304 sin ejecutar la vista.
+
+        Aplicarlo debajo de @login_required para que la autenticación se
+        compruebe antes.
+        """
+        cache_control = f'public, max-age={self.public_max_age}' if public else 'private, no-cache'
+
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                etag, last_modified = _validadores(self.db, familias)
+                if _no_modificado(etag, last_modified):
+                    response = make_response('', 304)
+                else:
+                    response = make_response(view(*args, **kwargs))
+                    if response.status_code != 200:
+                        return response
+                response.set_etag(etag, weak=True)
+                if last_modified is not None:
+                    response.last_modified = last_modified
+                response.headers['Cache-Control'] = cache_control
+                return response
+            return wrapper
+        return decorator
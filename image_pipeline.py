@@ -0,0 +1,219 @@
+"""
+Obtención y redimensionado de imágenes de producto en paralelo.
+
+Pensado para la exportación a XLSX (excel_export.py), que antes descargaba,
+decodificaba y redimensionaba cada imagen de una en una:
+
+- fetch: un pool de hilos descarga las URLs remotas (requests.Session con
+  pool de conexiones) o lee los ficheros locales de upload_folder.
+- resize: la miniatura (thumbnails.render_thumbnail) se hace en un pool de procesos (contexto
+  'spawn', seguro desde los hilos de un worker de gunicorn), repartiendo
+  el trabajo de CPU entre núcleos. Con processes=0 se hace en el propio hilo.
+- imap() devuelve los resultados en el mismo orden de entrada con como
+  máximo `window` imágenes en vuelo, así que la memoria está acotada y el
+  writer del libro puede ir escribiendo filas mientras llegan.
+
+Con `thumbnails` (thumbnails.ThumbnailCache) las miniaturas ya generadas se
+leen de disco y las nuevas se guardan allí, de modo que una exportación
+repetida no vuelve a descargar ni a redimensionar nada.
+
+Cada imagen tiene un plazo total de `timeout` segundos (descarga +
+redimensionado) contado desde que un hilo empieza a procesarla, no desde que
+se encola: las que esperan detrás de descargas lentas no caducan sin haberse
+intentado. El plazo lo aplica el propio hilo (cada lectura de la descarga
+usa el tiempo restante), así que un hilo nunca queda ocupado más allá de él.
+Con un tamaño máximo de `max_bytes`; si se supera, o falla, se devuelve la
+excepción en lugar de los bytes y la exportación sigue.
+
+Los pools se crean al primer uso y se reutilizan entre exportaciones del
+mismo worker.
+"""
+import atexit
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from io import BytesIO
+
+from thumbnails import render_thumbnail
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+
+class ImageTimeout(Exception):
+    pass
+
+
+class ImagePipeline(object):
+    """Descarga (hilos) + redimensionado (procesos) con resultados en orden."""
+
+    def __init__(self, upload_folder, threads=8, processes=2, window=32, timeout=10.0,
+                 max_bytes=20 * 1024 * 1024, thumbnails=None):
+        self.upload_folder = upload_folder
+        self.thumbnails = thumbnails
+        self.threads = max(1, int(threads))
+        self.processes = max(0, int(processes))
+        self.window = max(1, int(window))
+        self.timeout = float(timeout)
+        self.max_bytes = int(max_bytes)
+
+        self._lock = threading.Lock()
+        self._thread_pool = None
+        self._process_pool = None
+        self._session = None
+        self._pid = None
+
+    @classmethod
+    def from_env(cls, upload_folder, thumbnails=None):
+        return cls(
+            upload_folder,
+            thumbnails=thumbnails,
+            threads=int(os.getenv('EXPORT_IMAGE_THREADS', '8')),
+            processes=int(os.getenv('EXPORT_IMAGE_PROCESSES', str(min(4, os.cpu_count() or 1)))),
+            window=int(os.getenv('EXPORT_IMAGE_WINDOW', '32')),
+            timeout=float(os.getenv('EXPORT_IMAGE_TIMEOUT', '10')),
+            max_bytes=int(os.getenv('EXPORT_IMAGE_MAX_MB', '20')) * 1024 * 1024
+        )
+
+    # ---- API pública -------------------------------------------------------
+
+    def imap(self, items, url_of, size, fmt='png'):
+        """Genera (item, miniatura, error) en el orden de `items`.
+
+        url_of(item) devuelve la imagen del item (URL o nombre de fichero
+        local) o None; en ese caso miniatura y error son None. size es el
+        lado máximo en px (uno de thumbnails.SIZES si se cachea).
+        """
+        self._ensure_pools()
+        pendientes = deque()
+        for item in items:
+            url = url_of(item)
+            future = self._thread_pool.submit(self._process, url, size, fmt) if url else None
+            pendientes.append((item, future))
+            if len(pendientes) >= self.window:
+                yield self._result(*pendientes.popleft())
+        while pendientes:
+            yield self._result(*pendientes.popleft())
+
+    def shutdown(self):
+        with self._lock:
+            if self._thread_pool is not None:
+                self._thread_pool.shutdown(wait=False, cancel_futures=True)
+            if self._process_pool is not None:
+                self._process_pool.shutdown(wait=False, cancel_futures=True)
+            if self._session is not None:
+                self._session.close()
+            self._thread_pool = self._process_pool = self._session = None
+
+    # ---- Internos ----------------------------------------------------------------
+
+    def _ensure_pools(self):
+        if self._thread_pool is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread_pool is not None and self._pid == os.getpid():
+                return
+            import requests
+
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=self.threads, pool_maxsize=self.threads)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            self._session = session
+            self._thread_pool = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='image-fetch')
+            self._process_pool = ProcessPoolExecutor(
+                max_workers=self.processes, mp_context=multiprocessing.get_context('spawn')
+            ) if self.processes else None
+            if self._pid is None:
+                atexit.register(self.shutdown)
+            self._pid = os.getpid()
+
+    def _result(self, item, future):
+        # Sin plazo aquí: _process lo aplica desde que empieza (ver docstring del módulo)
+        if future is None:
+            return item, None, None
+        try:
+            return item, future.result(), None
+        except Exception as e:
+            return item, None, e
+
+    def _process(self, url, size, fmt):
+        deadline = time.monotonic() + self.timeout
+        cache = self.thumbnails
+        remota = url.startswith('http')
+        if remota:
+            digest = cache.remote_digest(url) if cache else None
+        else:
+            # Ruta local (relativa a upload_folder)
+            path = os.path.join(self.upload_folder, os.path.basename(url))
+            if not os.path.exists(path):
+                return None
+            if os.path.getsize(path) > self.max_bytes:
+                raise ValueError('Imagen demasiado grande')
+            digest = cache.file_digest(path) if cache else None
+
+        cached = self._cached(digest, size, fmt)
+        if cached is not None:
+            return cached
+        if remota:
+            data = self._download(url, deadline)
+            if cache:
+                digest = cache.digest(data)
+                cache.remember_remote(url, digest)
+                # La URL pudo caducar pero su contenido seguir igual
+                cached = self._cached(digest, size, fmt)
+                if cached is not None:
+                    return cached
+        else:
+            with open(path, 'rb') as f:
+                data = f.read()
+
+        if self._process_pool is None:
+            thumb = render_thumbnail(data, size, fmt)
+        else:
+            future = self._process_pool.submit(render_thumbnail, data, size, fmt)
+            try:
+                thumb = future.result(timeout=self._remaining(deadline))
+            except FutureTimeout:
+                future.cancel()
+                raise ImageTimeout(f'Sin respuesta en {self.timeout:.0f}s')
+        if cache:
+            cache.store(digest, size, fmt, thumb)
+        return thumb
+
+    def _cached(self, digest, size, fmt):
+        path = self.thumbnails.lookup(digest, size, fmt) if digest else None
+        if path is None:
+            return None
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except OSError:
+            # Expulsada entre lookup() y la lectura
+            return None
+
+    def _remaining(self, deadline):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise ImageTimeout(f'Sin respuesta en {self.timeout:.0f}s')
+        return remaining
+
+    def _download(self, url, deadline):
+        # El timeout de requests (lo que queda del plazo) acota la conexión y cada
+        # lectura; el plazo total se vuelve a comprobar por bloque
+        with self._session.get(url, timeout=self._remaining(deadline), stream=True) as response:
+            response.raise_for_status()
+            buffer = BytesIO()
+            for chunk in response.iter_content(CHUNK_SIZE):
+                buffer.write(chunk)
+                if buffer.tell() > self.max_bytes:
+                    raise ValueError('Imagen demasiado grande')
+                if time.monotonic() > deadline:
+                    raise ImageTimeout(f'Descarga de más de {self.timeout:.0f}s')
+            return buffer.getvalue()
@@ -0,0 +1,343 @@
+"""
+Trabajos en segundo plano sobre una tabla de la propia BD (sin broker).
+
+- enqueue() inserta una fila 'pendiente' en `jobs` y devuelve su id; la
+  petición HTTP responde enseguida (202) y el cliente consulta el progreso.
+- Cada worker de gunicorn arranca `JOBS_WORKERS` hilos que reclaman trabajos
+  de forma atómica (UPDATE ... WHERE estado = 'pendiente'; en PostgreSQL el
+  candidato se elige con FOR UPDATE SKIP LOCKED) y ejecutan el handler
+  registrado para su tipo. Con JOBS_WORKERS=0 no se arrancan hilos y los
+  trabajos los procesa `python run_jobs.py` en otro proceso/contenedor.
+- El handler informa del progreso con ctx.progress(), que también renueva el
+  heartbeat. Un trabajo 'en_curso' sin heartbeat durante `stale_after`
+  segundos (worker caído o reiniciado) vuelve a 'pendiente' hasta
+  `max_intentos` veces; el handler recibe el último ctx.checkpoint guardado
+  para continuar desde ahí.
+- Los ficheros generados se guardan en JOBS_DIR/<id>/ y se descargan desde
+  disco; los trabajos terminados se borran (fila y ficheros) pasadas
+  `retention_hours` horas.
+"""
+import atexit
+import json
+import logging
+import os
+import shutil
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select
+
+from models import Job
+
+logger = logging.getLogger(__name__)
+
+ESTADOS_FINALES = ('completado', 'error')
+
+
+class JobContext(object):
+    """Lo que recibe un handler: parámetros, progreso, checkpoint y ficheros."""
+
+    # Mínimo entre dos escrituras de progreso (la última siempre se escribe)
+    PROGRESS_INTERVAL = 0.5
+
+    def __init__(self, queue, job):
+        self.queue = queue
+        self.job_id = job.id
+        self.tipo = job.tipo
+        self.usuario = job.usuario
+        self.params = json.loads(job.params) if job.params else {}
+        self.checkpoint = json.loads(job.checkpoint) if job.checkpoint else None
+        self.archivo = None
+        self.archivo_nombre = None
+        self._last_progress = 0.0
+
+    def progress(self, procesados, total=None, mensaje=None, force=False):
+        """Actualiza el progreso y el heartbeat (en su propia transacción)."""
+        now = time.monotonic()
+        if not force and now - self._last_progress < self.PROGRESS_INTERVAL and procesados != total:
+            return
+        self._last_progress = now
+        values = {'procesados': procesados, 'heartbeat': datetime.utcnow()}
+        if total is not None:
+            values['total'] = total
+        if mensaje is not None:
+            values['mensaje'] = mensaje[:500]
+        self.queue._update(self.job_id, **values)
+
+    def save_checkpoint(self, data, procesados=None):
+        """Guarda el checkpoint en la transacción de la sesión.
+
+        Llamarlo justo antes del commit del bloque de trabajo al que
+        corresponde: si el commit falla, el checkpoint tampoco se guarda.
+        """
+        tabla = Job.__table__
+        values = {'checkpoint': json.dumps(data), 'heartbeat': datetime.utcnow()}
+        if procesados is not None:
+            values['procesados'] = procesados
+        self.queue.db.session.execute(tabla.update().where(tabla.c.id == self.job_id).values(**values))
+        self.checkpoint = data
+
+    def output_path(self, filename, download_name=None):
+        """Ruta (en JOBS_DIR/<id>/) donde el handler debe escribir su resultado."""
+        directorio = self.queue.job_dir(self.job_id)
+        os.makedirs(directorio, exist_ok=True)
+        self.archivo = os.path.join(self.job_id, filename)
+        self.archivo_nombre = download_name or filename
+        return os.path.join(directorio, filename)
+
+
+class JobQueue(object):
+    """Cola de trabajos persistida en la tabla `jobs`."""
+
+    def __init__(self, app=None, db=None, jobs_dir='exports', workers=2, poll_interval=1.0,
+                 stale_after=300, max_intentos=3, retention_hours=24):
+        self.app = app
+        self.db = db
+        self.jobs_dir = os.path.abspath(jobs_dir)
+        self.workers = max(0, int(workers))
+        self.poll_interval = max(0.05, float(poll_interval))
+        self.stale_after = max(10, int(stale_after))
+        self.max_intentos = max(1, int(max_intentos))
+        self.retention = timedelta(hours=retention_hours)
+        self.handlers = {}
+
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._pid = None
+        self._atexit_registered = False
+        self._last_maintenance = 0.0
+
+    @classmethod
+    def from_env(cls, app=None, db=None):
+        return cls(
+            app, db,
+            jobs_dir=os.getenv('JOBS_DIR', 'exports'),
+            workers=int(os.getenv('JOBS_WORKERS', '2')),
+            poll_interval=float(os.getenv('JOBS_POLL_SECONDS', '1')),
+            stale_after=int(os.getenv('JOBS_STALE_SECONDS', '300')),
+            max_intentos=int(os.getenv('JOBS_MAX_ATTEMPTS', '3')),
+            retention_hours=float(os.getenv('JOBS_RETENTION_HOURS', '24'))
+        )
+
+    # ---- API pública -------------------------------------------------------
+
+    def register(self, tipo, handler=None):
+        """Registra el handler de un tipo de trabajo (también como decorador).
+
+        El handler recibe un JobContext y puede devolver un dict con el
+        resultado (se guarda como JSON y lo devuelve el endpoint de estado).
+        """
+        if handler is None:
+            return lambda f: self.register(tipo, f)
+        self.handlers[tipo] = handler
+        return handler
+
+    def enqueue(self, tipo, params=None, usuario=None):
+        """Crea el trabajo (con commit) y despierta a los hilos. Devuelve el Job."""
+        if tipo not in self.handlers:
+            raise ValueError(f'Tipo de trabajo desconocido: {tipo}')
+        job = Job(id=uuid.uuid4().hex, tipo=tipo, estado='pendiente', usuario=usuario,
+                  params=json.dumps(params or {}), procesados=0, intentos=0, fecha_creacion=datetime.utcnow())
+        self.db.session.add(job)
+        self.db.session.commit()
+        self._wake.set()
+        return job
+
+    def job_dir(self, job_id):
+        return os.path.join(self.jobs_dir, job_id)
+
+    def file_path(self, job):
+        """Ruta absoluta del fichero resultado, o None si no existe."""
+        if not job.archivo or job.estado != 'completado':
+            return None
+        path = os.path.abspath(os.path.join(self.jobs_dir, job.archivo))
+        if not path.startswith(self.jobs_dir + os.sep) or not os.path.exists(path):
+            return None
+        return path
+
+    def run_pending(self, limit=None):
+        """Procesa trabajos pendientes en el hilo actual (tests / run_jobs.py)."""
+        procesados = 0
+        while limit is None or procesados < limit:
+            job_id = self.claim()
+            if job_id is None:
+                break
+            self.run_job(job_id)
+            procesados += 1
+        return procesados
+
+    def run_forever(self):
+        """Bucle de un proceso dedicado (run_jobs.py)."""
+        logger.info(f"[JOBS] Procesando trabajos en {self._worker_id()}")
+        while not self._stop.is_set():
+            with self.app.app_context():
+                try:
+                    self._maintenance()
+                    if not self.run_pending(limit=1):
+                        self._wake.wait(self.poll_interval)
+                        self._wake.clear()
+                finally:
+                    self.db.session.remove()
+
+    def ensure_started(self):
+        """Arranca los hilos de este proceso (tras un fork no existen en el hijo)."""
+        if not self.workers or self.app is None or self.app.config.get('TESTING'):
+            return
+        if self._pid == os.getpid() and all(t.is_alive() for t in self._threads):
+            return
+        with self._lock:
+            if self._pid == os.getpid() and all(t.is_alive() for t in self._threads):
+                return
+            self._stop.clear()
+            self._pid = os.getpid()
+            self._threads = [
+                threading.Thread(target=self._run, name=f'jobs-{i}', daemon=True) for i in range(self.workers)
+            ]
+            for t in self._threads:
+                t.start()
+            if not self._atexit_registered:
+                atexit.register(self.stop)
+                self._atexit_registered = True
+
+    def stop(self, timeout=5.0):
+        """Pide a los hilos que terminen al acabar su trabajo actual."""
+        self._stop.set()
+        self._wake.set()
+        if self._pid == os.getpid():
+            for t in self._threads:
+                if t.is_alive():
+                    t.join(timeout)
+
+    # ---- Reclamar y ejecutar ---------------------------------------------------
+
+    def claim(self):
+        """Marca como 'en_curso' el pendiente más antiguo. Devuelve su id o None."""
+        tabla = Job.__table__
+        session = self.db.session
+        candidato = select(tabla.c.id).where(tabla.c.estado == 'pendiente') \
+            .order_by(tabla.c.fecha_creacion).limit(1)
+        if session.get_bind().dialect.name == 'postgresql':
+            candidato = candidato.with_for_update(skip_locked=True)
+        try:
+            job_id = session.execute(candidato).scalar()
+            if job_id is None:
+                session.rollback()
+                return None
+            now = datetime.utcnow()
+            # Compare-and-set: si otro worker lo reclamó antes, rowcount = 0
+            result = session.execute(
+                tabla.update().where(tabla.c.id == job_id, tabla.c.estado == 'pendiente').values(
+                    estado='en_curso', worker=self._worker_id(), heartbeat=now,
+                    fecha_inicio=func.coalesce(tabla.c.fecha_inicio, now), intentos=tabla.c.intentos + 1
+                )
+            )
+            session.commit()
+            return job_id if result.rowcount == 1 else None
+        except Exception:
+            session.rollback()
+            raise
+
+    def run_job(self, job_id):
+        session = self.db.session
+        job = session.get(Job, job_id)
+        handler = self.handlers.get(job.tipo)
+        ctx = JobContext(self, job)
+        session.commit()
+        inicio = time.monotonic()
+        try:
+            if handler is None:
+                raise RuntimeError(f'Sin handler para el tipo {job.tipo}')
+            resultado = handler(ctx)
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            logger.error(f"[JOBS] {job.tipo} {job_id} falló: {e}", exc_info=True)
+            self._update(job_id, estado='error', error=str(e)[:2000], fecha_fin=datetime.utcnow())
+            return False
+        values = {'estado': 'completado', 'fecha_fin': datetime.utcnow(), 'heartbeat': datetime.utcnow()}
+        if resultado is not None:
+            values['resultado'] = json.dumps(resultado, default=str)
+        if ctx.archivo:
+            values['archivo'] = ctx.archivo
+            values['archivo_nombre'] = ctx.archivo_nombre
+        self._update(job_id, **values)
+        logger.info(f"[JOBS] {job.tipo} {job_id} completado en {time.monotonic() - inicio:.1f}s")
+        return True
+
+    # ---- Mantenimiento ---------------------------------------------------------
+
+    def recover_stale(self):
+        """Devuelve a 'pendiente' los trabajos cuyo worker dejó de dar señales."""
+        tabla = Job.__table__
+        limite = datetime.utcnow() - timedelta(seconds=self.stale_after)
+        abandonado = (tabla.c.estado == 'en_curso') & (tabla.c.heartbeat < limite)
+        session = self.db.session
+        reintentos = session.execute(
+            tabla.update().where(abandonado, tabla.c.intentos < self.max_intentos)
+            .values(estado='pendiente', worker=None)
+        ).rowcount
+        fallidos = session.execute(
+            tabla.update().where(abandonado, tabla.c.intentos >= self.max_intentos)
+            .values(estado='error', error='Abandonado tras varios intentos', fecha_fin=datetime.utcnow())
+        ).rowcount
+        session.commit()
+        if reintentos or fallidos:
+            logger.warning(f"[JOBS] Trabajos abandonados: {reintentos} reencolados, {fallidos} en error")
+        return reintentos
+
+    def purge_expired(self):
+        """Borra trabajos terminados hace más de `retention_hours` y sus ficheros."""
+        limite = datetime.utcnow() - self.retention
+        session = self.db.session
+        viejos = [jid for (jid,) in session.query(Job.id).filter(Job.estado.in_(ESTADOS_FINALES),
+                                                               Job.fecha_fin < limite)]
+        for job_id in viejos:
+            shutil.rmtree(self.job_dir(job_id), ignore_errors=True)
+        if viejos:
+            session.query(Job).filter(Job.id.in_(viejos)).delete(synchronize_session=False)
+        session.commit()
+        return len(viejos)
+
+    # ---- Internos ----------------------------------------------------------------
+
+    def _worker_id(self):
+        return f'{socket.gethostname()}:{os.getpid()}:{threading.current_thread().name}'[:100]
+
+    def _update(self, job_id, **values):
+        # Conexión propia: no confirma lo que el handler tenga pendiente en la sesión
+        tabla = Job.__table__
+        with self.db.engine.begin() as conn:
+            conn.execute(tabla.update().where(tabla.c.id == job_id).values(**values))
+
+    def _maintenance(self):
+        now = time.monotonic()
+        if now - self._last_maintenance < self.stale_after / 2:
+            return
+        self._last_maintenance = now
+        try:
+            self.recover_stale()
+            self.purge_expired()
+        except Exception as e:
+            self.db.session.rollback()
+            logger.warning(f"[JOBS] Error en mantenimiento: {e}")
+
+    def _run(self):
+        while not self._stop.is_set():
+            with self.app.app_context():
+                try:
+                    self._maintenance()
+                    job_id = self.claim()
+                    if job_id is not None:
+                        self.run_job(job_id)
+                        continue
+                except Exception as e:
+                    logger.error(f"[JOBS] Error en el hilo de trabajos: {e}", exc_info=True)
+                finally:
+                    self.db.session.remove()
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
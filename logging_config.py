@@ -0,0 +1,274 @@
+"""
+Configuración de logging de la aplicación.
+
+Los hilos de las peticiones sólo encolan el registro (QueueHandler); un
+QueueListener en segundo plano lo formatea y lo escribe en consola y/o en
+fichero, así que una escritura lenta a disco nunca bloquea una petición.
+
+- Formato JSON por línea (LOG_FORMAT=json) o texto (LOG_FORMAT=text).
+- Cada registro lleva el request_id de la petición (cabecera X-Request-ID
+  que pone nginx, o uno generado) y el pid del worker.
+- El fichero rota por tamaño (LOG_MAX_BYTES) y por tiempo (LOG_ROTATE_WHEN:
+  midnight | H | none). Varios workers de gunicorn pueden compartirlo: cada
+  escritura y cada rotación se hace bajo flock sobre `<fichero>.lock`.
+- Niveles: LOG_LEVEL global y LOG_LEVELS="modulo=NIVEL,otro=NIVEL".
+"""
+import atexit
+import copy
+import glob
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin bloqueo entre procesos
+    fcntl = None
+
+from flask import g, has_request_context, request
+
+TEXT_FORMAT = '%(asctime)s - %(process)d - %(request_id)s - %(name)s - %(levelname)s - %(message)s'
+
+
+class JsonFormatter(logging.Formatter):
+    """Una línea JSON por registro."""
+
+    def format(self, record):
+        data = {
+            'ts': datetime.utcfromtimestamp(record.created).isoformat(timespec='milliseconds') + 'Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+            'pid': record.process,
+            'request_id': getattr(record, 'request_id', None),
+        }
+        if record.exc_text:
+            data['exc'] = record.exc_text
+        elif record.exc_info:
+            data['exc'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class RequestQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler que guarda el request_id en el registro antes de encolarlo.
+
+    El formateo real ocurre en el hilo del listener, donde ya no hay
+    contexto de petición; por eso el request_id y el traceback se resuelven
+    aquí.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.request_id = g.get('request_id', '-') if has_request_context() else '-'
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class SharedRotatingFileHandler(logging.Handler):
+    """Fichero compartido entre procesos que rota por tamaño y por tiempo.
+
+    Las copias se llaman `<fichero>.<AAAAMMDD-HHMMSS>` y se conservan las
+    `backup_count` más recientes.
+    """
+
+    def __init__(self, filename, max_bytes=10 * 1024 * 1024, when='midnight', backup_count=14):
+        super().__init__()
+        self.filename = os.path.abspath(filename)
+        self.max_bytes = max_bytes
+        self.when = when
+        self.backup_count = backup_count
+        self._lock_file = open(self.filename + '.lock', 'a')
+        self._stream = None
+        self._inode = None
+
+    def emit(self, record):
+        try:
+            line = self.format(record) + '\n'
+            data = line.encode('utf-8')
+            self._acquire_file_lock()
+            try:
+                if self._should_rollover(len(data)):
+                    self._rollover()
+                self._ensure_stream()
+                self._stream.write(data)
+                self._stream.flush()
+            finally:
+                self._release_file_lock()
+        except Exception:
+            self.handleError(record)
+
+    def close(self):
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+        self._lock_file.close()
+        super().close()
+
+    # ---- Internos ------------------------------------------------------------
+
+    def _acquire_file_lock(self):
+        if fcntl is not None:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX)
+
+    def _release_file_lock(self):
+        if fcntl is not None:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _ensure_stream(self):
+        # Otro worker pudo haber rotado el fichero: reabrir si cambió el inode
+        try:
+            inode = os.stat(self.filename).st_ino
+        except FileNotFoundError:
+            inode = None
+        if self._stream is None or inode != self._inode:
+            if self._stream is not None:
+                self._stream.close()
+            self._stream = open(self.filename, 'ab')
+            self._inode = os.fstat(self._stream.fileno()).st_ino
+
+    def _period_start(self, now):
+        t = time.localtime(now)
+        if self.when == 'H':
+            return time.mktime((t.tm_year, t.tm_mon, t.tm_mday, t.tm_hour, 0, 0, 0, 0, -1))
+        return time.mktime((t.tm_year, t.tm_mon, t.tm_mday, 0, 0, 0, 0, 0, -1))
+
+    def _should_rollover(self, incoming):
+        try:
+            st = os.stat(self.filename)
+        except FileNotFoundError:
+            return False
+        if st.st_size == 0:
+            return False
+        if self.max_bytes and st.st_size + incoming > self.max_bytes:
+            return True
+        # Si nadie ha escrito en el periodo actual, el fichero es de un periodo anterior
+        if self.when in ('midnight', 'H') and st.st_mtime < self._period_start(time.time()):
+            return True
+        return False
+
+    def _rollover(self):
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+        destino = f"{self.filename}.{datetime.now().strftime('%Y%m%d-%H%M%S')}"
+        n = 1
+        while os.path.exists(destino):
+            destino = f"{self.filename}.{datetime.now().strftime('%Y%m%d-%H%M%S')}.{n}"
+            n += 1
+        os.rename(self.filename, destino)
+        if self.backup_count:
+            copias = sorted(glob.glob(glob.escape(self.filename) + '.2*'))
+            for viejo in copias[:-self.backup_count]:
+                try:
+                    os.remove(viejo)
+                except OSError:
+                    pass
+
+
+class LoggingPipeline(object):
+    """Cola + QueueListener; se reinicia en el hijo tras un fork."""
+
+    def __init__(self, handlers):
+        self.handlers = handlers
+        self.queue = queue.SimpleQueue()
+        self._listener = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self):
+        if self._listener is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._listener is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._listener = logging.handlers.QueueListener(self.queue, *self.handlers, respect_handler_level=True)
+            self._listener.start()
+
+    def stop(self):
+        listener = self._listener
+        if listener is not None and self._pid == os.getpid():
+            listener.stop()
+            self._listener = None
+
+
+class _PipelineQueueHandler(RequestQueueHandler):
+    def __init__(self, pipeline):
+        super().__init__(pipeline.queue)
+        self.pipeline = pipeline
+
+    def enqueue(self, record):
+        self.pipeline.ensure_started()
+        super().enqueue(record)
+
+
+def parse_levels(spec):
+    """'sqlalchemy.engine=WARNING,app=DEBUG' -> {'sqlalchemy.engine': 'WARNING', 'app': 'DEBUG'}"""
+    levels = {}
+    for item in (spec or '').split(','):
+        if '=' in item:
+            name, level = item.split('=', 1)
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def configure_logging():
+    """Sustituye los handlers del logger raíz por la tubería encolada."""
+    formato = os.getenv('LOG_FORMAT', 'json').lower()
+    formatter = JsonFormatter() if formato == 'json' else logging.Formatter(TEXT_FORMAT)
+
+    handlers = []
+    if os.getenv('LOG_STDOUT', 'true').lower() != 'false':
+        stream = logging.StreamHandler(sys.stdout)
+        stream.setFormatter(formatter)
+        handlers.append(stream)
+    log_file = os.getenv('LOG_FILE', 'catalogo_app.log')
+    if log_file:
+        file_handler = SharedRotatingFileHandler(
+            log_file,
+            max_bytes=int(os.getenv('LOG_MAX_BYTES', str(10 * 1024 * 1024))),
+            when=os.getenv('LOG_ROTATE_WHEN', 'midnight'),
+            backup_count=int(os.getenv('LOG_BACKUP_COUNT', '14'))
+        )
+        file_handler.setFormatter(formatter)
+        handlers.append(file_handler)
+
+    pipeline = LoggingPipeline(handlers)
+    root = logging.getLogger()
+    for h in list(root.handlers):
+        root.removeHandler(h)
+    root.addHandler(_PipelineQueueHandler(pipeline))
+    root.setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
+    for name, level in parse_levels(os.getenv('LOG_LEVELS')).items():
+        logging.getLogger(name).setLevel(level)
+
+    pipeline.ensure_started()
+    atexit.register(pipeline.stop)
+    return pipeline
+
+
+def init_request_id(app):
+    """Asigna un request_id por petición y lo devuelve en X-Request-ID."""
+
+    @app.before_request
+    def _set_request_id():
+        rid = request.headers.get('X-Request-ID', '')[:64]
+        g.request_id = rid or uuid.uuid4().hex
+
+    @app.after_request
+    def _return_request_id(response):
+        rid = g.get('request_id')
+        if rid:
+            response.headers['X-Request-ID'] = rid
+        return response
@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+"""
+Mantenimiento de access_logs: particiones, retención y rollups horarios.
+
+Uso (dentro del contenedor):
+    python manage_access_logs.py particiones   # crea particiones por adelantado
+    python manage_access_logs.py retencion     # borra/archiva particiones viejas
+    python manage_access_logs.py rollups       # recalcula rollups horarios
+    python manage_access_logs.py mantenimiento # las tres anteriores
+
+Configuración por entorno: ACCESS_LOG_PARTITION (month|day),
+ACCESS_LOG_PARTITIONS_AHEAD, ACCESS_LOG_RETENTION_DAYS,
+ACCESS_LOG_RETENTION_MODE (drop|detach|archive), ACCESS_LOG_ARCHIVE_DIR.
+
+Cron sugerido:
+    */15 * * * * docker compose exec -T app python manage_access_logs.py mantenimiento
+"""
+import sys
+
+from app import app, db
+from access_log_storage import AccessLogStorage
+
+ACCIONES = ('particiones', 'retencion', 'rollups', 'mantenimiento')
+
+
+def run(accion):
+    with app.app_context():
+        storage = AccessLogStorage.from_env(db)
+        if accion == 'particiones':
+            print('Particiones creadas:', storage.ensure_partitions() or 'ninguna')
+        elif accion == 'retencion':
+            print('Particiones procesadas por retención:', storage.apply_retention() or 'ninguna')
+        elif accion == 'rollups':
+            print('Rollups recalculados desde:', storage.refresh_rollups())
+        else:
+            print(storage.maintain())
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2 or sys.argv[1] not in ACCIONES:
+        print(__doc__)
+        sys.exit(1)
+    run(sys.argv[1])
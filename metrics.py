@@ -0,0 +1,160 @@
+"""
+Métricas Prometheus de la aplicación (endpoint /metrics).
+
+Por petición se registran: conteo y latencia por endpoint/método/estado,
+peticiones en curso, número de consultas SQL y tiempo en BD, y el tiempo de
+render de cada plantilla.
+
+Con gunicorn cada worker es un proceso distinto: si PROMETHEUS_MULTIPROC_DIR
+está definido, prometheus_client escribe las métricas en ficheros mmap de
+ese directorio y /metrics las agrega todas (gunicorn.conf.py limpia el
+directorio al arrancar y marca los workers muertos).
+
+prometheus_client es opcional: sin él las métricas se desactivan.
+"""
+import logging
+import os
+import time
+
+from flask import Response, before_render_template, g, has_request_context, jsonify, request, template_rendered
+from sqlalchemy import event
+
+try:
+    import prometheus_client
+    from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+    from prometheus_client import multiprocess
+except ImportError:
+    prometheus_client = None
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+class Metrics(object):
+    """Instrumenta una app Flask y su engine SQLAlchemy."""
+
+    def __init__(self, app=None, db=None, registry=None):
+        self.enabled = prometheus_client is not None and os.getenv('METRICS_ENABLED', 'true').lower() != 'false'
+        self.token = os.getenv('METRICS_TOKEN')
+        if self.enabled:
+            self._create_metrics(registry or prometheus_client.REGISTRY)
+        if app is not None:
+            self.init_app(app, db)
+
+    def _create_metrics(self, registry):
+        self.requests = Counter(
+            'http_requests_total', 'Peticiones HTTP atendidas',
+            ['endpoint', 'method', 'status'], registry=registry)
+        self.latency = Histogram(
+            'http_request_duration_seconds', 'Latencia de las peticiones HTTP',
+            ['endpoint', 'method', 'status'], buckets=LATENCY_BUCKETS, registry=registry)
+        self.in_flight = Gauge(
+            'http_requests_in_flight', 'Peticiones en curso',
+            multiprocess_mode='livesum', registry=registry)
+        self.db_queries = Histogram(
+            'db_queries_per_request', 'Consultas SQL ejecutadas por petición',
+            ['endpoint'], buckets=QUERY_COUNT_BUCKETS, registry=registry)
+        self.db_time = Histogram(
+            'db_time_per_request_seconds', 'Tiempo total en BD por petición',
+            ['endpoint'], buckets=LATENCY_BUCKETS, registry=registry)
+        self.template_time = Histogram(
+            'template_render_seconds', 'Tiempo de render de plantillas',
+            ['template'], buckets=LATENCY_BUCKETS, registry=registry)
+
+    def init_app(self, app, db=None):
+        app.add_url_rule('/metrics', 'metrics', self.metrics_view)
+        if not self.enabled:
+            logger.info("[METRICS] prometheus_client no disponible o METRICS_ENABLED=false; métricas desactivadas")
+            return
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        before_render_template.connect(self._before_render, app, weak=False)
+        template_rendered.connect(self._after_render, app, weak=False)
+        if db is not None:
+            with app.app_context():
+                self._instrument_engine(db.engine)
+
+    # ---- Peticiones ------------------------------------------------------------
+
+    def _before_request(self):
+        if request.path.startswith('/static'):
+            return
+        g._metrics_start = time.perf_counter()
+        g._metrics_queries = 0
+        g._metrics_db_time = 0.0
+        self.in_flight.inc()
+
+    def _after_request(self, response):
+        g._metrics_status = response.status_code
+        return response
+
+    def _teardown_request(self, exc=None):
+        start = g.pop('_metrics_start', None)
+        if start is None:
+            return
+        self.in_flight.dec()
+        elapsed = time.perf_counter() - start
+        endpoint = request.url_rule.endpoint if request.url_rule else 'sin_ruta'
+        status = str(g.pop('_metrics_status', 500))
+        self.requests.labels(endpoint, request.method, status).inc()
+        self.latency.labels(endpoint, request.method, status).observe(elapsed)
+        self.db_queries.labels(endpoint).observe(g.pop('_metrics_queries', 0))
+        self.db_time.labels(endpoint).observe(g.pop('_metrics_db_time', 0.0))
+
+    # ---- Plantillas --------------------------------------------------------------
+
+    def _before_render(self, sender, template, context, **extra):
+        if has_request_context():
+            g.setdefault('_metrics_templates', []).append(time.perf_counter())
+
+    def _after_render(self, sender, template, context, **extra):
+        if not has_request_context():
+            return
+        stack = g.get('_metrics_templates')
+        if stack:
+            self.template_time.labels(template.name or 'sin_nombre').observe(time.perf_counter() - stack.pop())
+
+    # ---- Base de datos -----------------------------------------------------------
+
+    def _instrument_engine(self, engine):
+        @event.listens_for(engine, 'before_cursor_execute')
+        def _before_cursor(conn, cursor, statement, parameters, context, executemany):
+            # El inicio va en el contexto de ejecución de la sentencia: si ésta falla,
+            # se descarta con él y no queda colgado en la conexión del pool
+            if context is not None:
+                context._metrics_start = time.perf_counter()
+
+        @event.listens_for(engine, 'after_cursor_execute')
+        def _after_cursor(conn, cursor, statement, parameters, context, executemany):
+            start = getattr(context, '_metrics_start', None)
+            if start is None:
+                return
+            elapsed = time.perf_counter() - start
+            # Sólo cuentan las consultas hechas dentro de una petición
+            # (no las del hilo de access_logs ni tareas de fondo)
+            if has_request_context() and '_metrics_start' in g:
+                g._metrics_queries += 1
+                g._metrics_db_time += elapsed
+
+    # ---- Exposición ----------------------------------------------------------------
+
+    def metrics_view(self):
+        if not self.enabled:
+            return jsonify({'error': 'Métricas desactivadas (instalar prometheus_client)'}), 503
+        if self.token and request.headers.get('Authorization') != f'Bearer {self.token}':
+            return jsonify({'error': 'Prohibido'}), 403
+        if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        else:
+            registry = prometheus_client.REGISTRY
+        return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
+
+
+def mark_process_dead(pid):
+    """Hook de gunicorn (child_exit): descarta los gauges 'live' del worker."""
+    if prometheus_client is not None and os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        multiprocess.mark_process_dead(pid)
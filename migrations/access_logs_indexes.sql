@@ -0,0 +1,17 @@
+-- Migración: índices para paginación keyset y filtros de /api/logs y /admin/puerta
+-- Fecha: 2026-10-18
+--
+-- Sobre la tabla particionada los índices se crean en el padre y PostgreSQL
+-- los propaga a cada partición (y a las que se adjunten después).
+-- `method` no lleva índice propio: tiene muy pocos valores distintos y se
+-- filtra junto con el rango de fechas.
+
+BEGIN;
+
+CREATE INDEX IF NOT EXISTS ix_access_logs_timestamp_id ON access_logs (timestamp, id);
+CREATE INDEX IF NOT EXISTS ix_access_logs_ip_timestamp ON access_logs (ip, timestamp);
+CREATE INDEX IF NOT EXISTS ix_access_logs_username_timestamp ON access_logs (username, timestamp);
+-- varchar_pattern_ops permite usar el índice en LIKE 'prefijo%'
+CREATE INDEX IF NOT EXISTS ix_access_logs_path_timestamp ON access_logs (path varchar_pattern_ops, timestamp);
+
+COMMIT;
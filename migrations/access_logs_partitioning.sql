@@ -0,0 +1,73 @@
+-- Migración: convertir access_logs en tabla particionada por rango de timestamp
+-- y crear la tabla de rollups horarios (access_log_rollups).
+-- Fecha: 2026-10-18
+--
+-- Después de aplicarla, programar el mantenimiento (crea particiones por
+-- adelantado, aplica retención y recalcula rollups):
+--   */15 * * * * docker compose exec -T app python manage_access_logs.py mantenimiento
+--
+-- La tabla original queda como access_logs_legacy; borrarla a mano cuando se
+-- haya verificado la copia:  DROP TABLE access_logs_legacy;
+
+BEGIN;
+
+ALTER TABLE access_logs RENAME TO access_logs_legacy;
+ALTER TABLE access_logs_legacy RENAME CONSTRAINT access_logs_pkey TO access_logs_legacy_pkey;
+
+-- La clave primaria de una tabla particionada debe incluir la columna de partición
+CREATE TABLE access_logs (
+    id BIGINT NOT NULL DEFAULT nextval('access_logs_id_seq'),
+    ip VARCHAR(100),
+    username VARCHAR(100),
+    path VARCHAR(500) NOT NULL,
+    method VARCHAR(10) NOT NULL,
+    user_agent VARCHAR(500),
+    referer VARCHAR(500),
+    timestamp TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+    PRIMARY KEY (id, timestamp)
+) PARTITION BY RANGE (timestamp);
+
+ALTER SEQUENCE access_logs_id_seq OWNED BY access_logs.id;
+
+-- Índice particionado: cada partición (actual o futura) recibe su propio índice
+CREATE INDEX ix_access_logs_timestamp ON access_logs (timestamp);
+
+-- Red de seguridad para filas fuera de las particiones creadas;
+-- manage_access_logs.py mueve su contenido al crear la partición que toque.
+CREATE TABLE access_logs_default PARTITION OF access_logs DEFAULT;
+
+-- Particiones mensuales desde el registro más antiguo hasta 3 meses adelante
+DO $$
+DECLARE
+    inicio DATE := date_trunc('month', COALESCE((SELECT min(timestamp) FROM access_logs_legacy), now()));
+    fin DATE := date_trunc('month', now()) + INTERVAL '3 months';
+    mes DATE;
+BEGIN
+    mes := inicio;
+    WHILE mes <= fin LOOP
+        EXECUTE format(
+            'CREATE TABLE IF NOT EXISTS %I PARTITION OF access_logs FOR VALUES FROM (%L) TO (%L)',
+            'access_logs_p' || to_char(mes, 'YYYY_MM'), mes, mes + INTERVAL '1 month'
+        );
+        mes := mes + INTERVAL '1 month';
+    END LOOP;
+END $$;
+
+INSERT INTO access_logs (id, ip, username, path, method, user_agent, referer, timestamp)
+SELECT id, ip, username, path, method, user_agent, referer, COALESCE(timestamp, now() AT TIME ZONE 'utc')
+FROM access_logs_legacy;
+
+ALTER SEQUENCE access_logs_id_seq AS BIGINT;
+
+-- Rollups horarios por ruta y por usuario (dimension = 'path' | 'user')
+CREATE TABLE IF NOT EXISTS access_log_rollups (
+    id SERIAL PRIMARY KEY,
+    hour TIMESTAMP NOT NULL,
+    dimension VARCHAR(10) NOT NULL,
+    value VARCHAR(500) NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    CONSTRAINT uq_access_log_rollup UNIQUE (hour, dimension, value)
+);
+CREATE INDEX IF NOT EXISTS ix_access_log_rollups_dimension_hour ON access_log_rollups (dimension, hour);
+
+COMMIT;
@@ -0,0 +1,12 @@
+-- Migración: tabla de contadores de versión para cachés en memoria
+-- (índice de permisos por rol y futuras familias cacheadas).
+-- Fecha: 2026-10-18
+
+CREATE TABLE IF NOT EXISTS cache_versions (
+    nombre VARCHAR(50) PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0,
+    fecha_actualizacion TIMESTAMP DEFAULT (now() AT TIME ZONE 'utc')
+);
+
+INSERT INTO cache_versions (nombre, version) VALUES ('permisos', 1)
+ON CONFLICT (nombre) DO NOTHING;
@@ -0,0 +1,31 @@
+-- Migración: agregados por categoría para /api/estadisticas (catalog_stats.py)
+-- e índice de precio para producto más caro / más barato.
+-- La app los mantiene en cada flush; esta migración crea la tabla y la rellena.
+-- Fecha: 2026-10-18
+
+CREATE TABLE IF NOT EXISTS estadisticas_categoria (
+    categoria VARCHAR(100) PRIMARY KEY,
+    productos INTEGER NOT NULL DEFAULT 0,
+    suma_precio DOUBLE PRECISION NOT NULL DEFAULT 0,
+    valor_inventario DOUBLE PRECISION NOT NULL DEFAULT 0,
+    stock INTEGER NOT NULL DEFAULT 0,
+    bajo_stock INTEGER NOT NULL DEFAULT 0,
+    fecha_actualizacion TIMESTAMP DEFAULT (now() AT TIME ZONE 'utc')
+);
+
+CREATE INDEX IF NOT EXISTS ix_productos_precio ON productos (precio);
+
+BEGIN;
+DELETE FROM estadisticas_categoria;
+INSERT INTO estadisticas_categoria (categoria, productos, suma_precio, valor_inventario, stock, bajo_stock)
+SELECT COALESCE(categoria, ''),
+       COUNT(*),
+       COALESCE(SUM(precio), 0),
+       COALESCE(SUM(precio * COALESCE(cantidad, 0)), 0),
+       COALESCE(SUM(COALESCE(cantidad, 0)), 0),
+       COUNT(*) FILTER (WHERE COALESCE(cantidad, 0) < 5)
+FROM productos
+GROUP BY COALESCE(categoria, '');
+INSERT INTO cache_versions (nombre, version) VALUES ('productos', 1)
+ON CONFLICT (nombre) DO UPDATE SET version = cache_versions.version + 1;
+COMMIT;
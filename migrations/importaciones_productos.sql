@@ -0,0 +1,29 @@
+-- Migración: staging de importaciones de productos desde Excel (product_import.py).
+-- create_db.py las crea en instalaciones nuevas; esto es para bases existentes.
+-- Fecha: 2026-10-18
+
+CREATE TABLE IF NOT EXISTS importaciones_productos (
+    id VARCHAR(32) PRIMARY KEY,
+    usuario VARCHAR(100),
+    archivo_nombre VARCHAR(255),
+    estado VARCHAR(20) NOT NULL DEFAULT 'cargando',
+    filas_leidas INTEGER NOT NULL DEFAULT 0,
+    aplicado_hasta INTEGER NOT NULL DEFAULT 0,
+    resumen TEXT,
+    fecha_creacion TIMESTAMP DEFAULT (now() AT TIME ZONE 'utc'),
+    fecha_aplicacion TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS importacion_productos_staging (
+    id SERIAL PRIMARY KEY,
+    importacion_id VARCHAR(32) NOT NULL REFERENCES importaciones_productos (id) ON DELETE CASCADE,
+    fila INTEGER NOT NULL,
+    nombre VARCHAR(255),
+    descripcion TEXT,
+    error VARCHAR(255),
+    producto_id INTEGER,
+    accion VARCHAR(20)
+);
+
+CREATE INDEX IF NOT EXISTS ix_importacion_staging_importacion_id ON importacion_productos_staging (importacion_id, id);
+CREATE INDEX IF NOT EXISTS ix_importacion_staging_nombre ON importacion_productos_staging (importacion_id, nombre);
@@ -0,0 +1,27 @@
+-- Migración: tabla de trabajos en segundo plano (jobs.py).
+-- create_db.py la crea en instalaciones nuevas; esto es para bases existentes.
+-- Fecha: 2026-10-18
+
+CREATE TABLE IF NOT EXISTS jobs (
+    id VARCHAR(32) PRIMARY KEY,
+    tipo VARCHAR(50) NOT NULL,
+    estado VARCHAR(20) NOT NULL DEFAULT 'pendiente',
+    params TEXT,
+    usuario VARCHAR(100),
+    procesados INTEGER NOT NULL DEFAULT 0,
+    total INTEGER,
+    mensaje VARCHAR(500),
+    checkpoint TEXT,
+    resultado TEXT,
+    archivo VARCHAR(500),
+    archivo_nombre VARCHAR(255),
+    error TEXT,
+    intentos INTEGER NOT NULL DEFAULT 0,
+    worker VARCHAR(100),
+    heartbeat TIMESTAMP,
+    fecha_creacion TIMESTAMP DEFAULT (now() AT TIME ZONE 'utc'),
+    fecha_inicio TIMESTAMP,
+    fecha_fin TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS ix_jobs_estado_fecha ON jobs (estado, fecha_creacion);
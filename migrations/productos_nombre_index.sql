@@ -0,0 +1,5 @@
+-- Migración: índice por nombre (clave) para la importación masiva desde Excel
+-- (product_import.py busca los productos existentes con nombre IN (...)).
+-- Fecha: 2026-10-18
+
+CREATE INDEX IF NOT EXISTS ix_productos_nombre ON productos (nombre);
@@ -0,0 +1,41 @@
+-- Migración: búsqueda full-text de productos (SEARCH_ENGINE=fts / auto)
+-- Columna tsvector mantenida por trigger + índice GIN, configuración en
+-- español que ignora acentos ("tornilleria" encuentra "Tornillería").
+-- Fecha: 2026-10-18
+
+BEGIN;
+
+CREATE EXTENSION IF NOT EXISTS unaccent;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_ts_config WHERE cfgname = 'es_unaccent') THEN
+        CREATE TEXT SEARCH CONFIGURATION es_unaccent ( COPY = spanish );
+        ALTER TEXT SEARCH CONFIGURATION es_unaccent
+            ALTER MAPPING FOR hword, hword_part, word WITH unaccent, spanish_stem;
+    END IF;
+END $$;
+
+ALTER TABLE productos ADD COLUMN IF NOT EXISTS search_vector tsvector;
+
+CREATE OR REPLACE FUNCTION productos_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('es_unaccent', coalesce(NEW.nombre, '')), 'A') ||
+        setweight(to_tsvector('es_unaccent', coalesce(NEW.categoria, '')), 'B') ||
+        setweight(to_tsvector('es_unaccent', coalesce(NEW.descripcion, '')), 'C');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_productos_search_vector ON productos;
+CREATE TRIGGER trg_productos_search_vector
+    BEFORE INSERT OR UPDATE OF nombre, categoria, descripcion ON productos
+    FOR EACH ROW EXECUTE FUNCTION productos_search_vector_update();
+
+-- Rellenar filas existentes (el trigger se dispara con el UPDATE de nombre)
+UPDATE productos SET nombre = nombre;
+
+CREATE INDEX IF NOT EXISTS ix_productos_search_vector ON productos USING GIN (search_vector);
+
+COMMIT;
@@ -0,0 +1,13 @@
+-- Migración: tabla compartida del limitador de intentos de login
+-- (RATE_LIMIT_BACKEND=sql). La aplicación también la crea si no existe.
+-- Fecha: 2026-10-18
+
+CREATE TABLE IF NOT EXISTS rate_limits (
+    key VARCHAR(255) PRIMARY KEY,
+    window_id BIGINT NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    prev_count INTEGER NOT NULL DEFAULT 0,
+    locked_until DOUBLE PRECISION NOT NULL DEFAULT 0,
+    expires_at DOUBLE PRECISION NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_rate_limits_expires_at ON rate_limits (expires_at);
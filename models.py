@@ -1,4 +1,5 @@
 from flask_sqlalchemy import SQLAlchemy
+import json
 from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
 from crypto_utils import encrypt_text, decrypt_text
@@ -142,13 +143,55 @@ class Permission(db.Model):
             'descripcion': self.descripcion
         }
 
+
+class CacheVersion(db.Model):
+    """Contador de versión por familia de datos; los workers lo consultan
+    para saber cuándo recargar sus cachés en memoria."""
+    __tablename__ = 'cache_versions'
+
+    nombre = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    fecha_actualizacion = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'nombre': self.nombre,
+            'version': self.version,
+            'fecha_actualizacion': self.fecha_actualizacion.isoformat() if self.fecha_actualizacion else None
+        }
+
+class EstadisticaCategoria(db.Model):
+    """Agregados de productos por categoría, mantenidos en cada flush
+    (catalog_stats.py) para no recorrer la tabla productos en /api/estadisticas."""
+    __tablename__ = 'estadisticas_categoria'
+
+    categoria = db.Column(db.String(100), primary_key=True)  # '' = sin categoría
+    productos = db.Column(db.Integer, nullable=False, default=0)
+    suma_precio = db.Column(db.Float, nullable=False, default=0)
+    valor_inventario = db.Column(db.Float, nullable=False, default=0)
+    stock = db.Column(db.Integer, nullable=False, default=0)
+    bajo_stock = db.Column(db.Integer, nullable=False, default=0)
+    fecha_actualizacion = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'categoria': self.categoria or None,
+            'productos': self.productos,
+            'suma_precio': self.suma_precio,
+            'valor_inventario': self.valor_inventario,
+            'stock': self.stock,
+            'bajo_stock': self.bajo_stock
+        }
+
 class Producto(db.Model):
     __tablename__ = 'productos'
     
     id = db.Column(db.Integer, primary_key=True)
-    nombre = db.Column(db.String(255), nullable=False)
+    # Indexado para la importación masiva por clave (product_import.py)
+    nombre = db.Column(db.String(255), nullable=False, index=True)
     descripcion = db.Column(db.Text, nullable=True)
-    precio = db.Column(db.Float, nullable=False)
+    # Indexado para producto más caro / más barato en /api/estadisticas
+    precio = db.Column(db.Float, nullable=False, index=True)
     cantidad = db.Column(db.Integer, default=0)
     imagen_url = db.Column(db.String(500), nullable=True)
     categoria = db.Column(db.String(100), nullable=True)
@@ -306,7 +349,18 @@ class AccessLog(db.Model):
     method = db.Column(db.String(10), nullable=False)
     user_agent = db.Column(db.String(500), nullable=True)
     referer = db.Column(db.String(500), nullable=True)
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    # En PostgreSQL la tabla está particionada por rango de timestamp
+    # (ver migrations/access_logs_partitioning.sql y manage_access_logs.py)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+    # Índices para la paginación keyset (timestamp, id) y los filtros de /api/logs
+    __table_args__ = (
+        db.Index('ix_access_logs_timestamp_id', 'timestamp', 'id'),
+        db.Index('ix_access_logs_ip_timestamp', 'ip', 'timestamp'),
+        db.Index('ix_access_logs_username_timestamp', 'username', 'timestamp'),
+        db.Index('ix_access_logs_path_timestamp', 'path', 'timestamp',
+                 postgresql_ops={'path': 'varchar_pattern_ops'}),
+    )
 
     def to_dict(self):
         return {
@@ -321,6 +375,30 @@ class AccessLog(db.Model):
         }
 
 
+class AccessLogRollup(db.Model):
+    """Conteo horario de accesos por ruta o por usuario (precalculado)."""
+    __tablename__ = 'access_log_rollups'
+
+    id = db.Column(db.Integer, primary_key=True)
+    hour = db.Column(db.DateTime, nullable=False)
+    dimension = db.Column(db.String(10), nullable=False)  # path, user
+    value = db.Column(db.String(500), nullable=False)
+    hits = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.UniqueConstraint('hour', 'dimension', 'value', name='uq_access_log_rollup'),
+        db.Index('ix_access_log_rollups_dimension_hour', 'dimension', 'hour'),
+    )
+
+    def to_dict(self):
+        return {
+            'hour': self.hour.isoformat(),
+            'dimension': self.dimension,
+            'value': self.value,
+            'hits': self.hits
+        }
+
+
 class QCReport(db.Model):
     """Informe de control de calidad para una máquina."""
     __tablename__ = 'qc_reports'
@@ -718,3 +796,98 @@ class ClaveProceso(db.Model):
             'tiempo_estimado': self.tiempo_estimado,
             'notas': self.notas,
         }
+
+
+class Job(db.Model):
+    """Trabajo en segundo plano (exportaciones, importaciones); ver jobs.py."""
+    __tablename__ = 'jobs'
+
+    id = db.Column(db.String(32), primary_key=True)  # uuid4 hex
+    tipo = db.Column(db.String(50), nullable=False)
+    estado = db.Column(db.String(20), nullable=False, default='pendiente')  # pendiente, en_curso, completado, error
+    params = db.Column(db.Text, nullable=True)  # JSON
+    usuario = db.Column(db.String(100), nullable=True)
+    procesados = db.Column(db.Integer, nullable=False, default=0)
+    total = db.Column(db.Integer, nullable=True)
+    mensaje = db.Column(db.String(500), nullable=True)
+    checkpoint = db.Column(db.Text, nullable=True)  # JSON; lo que el handler necesita para reanudar
+    resultado = db.Column(db.Text, nullable=True)  # JSON
+    archivo = db.Column(db.String(500), nullable=True)  # fichero generado, relativo a JOBS_DIR
+    archivo_nombre = db.Column(db.String(255), nullable=True)  # nombre de descarga
+    error = db.Column(db.Text, nullable=True)
+    intentos = db.Column(db.Integer, nullable=False, default=0)
+    worker = db.Column(db.String(100), nullable=True)
+    heartbeat = db.Column(db.DateTime, nullable=True)
+    fecha_creacion = db.Column(db.DateTime, default=datetime.utcnow)
+    fecha_inicio = db.Column(db.DateTime, nullable=True)
+    fecha_fin = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_jobs_estado_fecha', 'estado', 'fecha_creacion'),
+    )
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'tipo': self.tipo,
+            'estado': self.estado,
+            'usuario': self.usuario,
+            'procesados': self.procesados,
+            'total': self.total,
+            'progreso': round(100.0 * self.procesados / self.total, 1) if self.total else None,
+            'mensaje': self.mensaje,
+            'resultado': json.loads(self.resultado) if self.resultado else None,
+            'descargable': bool(self.archivo) and self.estado == 'completado',
+            'error': self.error,
+            'intentos': self.intentos,
+            'fecha_creacion': self.fecha_creacion.isoformat() if self.fecha_creacion else None,
+            'fecha_inicio': self.fecha_inicio.isoformat() if self.fecha_inicio else None,
+            'fecha_fin': self.fecha_fin.isoformat() if self.fecha_fin else None,
+        }
+
+
+class ImportacionProductos(db.Model):
+    """Importación de productos desde Excel: previsualización y aplicación (ver product_import.py)."""
+    __tablename__ = 'importaciones_productos'
+
+    id = db.Column(db.String(32), primary_key=True)  # uuid4 hex
+    usuario = db.Column(db.String(100), nullable=True)
+    archivo_nombre = db.Column(db.String(255), nullable=True)
+    estado = db.Column(db.String(20), nullable=False, default='cargando')  # cargando, previsualizada, encolada, aplicando, aplicada, descartada
+    filas_leidas = db.Column(db.Integer, nullable=False, default=0)  # última fila de la hoja pasada a staging
+    aplicado_hasta = db.Column(db.Integer, nullable=False, default=0)  # último id de staging aplicado
+    resumen = db.Column(db.Text, nullable=True)  # JSON con los contadores del diff
+    fecha_creacion = db.Column(db.DateTime, default=datetime.utcnow)
+    fecha_aplicacion = db.Column(db.DateTime, nullable=True)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'usuario': self.usuario,
+            'archivo_nombre': self.archivo_nombre,
+            'estado': self.estado,
+            'filas_leidas': self.filas_leidas,
+            'resumen': json.loads(self.resumen) if self.resumen else None,
+            'fecha_creacion': self.fecha_creacion.isoformat() if self.fecha_creacion else None,
+            'fecha_aplicacion': self.fecha_aplicacion.isoformat() if self.fecha_aplicacion else None,
+        }
+
+
+class ImportacionProductoFila(db.Model):
+    """Fila de la hoja en staging; `accion` es el resultado del diff con productos."""
+    __tablename__ = 'importacion_productos_staging'
+
+    id = db.Column(db.Integer, primary_key=True)
+    importacion_id = db.Column(db.String(32), db.ForeignKey('importaciones_productos.id', ondelete='CASCADE'),
+                               nullable=False)
+    fila = db.Column(db.Integer, nullable=False)
+    nombre = db.Column(db.String(255), nullable=True)
+    descripcion = db.Column(db.Text, nullable=True)
+    error = db.Column(db.String(255), nullable=True)
+    producto_id = db.Column(db.Integer, nullable=True)  # producto existente con ese nombre (el de menor id)
+    accion = db.Column(db.String(20), nullable=True)  # nuevo, cambio, igual, duplicado, invalido
+
+    __table_args__ = (
+        db.Index('ix_importacion_staging_importacion_id', 'importacion_id', 'id'),
+        db.Index('ix_importacion_staging_nombre', 'importacion_id', 'nombre'),
+    )
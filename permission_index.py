@@ -0,0 +1,91 @@
+"""
+Índice compilado de permisos por rol.
+
+Carga la matriz role_permissions una sola vez por worker en un dict
+role_id -> frozenset((module, action)). La versión 'permisos' de
+cache_versions indica cuándo recargarla; se consulta como mucho cada
+`check_interval` segundos (una lectura por clave primaria), así que las
+peticiones normales no tocan la tabla de asociación.
+
+Si la versión no se puede leer (p. ej. falta la migración de
+cache_versions) se sigue sirviendo el último índice cargado y se reintenta
+al cabo de `check_interval`; si aún no había ninguno se carga directamente
+de role_permissions, nunca se devuelven permisos vacíos por un error.
+"""
+import logging
+import threading
+import time
+
+from sqlalchemy import select
+
+from cache_versions import bump_version, get_version
+from models import Permission, role_permissions
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = 'permisos'
+
+
+class PermissionIndex(object):
+    """role_id -> frozenset de (module, action), con invalidación por versión."""
+
+    def __init__(self, db, check_interval=2.0):
+        self.db = db
+        self.check_interval = max(0.0, float(check_interval))
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Olvida el índice cargado; se recargará en el próximo ensure_fresh()."""
+        self._by_role = {}
+        self.version = None
+        self._loaded = False
+        self._checked_at = 0.0
+
+    def ensure_fresh(self):
+        """Recarga el índice si la versión en BD cambió (comprobación espaciada)."""
+        now = time.monotonic()
+        if self._loaded and now - self._checked_at < self.check_interval:
+            return
+        try:
+            version = get_version(self.db, VERSION_KEY)
+        except Exception as e:
+            # Sin rollback la transacción queda abortada (PostgreSQL) para el resto de la petición
+            self.db.session.rollback()
+            self._checked_at = now
+            if self._loaded:
+                logger.warning(f"[PERMISOS] No se pudo leer la versión del índice, se mantiene el cargado: {e}")
+                return
+            logger.warning(f"[PERMISOS] No se pudo leer la versión del índice, se carga sin versión: {e}")
+            self._load(None)
+            return
+        self._checked_at = now
+        if not self._loaded or version != self.version:
+            self._load(version)
+
+    def for_role(self, role_id):
+        if role_id is None:
+            return frozenset()
+        return self._by_role.get(role_id, frozenset())
+
+    def has_permission(self, role_id, module, action):
+        return (module, action) in self.for_role(role_id)
+
+    def invalidate(self):
+        """Marca los permisos como modificados (llamar antes del commit)."""
+        bump_version(self.db, VERSION_KEY)
+        self._checked_at = 0.0
+
+    def _load(self, version):
+        rows = self.db.session.execute(
+            select(role_permissions.c.role_id, Permission.module, Permission.action)
+            .join(Permission, Permission.id == role_permissions.c.permission_id)
+        )
+        by_role = {}
+        for role_id, module, action in rows:
+            by_role.setdefault(role_id, set()).add((module, action))
+        with self._lock:
+            self._by_role = {role_id: frozenset(perms) for role_id, perms in by_role.items()}
+            self.version = version
+            self._loaded = True
+        logger.info(f"[PERMISOS] Índice cargado (versión {version}, {len(by_role)} roles)")
@@ -0,0 +1,397 @@
+"""
+Importación masiva de productos desde Excel (CLAVES.xlsx).
+
+Columna C (Clave) -> nombre, columna F (Producto) -> descripción; la fila 1
+es el encabezado. Un producto existente (mismo nombre) actualiza su
+descripción; uno nuevo se crea con precio 0, stock 0 y categoría
+'Importado'.
+
+En tres pasos, sin volver a leer el fichero:
+
+1. stage(): la hoja se lee en modo read_only (openpyxl en streaming) y sus
+   filas se insertan en importacion_productos_staging en bloques de
+   `chunk_size`, con un commit por bloque.
+2. diff(): en SQL, sobre staging y productos (índice ix_productos_nombre),
+   cada fila queda como nuevo / cambio / igual / duplicado (la misma clave
+   aparece más abajo en la hoja; gana la última) / invalido. El resumen son
+   esos contadores; es lo que devuelve la previsualización (dry_run).
+3. apply(): aplica nuevos y cambios por rangos de id de staging, con un
+   INSERT ... SELECT y un UPDATE por rango y un commit por rango, así que
+   ninguna transacción bloquea más de `chunk_size` productos. El avance se
+   guarda en aplicado_hasta.
+
+Nota: nombre no es único en productos, así que no se puede usar INSERT ...
+ON CONFLICT (nombre); con nombres repetidos en la BD se actualiza el de
+menor id, y un 'nuevo' que otro usuario haya creado entre la
+previsualización y la confirmación no se duplica (NOT EXISTS al insertar).
+
+Las escrituras son en bloque y no pasan por el flush del ORM: al terminar
+se recalculan las estadísticas (catalog_stats.rebuild, que además
+incrementa la versión 'productos') y se llama a `on_change`.
+
+Los tres pasos se ejecutan como trabajo en segundo plano (importar_job,
+tipo 'importar_productos' en jobs.py): la petición sólo guarda el fichero en
+`upload_dir` y encola. filas_leidas y aplicado_hasta se confirman en la
+misma transacción que cada bloque, así que si el worker cae el trabajo se
+reencola (JobQueue.recover_stale) y continúa desde el último bloque
+confirmado en lugar de empezar de nuevo.
+"""
+import json
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, case, exists, func, literal, select
+
+from catalog_stats import rebuild as rebuild_estadisticas
+from models import ImportacionProductoFila, ImportacionProductos, Job, Producto
+
+logger = logging.getLogger(__name__)
+
+COL_CLAVE = 2        # C
+COL_DESCRIPCION = 5  # F
+CATEGORIA = 'Importado'
+ACCIONES = ('nuevo', 'cambio', 'igual', 'duplicado', 'invalido')
+REPORT_FIELDS = ('fila', 'clave', 'error')
+TIPO = 'importar_productos'
+# Estados desde los que se puede (re)lanzar la aplicación si no hay un trabajo activo
+RELANZABLES = ('encolada', 'aplicando')
+
+
+def _texto(valor):
+    return str(valor).strip() if valor is not None else ''
+
+
+def leer_filas(fileobj, min_row=2):
+    """Genera (fila, clave, descripcion, error) leyendo la hoja en streaming."""
+    import openpyxl
+
+    wb = openpyxl.load_workbook(fileobj, read_only=True, data_only=True)
+    try:
+        ws = wb.active
+        for row_num, row in enumerate(ws.iter_rows(min_row=min_row, values_only=True), start=min_row):
+            clave = _texto(row[COL_CLAVE]) if len(row) > COL_CLAVE else ''
+            descripcion = _texto(row[COL_DESCRIPCION]) if len(row) > COL_DESCRIPCION else ''
+            if not clave and not descripcion and not any(v is not None for v in row):
+                continue  # fila vacía
+            if not clave or not descripcion:
+                yield row_num, clave, descripcion, 'Falta Clave o Producto'
+            elif len(clave) > Producto.nombre.type.length:
+                yield row_num, clave[:Producto.nombre.type.length], descripcion, \
+                    f'Clave de más de {Producto.nombre.type.length} caracteres'
+            else:
+                yield row_num, clave, descripcion, None
+    finally:
+        wb.close()
+
+
+class ProductImporter(object):
+    """Staging + diff + aplicación por bloques de importaciones de productos."""
+
+    def __init__(self, db, upload_dir='exports/importaciones', chunk_size=1000, retention_hours=24,
+                 on_change=None):
+        self.db = db
+        self.upload_dir = os.path.abspath(upload_dir)
+        self.chunk_size = max(1, int(chunk_size))
+        self.retention = timedelta(hours=retention_hours)
+        self.on_change = on_change
+
+    @classmethod
+    def from_env(cls, db, on_change=None):
+        return cls(
+            db,
+            upload_dir=os.getenv('IMPORT_UPLOAD_DIR', 'exports/importaciones'),
+            chunk_size=int(os.getenv('IMPORT_CHUNK_SIZE', '1000')),
+            retention_hours=float(os.getenv('IMPORT_RETENTION_HOURS', '24')),
+            on_change=on_change
+        )
+
+    def upload_path(self, importacion_id):
+        """Dónde se guarda la hoja subida hasta que pasa a staging."""
+        return os.path.join(self.upload_dir, f'{importacion_id}.xlsx')
+
+    # ---- 1. Staging ------------------------------------------------------------
+
+    def create(self, fileobj, usuario=None, archivo_nombre=None):
+        """Registra la importación y guarda la hoja en disco (con commit)."""
+        importacion = ImportacionProductos(id=uuid.uuid4().hex, usuario=usuario, archivo_nombre=archivo_nombre,
+                                           estado='cargando', filas_leidas=0, aplicado_hasta=0)
+        os.makedirs(self.upload_dir, exist_ok=True)
+        fileobj.save(self.upload_path(importacion.id))
+        self.db.session.add(importacion)
+        self.db.session.commit()
+        return importacion
+
+    def stage(self, importacion, fileobj, on_chunk=None):
+        """Pasa la hoja a staging (commit por bloque) desde filas_leidas + 1."""
+        tabla = ImportacionProductoFila.__table__
+        session = self.db.session
+        bloque = []
+
+        def _volcar(ultima_fila):
+            session.execute(tabla.insert(), bloque)
+            importacion.filas_leidas = ultima_fila
+            session.commit()
+            bloque.clear()
+            if on_chunk:
+                on_chunk(importacion)
+
+        ultima = importacion.filas_leidas
+        for fila, clave, descripcion, error in leer_filas(fileobj, min_row=max(2, importacion.filas_leidas + 1)):
+            bloque.append({'importacion_id': importacion.id, 'fila': fila, 'nombre': clave or None,
+                           'descripcion': descripcion or None, 'error': error})
+            ultima = fila
+            if len(bloque) >= self.chunk_size:
+                _volcar(ultima)
+        if bloque:
+            _volcar(ultima)
+        return importacion
+
+    # ---- 2. Diff ---------------------------------------------------------------
+
+    def diff(self, importacion):
+        """Clasifica las filas en SQL y guarda el resumen (con commit)."""
+        s = ImportacionProductoFila.__table__
+        p = Producto.__table__
+        session = self.db.session
+        de_esta = s.c.importacion_id == importacion.id
+
+        # La misma clave más abajo en la hoja -> esta fila no se aplica
+        posterior = s.alias('posterior')
+        session.execute(s.update().where(
+            de_esta, s.c.error.is_(None),
+            exists().where(posterior.c.importacion_id == s.c.importacion_id,
+                           posterior.c.nombre == s.c.nombre,
+                           posterior.c.error.is_(None),
+                           posterior.c.fila > s.c.fila)
+        ).values(accion='duplicado'))
+
+        existente = select(func.min(p.c.id)).where(p.c.nombre == s.c.nombre).scalar_subquery()
+        session.execute(s.update().where(de_esta, s.c.error.is_(None), s.c.accion.is_(None))
+                        .values(producto_id=existente))
+
+        descripcion_actual = select(p.c.descripcion).where(p.c.id == s.c.producto_id).scalar_subquery()
+        session.execute(s.update().where(de_esta, s.c.accion.is_(None)).values(accion=case(
+            (s.c.error.isnot(None), 'invalido'),
+            (s.c.producto_id.is_(None), 'nuevo'),
+            (s.c.descripcion == descripcion_actual, 'igual'),
+            else_='cambio'
+        )))
+
+        conteos = dict(session.execute(
+            select(s.c.accion, func.count()).where(de_esta).group_by(s.c.accion)
+        ).all())
+        resumen = {accion: conteos.get(accion, 0) for accion in ACCIONES}
+        resumen['filas'] = sum(resumen.values())
+        importacion.resumen = json.dumps(resumen)
+        importacion.estado = 'previsualizada'
+        session.commit()
+        return resumen
+
+    def preview(self, importacion, limite=20):
+        """Primeros cambios y altas, para mostrarlos antes de confirmar."""
+        s = ImportacionProductoFila.__table__
+        p = Producto.__table__
+        filas = self.db.session.execute(
+            select(s.c.fila, s.c.accion, s.c.nombre, p.c.descripcion, s.c.descripcion)
+            .select_from(s.outerjoin(p, p.c.id == s.c.producto_id))
+            .where(s.c.importacion_id == importacion.id, s.c.accion.in_(('nuevo', 'cambio')))
+            .order_by(s.c.id).limit(limite)
+        )
+        return [{'fila': fila, 'accion': accion, 'clave': nombre, 'descripcion_actual': actual,
+                 'descripcion_nueva': nueva} for fila, accion, nombre, actual, nueva in filas]
+
+    # ---- 3. Aplicar ------------------------------------------------------------
+
+    def apply(self, importacion, on_chunk=None):
+        """Aplica nuevos y cambios por rangos de staging, un commit por rango."""
+        s = ImportacionProductoFila.__table__
+        p = Producto.__table__
+        session = self.db.session
+        importacion.estado = 'aplicando'
+        session.commit()
+
+        resumen = json.loads(importacion.resumen or '{}')
+        creados, actualizados = resumen.get('creados', 0), resumen.get('actualizados', 0)
+        aplicables = and_(s.c.importacion_id == importacion.id, s.c.accion.in_(('nuevo', 'cambio')))
+        while True:
+            ids = session.execute(
+                select(s.c.id).where(aplicables, s.c.id > importacion.aplicado_hasta)
+                .order_by(s.c.id).limit(self.chunk_size)
+            ).scalars().all()
+            if not ids:
+                break
+            en_rango = and_(aplicables, s.c.id.between(ids[0], ids[-1]))
+            now = datetime.utcnow()
+
+            nuevos = select(s.c.nombre, s.c.descripcion, literal(0.0), literal(0), literal(CATEGORIA),
+                            literal(now), literal(now)).where(
+                en_rango, s.c.accion == 'nuevo', ~exists().where(p.c.nombre == s.c.nombre))
+            creados += session.execute(p.insert().from_select(
+                ['nombre', 'descripcion', 'precio', 'cantidad', 'categoria', 'fecha_creacion',
+                 'fecha_actualizacion'], nuevos)).rowcount
+
+            cambio = and_(en_rango, s.c.accion == 'cambio')
+            actualizados += session.execute(p.update().where(
+                p.c.id.in_(select(s.c.producto_id).where(cambio))
+            ).values(
+                descripcion=select(s.c.descripcion).where(cambio, s.c.producto_id == p.c.id)
+                .limit(1).scalar_subquery(),
+                fecha_actualizacion=now
+            )).rowcount
+
+            # El avance se confirma con los cambios del rango
+            importacion.aplicado_hasta = ids[-1]
+            resumen.update(creados=creados, actualizados=actualizados)
+            importacion.resumen = json.dumps(resumen)
+            session.commit()
+            if on_chunk:
+                on_chunk(importacion)
+
+        if creados or actualizados:
+            rebuild_estadisticas(self.db)
+        importacion.estado = 'aplicada'
+        importacion.fecha_aplicacion = datetime.utcnow()
+        resumen.update(creados=creados, actualizados=actualizados)
+        importacion.resumen = json.dumps(resumen)
+        # Sólo se conservan las filas inválidas (para el reporte de errores)
+        session.execute(s.delete().where(s.c.importacion_id == importacion.id, s.c.accion != 'invalido'))
+        session.commit()
+        if self.on_change and (creados or actualizados):
+            self.on_change()
+        logger.info(f"[IMPORT] Importación {importacion.id} aplicada: {resumen}")
+        return resumen
+
+    def reserve_apply(self, importacion_id):
+        """Pasa la importación a 'encolada' si se puede aplicar (sin commit).
+
+        Compare-and-set en un solo UPDATE: desde 'previsualizada', o desde
+        'encolada' / 'aplicando' (relanzar tras un fallo), y siempre que no
+        haya un trabajo 'importar_productos' pendiente o en curso para ella
+        (una subida sin dry_run pasa por 'previsualizada' antes de aplicar en
+        el mismo trabajo). Dos confirmaciones simultáneas no pueden lanzar dos
+        apply() a la vez: sólo una ve rowcount 1.
+        """
+        i = ImportacionProductos.__table__
+        return self.db.session.execute(
+            i.update().where(i.c.id == importacion_id,
+                             i.c.estado.in_(('previsualizada',) + RELANZABLES),
+                             ~_trabajo_activo(i.c.id))
+            .values(estado='encolada')
+        ).rowcount == 1
+
+    # ---- Utilidades ------------------------------------------------------------
+
+    def errores(self, importacion):
+        """Filas inválidas como dicts (fila, clave, error), en orden."""
+        s = ImportacionProductoFila.__table__
+        filas = self.db.session.execute(
+            select(s.c.fila, s.c.nombre, s.c.error)
+            .where(s.c.importacion_id == importacion.id, s.c.accion == 'invalido').order_by(s.c.id)
+        )
+        return ({'fila': fila, 'clave': nombre or '', 'error': error} for fila, nombre, error in filas)
+
+    def discard(self, importacion_id):
+        """Descarta una importación previsualizada sin trabajo activo (con commit).
+
+        Mismo compare-and-set que reserve_apply(): devuelve False (sin tocar
+        staging) si la importación ya no está 'previsualizada' o un trabajo
+        la va a aplicar.
+        """
+        i = ImportacionProductos.__table__
+        s = ImportacionProductoFila.__table__
+        session = self.db.session
+        descartada = session.execute(
+            i.update().where(i.c.id == importacion_id, i.c.estado == 'previsualizada',
+                             ~_trabajo_activo(i.c.id))
+            .values(estado='descartada')
+        ).rowcount == 1
+        if not descartada:
+            session.rollback()
+            return False
+        session.execute(s.delete().where(s.c.importacion_id == importacion_id))
+        session.commit()
+        self._remove_upload(importacion_id)
+        return True
+
+    def purge_expired(self):
+        """Borra importaciones (y su staging) de hace más de `retention_hours`."""
+        s = ImportacionProductoFila.__table__
+        i = ImportacionProductos.__table__
+        viejas = select(i.c.id).where(i.c.fecha_creacion < datetime.utcnow() - self.retention,
+                                      i.c.estado.notin_(RELANZABLES), ~_trabajo_activo(i.c.id))
+        session = self.db.session
+        ids = session.execute(viejas).scalars().all()
+        if not ids:
+            return 0
+        session.execute(s.delete().where(s.c.importacion_id.in_(ids)))
+        session.execute(i.delete().where(i.c.id.in_(ids)))
+        session.commit()
+        for importacion_id in ids:
+            self._remove_upload(importacion_id)
+        return len(ids)
+
+    def _remove_upload(self, importacion_id):
+        try:
+            os.remove(self.upload_path(importacion_id))
+        except OSError:
+            pass
+
+
+def _trabajo_activo(importacion_id):
+    """EXISTS de un trabajo 'importar_productos' pendiente o en curso para la importación.
+
+    jobs no tiene columna de importación: se busca el id (uuid hex) en params.
+    """
+    j = Job.__table__
+    return exists().where(j.c.tipo == TIPO, j.c.estado.in_(('pendiente', 'en_curso')),
+                          j.c.params.contains(importacion_id))
+
+
+def contar_filas(path):
+    """Filas declaradas en la hoja (dimensión), para el progreso; None si no consta."""
+    import openpyxl
+
+    wb = openpyxl.load_workbook(path, read_only=True)
+    try:
+        return wb.active.max_row
+    finally:
+        wb.close()
+
+
+def importar_job(ctx, importer):
+    """Handler del trabajo 'importar_productos': staging + diff y, si se pide, aplicar.
+
+    Reanudable: cada fase continúa desde lo ya confirmado en la importación.
+    """
+    session = importer.db.session
+    importacion = session.get(ImportacionProductos, ctx.params['importacion_id'])
+    if importacion is None:
+        raise ValueError('Importación no encontrada')
+
+    if importacion.estado == 'cargando':
+        path = importer.upload_path(importacion.id)
+        if not os.path.exists(path):
+            raise ValueError('El fichero de la importación ya no existe')
+        total = contar_filas(path)
+        ctx.progress(importacion.filas_leidas, total, 'Leyendo hoja', force=True)
+        importer.stage(importacion, path, on_chunk=lambda imp: ctx.progress(imp.filas_leidas, total))
+        ctx.progress(importacion.filas_leidas, total, 'Comparando con el catálogo', force=True)
+        importer.diff(importacion)
+        importer._remove_upload(importacion.id)
+
+    if ctx.params.get('aplicar') and importacion.estado in ('previsualizada',) + RELANZABLES:
+        resumen = json.loads(importacion.resumen or '{}')
+        total = resumen.get('nuevo', 0) + resumen.get('cambio', 0)
+
+        def _aplicado(imp):
+            hecho = json.loads(imp.resumen)
+            ctx.progress(hecho.get('creados', 0) + hecho.get('actualizados', 0), total)
+
+        ctx.progress(resumen.get('creados', 0) + resumen.get('actualizados', 0), total, 'Aplicando cambios',
+                     force=True)
+        importer.apply(importacion, on_chunk=_aplicado)
+
+    return {'importacion_id': importacion.id, 'estado': importacion.estado,
+            'resumen': json.loads(importacion.resumen or '{}')}
@@ -0,0 +1,201 @@
+"""
+Búsqueda de productos por texto.
+
+Motores (SEARCH_ENGINE):
+- fts: PostgreSQL full-text. Usa la columna productos.search_vector
+  (tsvector con pesos nombre A / categoría B / descripción C, configuración
+  es_unaccent = spanish + unaccent) mantenida por trigger e indexada con GIN
+  (migrations/productos_search.sql). Cada término se busca como prefijo y
+  los resultados se ordenan por ts_rank_cd.
+- memory: índice invertido en el proceso (token -> ids), para SQLite y
+  tests. Se recarga cuando cambia la versión 'productos' de cache_versions.
+- like: el ILIKE '%q%' anterior, sin índice.
+- auto (default): en PostgreSQL, fts si la migración está aplicada y si no
+  like (con avisos en el log; no se carga el catálogo entero en cada worker
+  de producción); en los demás motores (SQLite, tests), memory. fts pedido
+  fuera de PostgreSQL también usa memory.
+
+Todos exponen filter(query, q): añade el filtro y el orden por relevancia a
+una consulta de Producto.
+"""
+import bisect
+import logging
+import re
+import threading
+import time
+import unicodedata
+
+from sqlalchemy import case, false, func, literal_column, text
+
+from cache_versions import get_version
+from models import Producto
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = 'productos'
+TS_CONFIG = 'es_unaccent'
+
+_RE_TOKEN = re.compile(r'\w+', re.UNICODE)
+
+# Peso de nombre / categoría / descripción en el índice en memoria (A/B/C del tsvector)
+FIELD_WEIGHTS = (3.0, 2.0, 1.0)
+
+
+def normalize_text(value):
+    """Minúsculas y sin acentos: 'Tornillería' -> 'tornilleria'."""
+    value = unicodedata.normalize('NFKD', value or '')
+    return ''.join(c for c in value if not unicodedata.combining(c)).lower()
+
+
+def tokenize(value):
+    return _RE_TOKEN.findall(normalize_text(value))
+
+
+class LikeSearch(object):
+    name = 'like'
+
+    def filter(self, query, q):
+        return query.filter(
+            Producto.nombre.ilike(f'%{q}%') | Producto.descripcion.ilike(f'%{q}%')
+        )
+
+
+class PostgresFullTextSearch(object):
+    name = 'fts'
+
+    def filter(self, query, q):
+        tokens = tokenize(q)
+        if not tokens:
+            return query.filter(false())
+        # Los tokens sólo contienen \w, así que no hay operadores de tsquery que escapar
+        tsquery = func.to_tsquery(TS_CONFIG, ' & '.join(f'{t}:*' for t in tokens))
+        vector = literal_column('productos.search_vector')
+        return (query.filter(vector.op('@@')(tsquery))
+                .order_by(func.ts_rank_cd(vector, tsquery).desc(), Producto.id))
+
+
+class InMemorySearch(object):
+    """Índice invertido por worker con coincidencia por prefijo."""
+    name = 'memory'
+
+    def __init__(self, db, check_interval=2.0):
+        self.db = db
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._postings = {}      # token -> {producto_id: peso}
+        self._tokens = []        # tokens ordenados, para buscar prefijos con bisect
+        self.version = None
+        self._checked_at = 0.0
+
+    def mark_stale(self):
+        """Fuerza comprobar la versión en la próxima búsqueda."""
+        self._checked_at = 0.0
+
+    def reset(self):
+        with self._lock:
+            self._postings = {}
+            self._tokens = []
+            self.version = None
+        self._checked_at = 0.0
+
+    def ensure_fresh(self):
+        now = time.monotonic()
+        if self.version is not None and now - self._checked_at < self.check_interval:
+            return
+        version = get_version(self.db, VERSION_KEY)
+        self._checked_at = now
+        if version != self.version:
+            self._build(version)
+
+    def _build(self, version):
+        postings = {}
+        rows = self.db.session.query(Producto.id, Producto.nombre, Producto.categoria, Producto.descripcion)
+        for pid, *campos in rows:
+            for valor, peso in zip(campos, FIELD_WEIGHTS):
+                for token in tokenize(valor):
+                    docs = postings.setdefault(token, {})
+                    docs[pid] = docs.get(pid, 0.0) + peso
+        with self._lock:
+            self._postings = postings
+            self._tokens = sorted(postings)
+            self.version = version
+
+    def _match_prefix(self, prefix):
+        scores = {}
+        i = bisect.bisect_left(self._tokens, prefix)
+        while i < len(self._tokens) and self._tokens[i].startswith(prefix):
+            for pid, peso in self._postings[self._tokens[i]].items():
+                scores[pid] = scores.get(pid, 0.0) + peso
+            i += 1
+        return scores
+
+    def search_ids(self, q):
+        """Ids ordenados por relevancia; todos los términos deben coincidir."""
+        self.ensure_fresh()
+        total = None
+        for token in tokenize(q):
+            scores = self._match_prefix(token)
+            if total is None:
+                total = scores
+            else:
+                total = {pid: total[pid] + s for pid, s in scores.items() if pid in total}
+            if not total:
+                return []
+        if not total:
+            return []
+        return sorted(total, key=lambda pid: (-total[pid], pid))
+
+    def filter(self, query, q):
+        ids = self.search_ids(q)
+        if not ids:
+            return query.filter(false())
+        orden = case({pid: i for i, pid in enumerate(ids)}, value=Producto.id)
+        return query.filter(Producto.id.in_(ids)).order_by(orden)
+
+
+def _fts_available(db):
+    try:
+        return bool(db.session.execute(text(
+            "SELECT 1 FROM information_schema.columns "
+            "WHERE table_name = 'productos' AND column_name = 'search_vector'"
+        )).scalar())
+    except Exception as e:
+        db.session.rollback()
+        logger.warning(f"[BUSQUEDA] No se pudo comprobar search_vector: {e}")
+        return False
+
+
+class ProductSearch(object):
+    """Elige el motor según SEARCH_ENGINE y el dialecto de la BD (al primer uso)."""
+
+    def __init__(self, db, engine='auto', check_interval=2.0):
+        self.db = db
+        self.requested = engine
+        self.memory = InMemorySearch(db, check_interval=check_interval)
+        self._engine = None
+
+    @property
+    def engine(self):
+        if self._engine is None:
+            self._engine = self._select_engine()
+            logger.info(f"[BUSQUEDA] Motor de búsqueda de productos: {self._engine.name}")
+        return self._engine
+
+    def _select_engine(self):
+        if self.requested == 'like':
+            return LikeSearch()
+        if self.requested == 'memory':
+            return self.memory
+        if self.db.engine.dialect.name == 'postgresql':
+            if _fts_available(self.db):
+                return PostgresFullTextSearch()
+            logger.warning("[BUSQUEDA] Falta productos.search_vector (aplicar migrations/productos_search.sql); "
+                           "se usa ILIKE")
+            return LikeSearch()
+        return self.memory
+
+    def filter(self, query, q):
+        q = (q or '').strip()
+        if not q:
+            return query
+        return self.engine.filter(query, q)
@@ -0,0 +1,235 @@
+"""
+Limitador de intentos (login) con ventana deslizante.
+
+Se usa el contador de ventana deslizante aproximado: por clave sólo se
+guardan el número de la ventana fija actual, su conteo y el de la ventana
+anterior; la estimación es `count + prev_count * (fracción restante de la
+ventana anterior)`. Cada intento cuesta una operación O(1) en el almacén.
+
+Almacenes:
+- MemoryRateLimitStore: dict LRU con TTL, sólo válido con un worker.
+- SQLRateLimitStore: tabla `rate_limits` con upsert atómico; sirve con la
+  BD principal (PostgreSQL) o con un fichero SQLite local compartido por
+  los workers de la misma máquina.
+"""
+import logging
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import BigInteger, Column, Float, Index, Integer, MetaData, String, Table, case, create_engine, select
+
+logger = logging.getLogger(__name__)
+
+metadata = MetaData()
+
+rate_limits = Table(
+    'rate_limits', metadata,
+    Column('key', String(255), primary_key=True),
+    Column('window_id', BigInteger, nullable=False),
+    Column('count', Integer, nullable=False, default=0),
+    Column('prev_count', Integer, nullable=False, default=0),
+    Column('locked_until', Float, nullable=False, default=0),
+    Column('expires_at', Float, nullable=False),
+    Index('ix_rate_limits_expires_at', 'expires_at'),
+)
+
+
+class MemoryRateLimitStore(object):
+    """Almacén en proceso: OrderedDict acotado, las entradas caducan solas."""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def incr(self, key, window_id, expires_at, now):
+        with self._lock:
+            entry = self._get(key, now)
+            if entry is None:
+                entry = [window_id, 0, 0, 0.0, expires_at]
+            elif entry[0] != window_id:
+                entry[2] = entry[1] if entry[0] == window_id - 1 else 0
+                entry[1] = 0
+                entry[0] = window_id
+            entry[1] += 1
+            entry[4] = max(entry[3], expires_at)
+            self._data[key] = entry
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+            return entry[1], entry[2], entry[3]
+
+    def locked_until(self, key, now):
+        with self._lock:
+            entry = self._get(key, now)
+            return entry[3] if entry else 0.0
+
+    def lock(self, key, until):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                entry[3] = until
+                entry[4] = max(entry[4], until)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def _get(self, key, now):
+        entry = self._data.get(key)
+        if entry is not None and entry[4] < now:
+            del self._data[key]
+            return None
+        return entry
+
+
+class SQLRateLimitStore(object):
+    """Almacén compartido en una tabla SQL (PostgreSQL o SQLite)."""
+
+    def __init__(self, engine=None, db=None, purge_interval=60):
+        """Recibe un engine propio o la instancia `db` de Flask-SQLAlchemy
+        (se usa su engine, con conexiones independientes de la sesión)."""
+        self._engine = engine
+        self.db = db
+        self.purge_interval = purge_interval
+        self._created = False
+        self._last_purge = 0.0
+
+    @property
+    def engine(self):
+        return self._engine if self._engine is not None else self.db.engine
+
+    def incr(self, key, window_id, expires_at, now):
+        engine = self._ensure_table()
+        t = rate_limits
+        stmt = self._insert(engine).values(
+            key=key, window_id=window_id, count=1, prev_count=0, locked_until=0, expires_at=expires_at
+        )
+        # En ON CONFLICT las columnas de `t` son los valores previos de la fila
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[t.c.key],
+            set_={
+                'prev_count': case((t.c.window_id == window_id, t.c.prev_count),
+                                   (t.c.window_id == window_id - 1, t.c.count), else_=0),
+                'count': case((t.c.window_id == window_id, t.c.count + 1), else_=1),
+                'window_id': window_id,
+                'expires_at': case((t.c.locked_until > expires_at, t.c.locked_until), else_=expires_at),
+            }
+        ).returning(t.c.count, t.c.prev_count, t.c.locked_until)
+        with engine.begin() as conn:
+            count, prev_count, locked_until = conn.execute(stmt).one()
+        self._maybe_purge(engine, now)
+        return count, prev_count, locked_until
+
+    def locked_until(self, key, now):
+        engine = self._ensure_table()
+        with engine.connect() as conn:
+            row = conn.execute(
+                select(rate_limits.c.locked_until).where(rate_limits.c.key == key, rate_limits.c.expires_at >= now)
+            ).first()
+        return row[0] if row else 0.0
+
+    def lock(self, key, until):
+        engine = self._ensure_table()
+        with engine.begin() as conn:
+            conn.execute(rate_limits.update().where(rate_limits.c.key == key)
+                         .values(locked_until=until, expires_at=until))
+
+    def delete(self, key):
+        engine = self._ensure_table()
+        with engine.begin() as conn:
+            conn.execute(rate_limits.delete().where(rate_limits.c.key == key))
+
+    def _ensure_table(self):
+        engine = self.engine
+        if not self._created:
+            metadata.create_all(engine, checkfirst=True)
+            self._created = True
+        return engine
+
+    def _insert(self, engine):
+        if engine.dialect.name == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        return insert(rate_limits)
+
+    def _maybe_purge(self, engine, now):
+        if now - self._last_purge < self.purge_interval:
+            return
+        self._last_purge = now
+        try:
+            with engine.begin() as conn:
+                conn.execute(rate_limits.delete().where(rate_limits.c.expires_at < now))
+        except Exception as e:
+            logger.warning(f"[RATE_LIMIT] No se pudieron purgar entradas caducadas: {e}")
+
+
+class RateLimiter(object):
+    """Bloquea una clave tras `limit` fallos dentro de `window` segundos."""
+
+    def __init__(self, store, limit=5, window=300, lockout=300):
+        self.store = store
+        self.limit = max(1, int(limit))
+        self.window = max(1, int(window))
+        self.lockout = max(1, int(lockout))
+
+    @classmethod
+    def from_env(cls, db):
+        """RATE_LIMIT_BACKEND: memory (un worker), sql (BD principal) o sqlite (fichero local)."""
+        backend = os.getenv('RATE_LIMIT_BACKEND', 'sql').lower()
+        if backend == 'memory':
+            store = MemoryRateLimitStore(max_entries=int(os.getenv('RATE_LIMIT_MAX_ENTRIES', '10000')))
+        elif backend == 'sqlite':
+            path = os.getenv('RATE_LIMIT_SQLITE_PATH', '/tmp/catalogo_rate_limits.db')
+            engine = create_engine(f'sqlite:///{path}', connect_args={'timeout': 5})
+            store = SQLRateLimitStore(engine=engine)
+        else:
+            store = SQLRateLimitStore(db=db)
+        return cls(
+            store,
+            limit=int(os.getenv('MAX_LOGIN_ATTEMPTS', '5')),
+            window=int(os.getenv('RATE_LIMIT_WINDOW_SECONDS', os.getenv('LOCKOUT_SECONDS', '300'))),
+            lockout=int(os.getenv('LOCKOUT_SECONDS', '300'))
+        )
+
+    def retry_after(self, key, now=None):
+        """Segundos que le quedan de bloqueo a `key` (0 si puede intentar)."""
+        now = now or time.time()
+        try:
+            until = self.store.locked_until(key, now)
+        except Exception as e:
+            logger.error(f"[RATE_LIMIT] Error consultando bloqueo de {key}: {e}")
+            return 0
+        return int(math.ceil(until - now)) if until > now else 0
+
+    def hit(self, key, now=None):
+        """Registra un fallo. Devuelve (intentos_estimados, segundos_de_bloqueo)."""
+        now = now or time.time()
+        window_id = int(now // self.window)
+        expires_at = (window_id + 2) * self.window
+        try:
+            count, prev_count, locked_until = self.store.incr(key, window_id, expires_at, now)
+        except Exception as e:
+            logger.error(f"[RATE_LIMIT] Error registrando intento de {key}: {e}")
+            return 0, 0
+        elapsed = (now - window_id * self.window) / self.window
+        estimado = count + prev_count * (1.0 - elapsed)
+        if locked_until > now:
+            return int(estimado), int(math.ceil(locked_until - now))
+        if estimado >= self.limit:
+            try:
+                self.store.lock(key, now + self.lockout)
+            except Exception as e:
+                logger.error(f"[RATE_LIMIT] Error bloqueando {key}: {e}")
+            return int(estimado), self.lockout
+        return int(estimado), 0
+
+    def reset(self, key):
+        try:
+            self.store.delete(key)
+        except Exception as e:
+            logger.error(f"[RATE_LIMIT] Error limpiando {key}: {e}")
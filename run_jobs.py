@@ -0,0 +1,29 @@
+#!/usr/bin/env python
+"""
+Procesa los trabajos en segundo plano (jobs.py) en un proceso dedicado.
+
+Uso (dentro del contenedor):
+    python run_jobs.py           # bucle continuo
+    python run_jobs.py pendientes  # procesa los pendientes y termina
+
+Útil con JOBS_WORKERS=0 para que los workers de gunicorn no ejecuten
+trabajos pesados y sólo los encolen.
+"""
+import sys
+
+from app import app, job_queue
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'pendientes':
+        with app.app_context():
+            job_queue.recover_stale()
+            print('Trabajos procesados:', job_queue.run_pending())
+    elif len(sys.argv) > 1:
+        print(__doc__)
+        sys.exit(1)
+    else:
+        try:
+            job_queue.run_forever()
+        except KeyboardInterrupt:
+            job_queue.stop()
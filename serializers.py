@@ -0,0 +1,329 @@
+"""
+Serialización de modelos para la API y las vistas.
+
+Cada forma (`Shape`) declara qué campos devuelve un endpoint y qué
+relaciones recorre; a partir de ella se generan las opciones de carga
+(selectinload para colecciones, joinedload para muchos-a-uno), así que una
+respuesta cuesta un número fijo de consultas y no una por fila y relación
+como los to_dict() encadenados de los modelos.
+
+Si una forma sólo tiene columnas del modelo, prepare() sustituye la
+entidad por esas columnas (with_entities) y se serializa directamente desde
+las tuplas, sin construir objetos ORM.
+
+En productos, `fields=` proyecta los campos escalares e `include=` añade
+las relaciones opcionales.
+"""
+from sqlalchemy import inspect
+from sqlalchemy.orm import joinedload, selectinload
+
+from models import (
+    ClaveProceso, ClaveProducto, ComentarioTicket, ComponenteMáquina, EstacionTrabajo, HistorialPreciosProveedor,
+    HojaRuta, Máquina, Permission, Producto, ProductoProveedor, Proveedor, Role, Ticket, Usuario
+)
+
+
+def _iso(value):
+    return value.isoformat() if value else None
+
+
+def _iso_attr(name):
+    return lambda obj: _iso(getattr(obj, name))
+
+
+def _blank_attr(name):
+    """Valor o '' (convención de las estaciones en las plantillas)."""
+    return lambda obj: getattr(obj, name) or ''
+
+
+# ==================== Formas ====================
+
+class Rel(object):
+    """Relación dentro de una forma.
+
+    shape=None carga la relación sin volcarla (la usa algún getter);
+    sort_key ordena la colección ya cargada.
+    """
+    __slots__ = ('shape', 'sort_key')
+
+    def __init__(self, shape=None, sort_key=None):
+        self.shape = shape
+        self.sort_key = sort_key
+
+
+class Shape(object):
+    """Campos y relaciones que devuelve un endpoint para un modelo."""
+
+    def __init__(self, model, fields, getters=None, relations=None):
+        self.model = model
+        self.fields = tuple(fields)
+        self.getters = dict(getters or {})
+        self.relations = dict(relations or {})
+        mapper = inspect(model)
+        self._many = {name: mapper.relationships[name].uselist for name in self.relations}
+        # Sólo columnas propias y sin relaciones -> se puede leer como tuplas
+        self.columnar = not self.relations and all(f in mapper.column_attrs for f in self.fields)
+
+    def select(self, fields=None, relations=None, getters=None):
+        """Variante con otros campos, relaciones y/o getters adicionales."""
+        return Shape(self.model, self.fields if fields is None else fields, dict(self.getters, **(getters or {})),
+                     self.relations if relations is None else relations)
+
+    def loader_options(self):
+        options = []
+        for name, rel in self.relations.items():
+            attr = getattr(self.model, name)
+            option = selectinload(attr) if self._many[name] else joinedload(attr)
+            if rel.shape is not None:
+                nested = rel.shape.loader_options()
+                if nested:
+                    option = option.options(*nested)
+            options.append(option)
+        return options
+
+    def prepare(self, query):
+        """Añade a `query` las opciones de carga, o la reduce a columnas si la forma lo permite."""
+        if self.columnar:
+            return query.with_entities(*(getattr(self.model, f) for f in self.fields))
+        options = self.loader_options()
+        return query.options(*options) if options else query
+
+    def dump(self, obj):
+        data = {}
+        for f in self.fields:
+            getter = self.getters.get(f)
+            data[f] = getter(obj) if getter else getattr(obj, f)
+        for name, rel in self.relations.items():
+            if rel.shape is None:
+                continue
+            value = getattr(obj, name)
+            if self._many[name]:
+                items = sorted(value, key=rel.sort_key) if rel.sort_key else value
+                data[name] = [rel.shape.dump(item) for item in items]
+            else:
+                data[name] = rel.shape.dump(value) if value is not None else None
+        return data
+
+    def dump_all(self, query):
+        return [self.dump(row) for row in self.prepare(query)]
+
+
+# ==================== Utilidades ====================
+
+def parse_fields(value, allowed, default, required=('id',)):
+    """'id,nombre' -> ('id', 'nombre'). ValueError si algún campo no existe.
+
+    Los campos de `required` se añaden al principio si no se pidieron.
+    """
+    if not value:
+        return tuple(default)
+    fields = tuple(f.strip() for f in value.split(',') if f.strip())
+    invalidos = [f for f in fields if f not in allowed]
+    if invalidos:
+        raise ValueError(f"Campos no válidos: {', '.join(invalidos)}")
+    faltan = tuple(f for f in required if f not in fields)
+    return faltan + fields
+
+
+def parse_includes(value, allowed):
+    """'proveedores,historial' -> frozenset. ValueError si alguna relación no existe."""
+    if not value:
+        return frozenset()
+    includes = frozenset(i.strip() for i in value.split(',') if i.strip())
+    invalidos = sorted(includes - set(allowed))
+    if invalidos:
+        raise ValueError(f"Relaciones no válidas: {', '.join(invalidos)}")
+    return includes
+
+
+def paginate_by_id(query, id_column, cursor, limit):
+    """Página por clave (id ascendente). Devuelve (filas, next_cursor)."""
+    if cursor:
+        try:
+            query = query.filter(id_column > int(cursor))
+        except (TypeError, ValueError):
+            raise ValueError('cursor no válido')
+    rows = query.order_by(id_column).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = str(rows[-1].id)
+    return rows, next_cursor
+
+
+# ==================== Productos y proveedores ====================
+
+PRODUCTO_FIELDS = ('id', 'nombre', 'descripcion', 'precio', 'cantidad', 'imagen_url', 'categoria',
+                   'fecha_creacion', 'fecha_actualizacion')
+PRODUCTO_PUBLIC_FIELDS = ('id', 'nombre', 'descripcion', 'precio', 'cantidad', 'imagen_url', 'categoria')
+PRODUCTO_INCLUDES = ('proveedores', 'historial')
+# Columnas por defecto de /api/productos/exportar (se puede pedir cualquiera de PRODUCTO_FIELDS)
+PRODUCTO_EXPORT_FIELDS = ('id', 'nombre', 'descripcion', 'precio', 'cantidad', 'categoria', 'fecha_creacion')
+
+PROVEEDOR = Shape(
+    Proveedor,
+    ('id', 'nombre', 'telefono', 'rfc', 'domicilio', 'correo', 'contacto', 'notas',
+     'fecha_creacion', 'fecha_actualizacion'),
+    getters={'fecha_creacion': _iso_attr('fecha_creacion'), 'fecha_actualizacion': _iso_attr('fecha_actualizacion')}
+)
+
+HISTORIAL_PRECIO = Shape(
+    HistorialPreciosProveedor,
+    ('id', 'producto_proveedor_id', 'precio', 'fecha_precio', 'notas', 'fecha_creacion'),
+    getters={'fecha_precio': _iso_attr('fecha_precio'), 'fecha_creacion': _iso_attr('fecha_creacion')}
+)
+
+PRODUCTO_PROVEEDOR = Shape(
+    ProductoProveedor,
+    ('id', 'producto_id', 'proveedor_id', 'precio_proveedor', 'fecha_precio', 'cantidad_minima', 'fecha_creacion'),
+    getters={'fecha_precio': _iso_attr('fecha_precio'), 'fecha_creacion': _iso_attr('fecha_creacion')},
+    relations={'proveedor': Rel(PROVEEDOR)}
+)
+
+PRODUCTO_PROVEEDOR_HISTORIAL = PRODUCTO_PROVEEDOR.select(
+    relations={'proveedor': Rel(PROVEEDOR), 'historial_precios': Rel(HISTORIAL_PRECIO)}
+)
+
+PRODUCTO = Shape(
+    Producto, PRODUCTO_FIELDS,
+    getters={'fecha_creacion': _iso_attr('fecha_creacion'), 'fecha_actualizacion': _iso_attr('fecha_actualizacion')}
+)
+
+
+def producto_shape(fields=PRODUCTO_FIELDS, includes=frozenset()):
+    """Forma de producto para `fields=` / `include=` (historial implica proveedores)."""
+    if 'historial' in includes:
+        relations = {'proveedores': Rel(PRODUCTO_PROVEEDOR_HISTORIAL)}
+    elif includes:
+        relations = {'proveedores': Rel(PRODUCTO_PROVEEDOR)}
+    else:
+        relations = {}
+    return PRODUCTO.select(fields=fields, relations=relations)
+
+
+# ==================== Máquinas y hojas de ruta ====================
+
+COMPONENTE_MAQUINA = Shape(ComponenteMáquina, ('id', 'maquina_id', 'nombre', 'descripcion', 'orden'))
+
+MAQUINA = Shape(
+    Máquina,
+    ('id', 'nombre', 'plantilla_default', 'tipo', 'descripcion', 'imagen_url', 'fecha_creacion',
+     'fecha_actualizacion'),
+    getters={'fecha_creacion': _iso_attr('fecha_creacion'), 'fecha_actualizacion': _iso_attr('fecha_actualizacion')},
+    relations={'componentes': Rel(COMPONENTE_MAQUINA)}
+)
+
+ESTACION_TRABAJO = Shape(
+    EstacionTrabajo,
+    ('id', 'hoja_ruta_id', 'pro_c', 'centro_trabajo', 'operacion', 'orden', 't_e', 't_tct', 't_tco', 't_to',
+     'total_piezas', 'operador', 'eficiencia', 'firma_supervisor', 'estado', 'fecha_inicio',
+     'fecha_finalizacion', 'notas', 'fecha_creacion'),
+    getters=dict(
+        {f: _blank_attr(f) for f in ('pro_c', 'centro_trabajo', 'operacion', 't_e', 't_tct', 't_tco', 't_to',
+                                     'total_piezas', 'operador', 'eficiencia', 'firma_supervisor', 'notas')},
+        fecha_inicio=lambda e: _iso(e.fecha_inicio) or '',
+        fecha_finalizacion=lambda e: _iso(e.fecha_finalizacion) or '',
+        fecha_creacion=_iso_attr('fecha_creacion')
+    )
+)
+
+
+def _orden_estacion(e):
+    return (e.orden or 0, e.id)
+
+
+HOJA_RUTA = Shape(
+    HojaRuta,
+    ('id', 'maquina_id', 'nombre', 'descripcion', 'producto', 'calidad', 'pn', 'revision', 'fecha_salida',
+     'cantidad_piezas', 'orden_trabajo_hr', 'orden_trabajo_pt', 'almacen', 'no_sin_orden', 'materia_prima',
+     'total_tiempo', 'dias_a_laborar', 'fecha_termino', 'aprobada', 'rechazada', 'scrap', 'retrabajo',
+     'supervisor', 'operador', 'eficiencia', 'fecha_creacion', 'fecha_actualizacion'),
+    getters={f: _iso_attr(f) for f in ('fecha_salida', 'fecha_termino', 'fecha_creacion', 'fecha_actualizacion')},
+    relations={'estaciones': Rel(ESTACION_TRABAJO, sort_key=_orden_estacion)}
+)
+
+# Listado reciente del formulario de hojas: nombre de la máquina con joinedload
+HOJA_RUTA_RECIENTE = Shape(
+    HojaRuta,
+    ('id', 'maquina', 'maquina_id', 'nombre', 'estado', 'cantidad_piezas', 'fecha_creacion'),
+    getters={
+        'maquina': lambda h: h.maquina.nombre if h.maquina else str(h.maquina_id),
+        'fecha_creacion': _iso_attr('fecha_creacion'),
+    },
+    relations={'maquina': Rel()}
+)
+
+
+# ==================== Claves de producto ====================
+
+CLAVE_PROCESO = Shape(
+    ClaveProceso,
+    ('id', 'clave_id', 'proceso_id', 'proceso_codigo', 'proceso_nombre', 'orden', 'centro_trabajo', 'operacion',
+     't_e', 't_tct', 't_tco', 't_to', 'tiempo_estimado', 'notas'),
+    getters={
+        'proceso_codigo': lambda cp: cp.proceso.codigo if cp.proceso else None,
+        'proceso_nombre': lambda cp: cp.proceso.nombre if cp.proceso else None,
+    },
+    relations={'proceso': Rel()}
+)
+
+# ClaveProducto.procesos ya está ordenado por ClaveProceso.orden (order_by de la relación)
+CLAVE_PRODUCTO = Shape(
+    ClaveProducto, ('id', 'clave', 'nombre'),
+    relations={'procesos': Rel(CLAVE_PROCESO)}
+)
+
+
+# ==================== Tickets ====================
+
+TICKET_BANDEJA = Shape(
+    Ticket,
+    ('id', 'numero_ticket', 'titulo', 'nombre_solicitante', 'email_solicitante', 'departamento', 'estado',
+     'prioridad', 'categoria', 'fecha_creacion'),
+    getters={'fecha_creacion': _iso_attr('fecha_creacion')}
+)
+
+COMENTARIO_TICKET = Shape(
+    ComentarioTicket, ('id', 'contenido', 'imagen_url', 'fecha_creacion'),
+    getters={'fecha_creacion': _iso_attr('fecha_creacion')}
+)
+
+COMENTARIO_TICKET_AUTOR = COMENTARIO_TICKET.select(
+    fields=COMENTARIO_TICKET.fields + ('ingeniero_nombre',),
+    relations={'ingeniero': Rel()},
+    getters={'ingeniero_nombre': lambda c: c.ingeniero.username if c.ingeniero else 'Desconocido'}
+)
+
+_TICKET_FECHAS = {f: _iso_attr(f) for f in ('fecha_creacion', 'fecha_asignacion', 'fecha_resolucion')}
+
+TICKET_ASIGNADO = Shape(
+    Ticket,
+    ('id', 'numero_ticket', 'titulo', 'nombre_solicitante', 'email_solicitante', 'departamento', 'descripcion',
+     'estado', 'prioridad', 'categoria', 'fecha_creacion', 'fecha_asignacion', 'fecha_resolucion',
+     'comentarios_count'),
+    getters=dict(_TICKET_FECHAS, comentarios_count=lambda t: len(t.comentarios)),
+    relations={'comentarios': Rel(COMENTARIO_TICKET)}
+)
+
+TICKET_DETALLE = Shape(
+    Ticket,
+    ('id', 'numero_ticket', 'titulo', 'nombre_solicitante', 'email_solicitante', 'departamento', 'descripcion',
+     'estado', 'prioridad', 'categoria', 'ingeniero_id', 'ingeniero_nombre', 'fecha_creacion',
+     'fecha_asignacion', 'fecha_resolucion'),
+    getters=dict(_TICKET_FECHAS, ingeniero_nombre=lambda t: t.ingeniero.username if t.ingeniero else None),
+    relations={'ingeniero': Rel(), 'comentarios': Rel(COMENTARIO_TICKET_AUTOR)}
+)
+
+
+# ==================== Usuarios y roles ====================
+
+PERMISSION = Shape(Permission, ('id', 'module', 'action', 'descripcion'))
+
+ROLE = Shape(Role, ('id', 'name', 'descripcion'), relations={'permissions': Rel(PERMISSION)})
+
+USUARIO_ADMIN = Shape(
+    Usuario,
+    ('id', 'username', 'correo', 'activo', 'es_admin', 'role', 'fecha_creacion'),
+    getters={'role': lambda u: u.role.name if u.role else None, 'fecha_creacion': _iso_attr('fecha_creacion')},
+    relations={'role': Rel()}
+)
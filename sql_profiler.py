@@ -0,0 +1,162 @@
+"""
+Perfilador de SQL por petición y detector de N+1.
+
+Escucha before/after_cursor_execute del engine, agrupa las sentencias por
+forma normalizada (literales y listas IN sustituidos por `?`) y marca como
+candidatas a N+1 las formas que se repiten `n1_threshold` o más veces en una
+misma petición.
+
+Modos (SQL_PROFILER_MODE):
+- off: no se registran eventos.
+- dev: se perfila cada petición; cabeceras X-SQL-Queries / X-SQL-Time-ms /
+  X-SQL-N1 en la respuesta.
+- sample: sólo una fracción `SQL_PROFILER_SAMPLE_RATE` de peticiones; el
+  resto sólo paga una comprobación en `g` por sentencia.
+
+Los últimos informes se guardan en memoria (por worker) y se consultan en
+/internal/sql-profile.
+"""
+import logging
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from functools import lru_cache
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+_RE_STRING = re.compile(r"'(?:[^']|'')*'")
+_RE_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_RE_PARAM = re.compile(r'%\([^)]+\)s|%s|:\w+|\$\d+|\?')
+_RE_IN_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_RE_SPACES = re.compile(r'\s+')
+
+
+@lru_cache(maxsize=2048)
+def normalize_sql(statement):
+    """Forma canónica de una sentencia: mismos valores -> misma clave."""
+    sql = _RE_STRING.sub('?', statement)
+    sql = _RE_PARAM.sub('?', sql)
+    sql = _RE_NUMBER.sub('?', sql)
+    sql = _RE_IN_LIST.sub('(?)', sql)
+    return _RE_SPACES.sub(' ', sql).strip()
+
+
+class SQLProfiler(object):
+    """Cuenta y cronometra las sentencias SQL de cada petición."""
+
+    def __init__(self, app=None, db=None, mode='off', sample_rate=0.01, n1_threshold=5, keep=50):
+        self.mode = mode if mode in ('off', 'dev', 'sample') else 'off'
+        self.sample_rate = min(max(float(sample_rate), 0.0), 1.0)
+        self.n1_threshold = max(2, int(n1_threshold))
+        self.reports = deque(maxlen=max(1, int(keep)))
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app, db)
+
+    @classmethod
+    def from_env(cls, app=None, db=None):
+        return cls(
+            app, db,
+            mode=os.getenv('SQL_PROFILER_MODE', 'off').lower(),
+            sample_rate=float(os.getenv('SQL_PROFILER_SAMPLE_RATE', '0.01')),
+            n1_threshold=int(os.getenv('SQL_PROFILER_N1_THRESHOLD', '5')),
+            keep=int(os.getenv('SQL_PROFILER_KEEP', '50'))
+        )
+
+    @property
+    def enabled(self):
+        return self.mode != 'off'
+
+    def init_app(self, app, db):
+        if not self.enabled:
+            return
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        with app.app_context():
+            self._instrument_engine(db.engine)
+        logger.info(f"[SQL_PROFILER] Activo en modo {self.mode}")
+
+    # ---- Eventos ---------------------------------------------------------------
+
+    def _instrument_engine(self, engine):
+        @event.listens_for(engine, 'before_cursor_execute')
+        def _before_cursor(conn, cursor, statement, parameters, context, executemany):
+            # En el contexto de la sentencia, no en conn.info: una sentencia que
+            # falla no deja su inicio en la conexión
+            if context is not None and has_request_context() and '_sqlprof' in g:
+                context._sqlprof_start = time.perf_counter()
+
+        @event.listens_for(engine, 'after_cursor_execute')
+        def _after_cursor(conn, cursor, statement, parameters, context, executemany):
+            if not (has_request_context() and '_sqlprof' in g):
+                return
+            start = getattr(context, '_sqlprof_start', None)
+            if start is None:
+                return
+            elapsed = time.perf_counter() - start
+            shapes = g._sqlprof['shapes']
+            shape = normalize_sql(statement)
+            entry = shapes.get(shape)
+            if entry is None:
+                shapes[shape] = [1, elapsed]
+            else:
+                entry[0] += 1
+                entry[1] += elapsed
+
+    def _before_request(self):
+        if request.path.startswith('/static'):
+            return
+        if self.mode == 'sample' and random.random() >= self.sample_rate:
+            return
+        g._sqlprof = {'shapes': {}, 'start': time.perf_counter()}
+
+    def _after_request(self, response):
+        prof = g.pop('_sqlprof', None)
+        if prof is None:
+            return response
+        report = self.build_report(prof)
+        with self._lock:
+            self.reports.append(report)
+        if report['n_plus_one']:
+            logger.warning(
+                f"[SQL_PROFILER] Posible N+1 en {report['endpoint']}: "
+                + '; '.join(f"{c['count']}x {c['sql'][:120]}" for c in report['n_plus_one'])
+            )
+        if self.mode == 'dev':
+            response.headers['X-SQL-Queries'] = str(report['queries'])
+            response.headers['X-SQL-Time-ms'] = str(report['db_ms'])
+            response.headers['X-SQL-N1'] = str(len(report['n_plus_one']))
+        return response
+
+    # ---- Informes ----------------------------------------------------------------
+
+    def build_report(self, prof):
+        shapes = sorted(
+            ({'sql': sql, 'count': count, 'total_ms': round(total * 1000, 3)}
+             for sql, (count, total) in prof['shapes'].items()),
+            key=lambda s: s['total_ms'], reverse=True
+        )
+        return {
+            'timestamp': datetime.utcnow().isoformat(),
+            'method': request.method,
+            'path': request.path,
+            'endpoint': request.url_rule.endpoint if request.url_rule else None,
+            'request_ms': round((time.perf_counter() - prof['start']) * 1000, 3),
+            'queries': sum(s['count'] for s in shapes),
+            'db_ms': round(sum(s['total_ms'] for s in shapes), 3),
+            'n_plus_one': [s for s in shapes if s['count'] >= self.n1_threshold],
+            'statements': shapes,
+        }
+
+    def recent(self, limit=None):
+        with self._lock:
+            reports = list(self.reports)
+        reports.reverse()
+        return reports[:limit] if limit else reports
@@ -139,27 +139,13 @@ function aplicarFiltros() {
 
 // EXPORT TO CSV
 function exportarCSV() {
-    fetch('/api/productos/exportar')
-        .then(response => {
-            if (!response.ok) throw new Error('Error en la descarga');
-            return response.blob();
-        })
-        .then(blob => {
-            // Create download link
-            const url = window.URL.createObjectURL(blob);
-            const a = document.createElement('a');
-            a.href = url;
-            a.download = `catalogo_${new Date().getTime()}.csv`;
-            document.body.appendChild(a);
-            a.click();
-            window.URL.revokeObjectURL(url);
-            document.body.removeChild(a);
-            alert('Catálogo exportado exitosamente');
-        })
-        .catch(error => {
-            console.error('Error exportando CSV:', error);
-            alert('Error al exportar el catálogo');
-        });
+    // Descarga directa: el navegador guarda el CSV a medida que llega (streaming)
+    const a = document.createElement('a');
+    a.href = '/api/productos/exportar';
+    a.download = `catalogo_${new Date().getTime()}.csv`;
+    document.body.appendChild(a);
+    a.click();
+    document.body.removeChild(a);
 }
 
 // VIEW LOW STOCK PRODUCTS
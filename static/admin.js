@@ -452,21 +452,15 @@ function mostrarMensaje(texto, tipo) {
 
 // ==================== EXPORTAR E IMPORTAR ====================
 function exportarExcel() {
-    fetch('/api/productos/exportar-excel')
+    // La exportación con imágenes se genera en segundo plano: encolar y consultar el progreso
+    fetch('/api/productos/exportar-excel', { method: 'POST' })
         .then(response => {
-            if (!response.ok) throw new Error('Error en la descarga');
-            return response.blob();
+            if (!response.ok) throw new Error('Error al iniciar la exportación');
+            return response.json();
         })
-        .then(blob => {
-            const url = window.URL.createObjectURL(blob);
-            const a = document.createElement('a');
-            a.href = url;
-            a.download = 'catalogo_productos.xlsx';
-            document.body.appendChild(a);
-            a.click();
-            window.URL.revokeObjectURL(url);
-            document.body.removeChild(a);
-            mostrarMensaje('✓ Catálogo exportado correctamente', 'success');
+        .then(job => {
+            mostrarMensaje('⏳ Generando catálogo Excel...', 'success');
+            esperarJob(job.id);
         })
         .catch(error => {
             console.error('Error:', error);
@@ -474,30 +468,46 @@ function exportarExcel() {
         });
 }
 
-function exportarCSV() {
-    fetch('/api/productos/exportar')
+function esperarJob(jobId) {
+    fetch(`/api/jobs/${jobId}`)
         .then(response => {
-            if (!response.ok) throw new Error('Error en la descarga');
-            return response.text();
+            if (!response.ok) throw new Error('Error al consultar la exportación');
+            return response.json();
         })
-        .then(csv => {
-            const blob = new Blob([csv], { type: 'text/csv' });
-            const url = window.URL.createObjectURL(blob);
-            const a = document.createElement('a');
-            a.href = url;
-            a.download = 'productos.csv';
-            document.body.appendChild(a);
-            a.click();
-            window.URL.revokeObjectURL(url);
-            document.body.removeChild(a);
-            mostrarMensaje('✓ Catálogo exportado como CSV', 'success');
+        .then(job => {
+            if (job.estado === 'completado') {
+                const a = document.createElement('a');
+                a.href = job.descarga_url;
+                document.body.appendChild(a);
+                a.click();
+                document.body.removeChild(a);
+                mostrarMensaje('✓ Catálogo exportado correctamente', 'success');
+            } else if (job.estado === 'error') {
+                mostrarMensaje(`✗ Error al exportar catálogo: ${job.error || ''}`, 'error');
+            } else {
+                if (job.progreso !== null) {
+                    mostrarMensaje(`⏳ Generando catálogo Excel... ${Math.round(job.progreso)}%`, 'success');
+                }
+                setTimeout(() => esperarJob(jobId), 1500);
+            }
         })
         .catch(error => {
             console.error('Error:', error);
-            mostrarMensaje('✗ Error al exportar CSV', 'error');
+            mostrarMensaje('✗ Error al exportar catálogo', 'error');
         });
 }
 
+function exportarCSV() {
+    // Descarga directa: el navegador guarda el CSV a medida que llega (streaming)
+    const a = document.createElement('a');
+    a.href = '/api/productos/exportar';
+    a.download = 'productos.csv';
+    document.body.appendChild(a);
+    a.click();
+    document.body.removeChild(a);
+    mostrarMensaje('✓ Exportación de catálogo iniciada', 'success');
+}
+
 // Manejador para importar Excel
 document.addEventListener('DOMContentLoaded', function() {
     const inputArchivo = document.getElementById('archivo-importar');
@@ -512,30 +522,68 @@ document.addEventListener('DOMContentLoaded', function() {
     }
 });
 
+function terminarJob(jobId, etiqueta) {
+    // Promesa que se resuelve con el trabajo completado (o se rechaza si falla)
+    return fetch(`/api/jobs/${jobId}`)
+        .then(response => {
+            if (!response.ok) throw new Error('Error al consultar el trabajo');
+            return response.json();
+        })
+        .then(job => {
+            if (job.estado === 'completado') return job;
+            if (job.estado === 'error') throw new Error(job.error || 'El trabajo falló');
+            if (job.progreso !== null) {
+                mostrarMensaje(`⏳ ${etiqueta}... ${Math.round(job.progreso)}%`, 'info');
+            }
+            return new Promise(resolve => setTimeout(resolve, 1500)).then(() => terminarJob(jobId, etiqueta));
+        });
+}
+
+function encolarImportacion(url, opciones, etiqueta) {
+    // POST que encola un trabajo de importación; devuelve el estado de la importación al terminar
+    return fetch(url, opciones)
+        .then(response => response.json())
+        .then(data => {
+            if (data.error) throw new Error(data.error);
+            return terminarJob(data.id, etiqueta).then(() => fetch(data.importacion_url));
+        })
+        .then(response => response.json());
+}
+
 function importarExcel(archivo) {
+    // Primero se previsualiza (dry_run) y sólo se aplica si el admin confirma;
+    // ambos pasos son trabajos en segundo plano
     const formData = new FormData();
     formData.append('file', archivo);
+    formData.append('dry_run', '1');
     
-    fetch('/api/productos/importar-excel', {
-        method: 'POST',
-        body: formData
-    })
-    .then(response => response.json())
+    encolarImportacion('/api/productos/importar-excel', { method: 'POST', body: formData }, 'Analizando Excel')
     .then(data => {
-        if (data.error) {
-            mostrarMensaje(`✗ Error: ${data.error}`, 'error');
-        } else {
-            const resumen = `Importación completada:\n✓ ${data.creados} creados\n✓ ${data.actualizados} actualizados\n✗ ${data.errores} errores`;
-            mostrarMensaje(resumen, 'success');
-            console.log('Detalles:', data.detalles);
-            cargarProductos(); // Recargar tabla
-            document.getElementById('archivo-nombre').textContent = '';
+        if (data.error) throw new Error(data.error);
+        const resumen = `Vista previa de la importación:\n+ ${data.nuevos} nuevos\n~ ${data.cambios} con cambios\n= ${data.sin_cambios} sin cambios\n✗ ${data.errores} errores`;
+        if (data.reporte_errores_url && confirm(`${resumen}\n\n¿Descargar el detalle de errores?`)) {
+            window.open(data.reporte_errores_url, '_blank');
+        }
+        if (!confirm(`${resumen}\n\n¿Aplicar la importación?`)) {
+            fetch(`/api/productos/importar-excel/${data.id}`, { method: 'DELETE' });
+            mostrarMensaje('Importación cancelada', 'info');
+            return null;
         }
+        return encolarImportacion(data.confirmar_url, { method: 'POST' }, 'Aplicando importación');
+    })
+    .then(data => {
+        if (!data) return;
+        if (data.error) throw new Error(data.error);
+        mostrarMensaje(`Importación completada:\n✓ ${data.creados} creados\n✓ ${data.actualizados} actualizados\n✗ ${data.errores} errores`, 'success');
+        cargarProductos(); // Recargar tabla
     })
     .catch(error => {
         console.error('Error:', error);
-        mostrarMensaje('✗ Error al importar Excel', 'error');
+        mostrarMensaje(`✗ Error al importar Excel: ${error.message}`, 'error');
+    })
+    .finally(() => {
         document.getElementById('archivo-nombre').textContent = '';
+        document.getElementById('archivo-importar').value = '';
     });
 }
 
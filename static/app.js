@@ -1,4 +1,9 @@
 // Funciones compartidas para la UI (incluye control de menú móvil)
+function miniaturaUrl(url, ancho) {
+	// Miniatura cacheada de las imágenes subidas (?w=64|200|800); las externas se dejan igual
+	return url && url.startsWith('/uploads/productos/') ? `${url}?w=${ancho}` : url;
+}
+
 document.addEventListener('DOMContentLoaded', function() {
 	console.log('Catálogo Web cargado correctamente');
 
@@ -0,0 +1,101 @@
+"""
+Exportación en streaming (CSV / NDJSON), opcionalmente comprimida con gzip.
+
+Los generadores de este módulo emiten el archivo en bloques de texto a
+medida que recorren las filas, sin construir el resultado completo en
+memoria. Usar con consultas `yield_per` para que la BD también entregue
+las filas por partes (en PostgreSQL, con un cursor del lado del servidor).
+
+export_response() es el punto de entrada común para exportar cualquier
+tabla: recibe un iterable de dicts y devuelve la respuesta en el formato
+pedido.
+"""
+import csv
+import json
+import zlib
+from io import StringIO
+
+from flask import Response, stream_with_context
+
+# Tamaño aproximado de cada bloque enviado al cliente
+CHUNK_SIZE = 64 * 1024
+# Filas que se piden a la BD por lote (yield_per)
+BATCH_SIZE = 1000
+
+FORMATOS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def iter_csv(rows, fieldnames):
+    """Genera un CSV (con encabezado) a partir de un iterable de dicts."""
+    buf = StringIO()
+    writer = csv.DictWriter(buf, fieldnames=fieldnames, extrasaction='ignore')
+    writer.writeheader()
+    for row in rows:
+        writer.writerow(row)
+        if buf.tell() >= CHUNK_SIZE:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate(0)
+    yield buf.getvalue()
+
+
+def iter_ndjson(rows):
+    """Genera JSON delimitado por líneas (un objeto por línea)."""
+    parts = []
+    size = 0
+    for row in rows:
+        line = json.dumps(row, ensure_ascii=False, default=str) + '\n'
+        parts.append(line)
+        size += len(line)
+        if size >= CHUNK_SIZE:
+            yield ''.join(parts)
+            parts = []
+            size = 0
+    if parts:
+        yield ''.join(parts)
+
+
+def iter_gzip(chunks, level=6):
+    """Comprime al vuelo bloques de texto (formato gzip, UTF-8)."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def accepts_gzip(request):
+    """True si el cliente acepta gzip y no lo ha desactivado con ?gzip=0."""
+    if request.args.get('gzip', '').lower() in ('0', 'false', 'no'):
+        return False
+    return request.accept_encodings['gzip'] > 0
+
+
+def stream_response(chunks, mimetype, filename=None, compress=False):
+    """Response de Flask que envía `chunks` conforme se generan."""
+    if compress:
+        chunks = iter_gzip(chunks)
+    response = Response(stream_with_context(chunks), mimetype=mimetype)
+    if compress:
+        response.headers['Content-Encoding'] = 'gzip'
+        response.headers['Vary'] = 'Accept-Encoding'
+    if filename:
+        response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+    # Evitar que nginx acumule la respuesta completa antes de enviarla
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def export_response(rows, fieldnames, formato='csv', basename='export', compress=False):
+    """Exporta `rows` (dicts) como <basename>.csv o <basename>.ndjson en streaming.
+
+    ValueError si el formato no está soportado.
+    """
+    if formato not in FORMATOS:
+        raise ValueError(f"Formato no soportado: {formato} (usar {' | '.join(FORMATOS)})")
+    chunks = iter_csv(rows, fieldnames) if formato == 'csv' else iter_ndjson(rows)
+    return stream_response(chunks, FORMATOS[formato], f'{basename}.{formato}', compress=compress)
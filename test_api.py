@@ -4,8 +4,30 @@ Ejecutar con: pytest test_api.py -v
 """
 import pytest
 import json
-from app import app, db, Usuario
-from models import Producto, Proveedor
+import os
+import tempfile
+from datetime import datetime, timedelta
+from io import BytesIO
+
+# configure_logging() abre LOG_FILE (y su .lock) al importar app: que el run de
+# tests escriba en un directorio temporal y no en el repositorio
+os.environ.setdefault('LOG_FILE', os.path.join(tempfile.mkdtemp(prefix='catalogo_tests_'), 'catalogo_app.log'))
+
+from app import (app, db, Usuario, user_cache, permission_index, product_search, catalog_stats, job_queue, thumbnails,
+                 product_importer, login_limiter)
+from models import (Producto, Proveedor, ProductoProveedor, HistorialPreciosProveedor, AccessLog, Role, Permission,
+                    Máquina, HojaRuta, EstacionTrabajo, Ticket, ComentarioTicket, EstadisticaCategoria, Job,
+                    ImportacionProductos, ClaveProducto, ClaveProceso, ProcesoCatalogo)
+from access_log_writer import AccessLogWriter
+from access_log_storage import AccessLogStorage
+from rate_limiter import MemoryRateLimitStore, RateLimiter, SQLRateLimitStore
+from sqlalchemy import create_engine
+from sqlalchemy.pool import NullPool
+from db_pool import InstrumentedQueuePool, engine_options_from_env
+from sql_profiler import SQLProfiler, normalize_sql
+from logging_config import JsonFormatter, RequestQueueHandler, SharedRotatingFileHandler
+from serializers import HOJA_RUTA, TICKET_BANDEJA
+from catalog_stats import rebuild as rebuild_estadisticas
 
 
 @pytest.fixture
@@ -13,6 +35,10 @@ def client():
     """Configurar cliente de prueba"""
     app.config['TESTING'] = True
     app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+    user_cache.invalidate()
+    permission_index.reset()
+    product_search.memory.reset()
+    catalog_stats.reset()
     
     with app.app_context():
         db.create_all()
@@ -212,5 +238,1123 @@ class TestErrorHandling:
         assert response.status_code == 404
 
 
+class TestAccessLog:
+    """Tests del registro de accesos"""
+
+    def test_peticion_registra_acceso(self, client):
+        """✓ Cada petición no estática queda en access_logs"""
+        client.get('/login')
+        client.get('/static/styles.css')
+        with app.app_context():
+            assert AccessLog.query.filter_by(path='/login').count() == 1
+            assert AccessLog.query.filter(AccessLog.path.like('/static%')).count() == 0
+
+    def test_writer_en_lotes_vacia_al_detener(self, client):
+        """✓ AccessLogWriter inserta en lotes y no pierde registros al detenerse"""
+        writer = AccessLogWriter(app=app, db=db, batch_size=3, flush_interval_ms=50)
+        for i in range(7):
+            assert writer.submit({'ip': '10.0.0.1', 'username': None, 'path': f'/lote/{i}',
+                                  'method': 'GET', 'user_agent': None, 'referer': None,
+                                  'timestamp': datetime.utcnow()})
+        writer.stop()
+        with app.app_context():
+            assert AccessLog.query.filter(AccessLog.path.like('/lote/%')).count() == 7
+        assert writer.stats['escritos'] == 7
+
+    def test_writer_descarta_con_cola_llena(self, client):
+        """✓ Con la cola llena los registros se descartan sin bloquear"""
+        writer = AccessLogWriter(app=app, db=db, max_queue=2, sample_rate=1.0, flush_interval_ms=60000)
+        writer._ensure_started = lambda: None  # sin hilo: la cola no se consume
+        aceptados = [writer.submit({'path': '/x', 'method': 'GET'}) for _ in range(5)]
+        assert aceptados.count(True) == 2
+        assert writer.stats['descartados'] == 3
+
+    def test_rollups_y_retencion(self, client):
+        """✓ Rollups horarios por ruta/usuario y retención por antigüedad"""
+        ahora = datetime.utcnow().replace(minute=30, second=0, microsecond=0)
+        with app.app_context():
+            db.session.query(AccessLog).delete()
+            for minutos, path, user in [(0, '/a', 'ana'), (5, '/a', None), (65, '/b', 'ana')]:
+                db.session.add(AccessLog(path=path, method='GET', username=user,
+                                         timestamp=ahora - timedelta(minutes=minutos)))
+            db.session.add(AccessLog(path='/viejo', method='GET', timestamp=ahora - timedelta(days=400)))
+            db.session.commit()
+
+            storage = AccessLogStorage(db, retention_days=365)
+            storage.apply_retention(now=ahora)
+            assert AccessLog.query.filter_by(path='/viejo').count() == 0
+
+            storage.refresh_rollups(now=ahora + timedelta(minutes=1))
+            rutas = {r['value']: r['hits'] for r in storage.top_rollups('path', now=ahora)}
+            usuarios = {u['value']: u['hits'] for u in storage.top_rollups('user', now=ahora)}
+            assert rutas == {'/a': 2, '/b': 1}
+            assert usuarios == {'ana': 2, '-': 1}
+
+            # Recalcular no duplica la última hora
+            storage.refresh_rollups(now=ahora + timedelta(minutes=1))
+            assert {r['value']: r['hits'] for r in storage.top_rollups('path', now=ahora)} == rutas
+
+        client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+        response = client.get('/admin/puerta')
+        assert response.status_code == 200
+        assert b'/a' in response.data
+
+
+class TestLogsAPI:
+    """Tests de /api/logs: paginación keyset, filtros y exportación"""
+
+    def _sembrar(self):
+        base = datetime(2026, 1, 1, 12, 0, 0)
+        with app.app_context():
+            db.session.query(AccessLog).delete()
+            for i in range(5):
+                db.session.add(AccessLog(ip='10.0.0.%d' % (i % 2), username='ana' if i < 3 else 'luis',
+                                         path=f'/api/x/{i}', method='GET',
+                                         timestamp=base + timedelta(minutes=i)))
+            db.session.commit()
+
+    def test_paginacion_por_cursor(self, client):
+        """✓ Recorre todas las páginas con X-Next-Cursor sin repetir filas"""
+        client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+        self._sembrar()
+        vistos = []
+        url = '/api/logs?limit=2&path=/api/x/'
+        while url:
+            response = client.get(url)
+            assert response.status_code == 200
+            vistos.extend(l['path'] for l in response.get_json())
+            cursor = response.headers.get('X-Next-Cursor')
+            url = f'/api/logs?limit=2&path=/api/x/&cursor={cursor}' if cursor else None
+        assert vistos == [f'/api/x/{i}' for i in range(4, -1, -1)]
+
+    def test_filtros(self, client):
+        """✓ Filtra por usuario, ip y rango de fechas"""
+        client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+        self._sembrar()
+        data = client.get('/api/logs?username=ana&ip=10.0.0.0').get_json()
+        assert [l['path'] for l in data] == ['/api/x/2', '/api/x/0']
+        data = client.get('/api/logs?path=/api/x/&desde=2026-01-01T12:03:00').get_json()
+        assert len(data) == 2
+        assert client.get('/api/logs?desde=ayer').status_code == 400
+
+    def test_exportar_csv_streaming(self, client):
+        """✓ format=csv exporta todo el rango filtrado"""
+        client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+        self._sembrar()
+        response = client.get('/api/logs?format=csv&username=luis')
+        assert response.status_code == 200
+        assert response.content_type.startswith('text/csv')
+        lineas = response.get_data(as_text=True).strip().splitlines()
+        assert lineas[0].startswith('id,timestamp,ip')
+        assert len(lineas) == 3
+
+
+class TestUserCache:
+    """Tests del snapshot de usuario/permisos en caché"""
+
+    def _crear_ingeniero(self):
+        with app.app_context():
+            perm = Permission(module='tickets', action='view')
+            role = Role(name='support', permissions=[perm])
+            u = Usuario(username='ing', correo='ing@test.com', activo=True, role=role)
+            u.set_password('ing123')
+            db.session.add(u)
+            db.session.commit()
+            return u.id
+
+    def test_snapshot_permisos(self, client):
+        """✓ El snapshot resuelve rol y permisos y queda en caché"""
+        self._crear_ingeniero()
+        client.post('/login', data={'username': 'ing', 'password': 'ing123'})
+        assert client.get('/tickets/ingeniero').status_code == 200
+        snap = user_cache.get('ing')
+        assert snap.role.name == 'support'
+        assert snap.has_permission('tickets', 'view')
+        assert not snap.has_permission('tickets', 'delete')
+
+    def test_mutacion_invalida_cache(self, client):
+        """✓ Desactivar un usuario invalida su snapshot"""
+        user_id = self._crear_ingeniero()
+        ing = app.test_client()
+        ing.post('/login', data={'username': 'ing', 'password': 'ing123'})
+        assert ing.get('/tickets/ingeniero').status_code == 200
+        assert user_cache.get('ing') is not None
+
+        client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+        assert client.put(f'/api/users/{user_id}/toggle_active').status_code == 200
+        assert user_cache.get('ing') is None
+        assert ing.get('/tickets/ingeniero').status_code == 302
+
+    def test_cambio_en_otro_worker_caduca_snapshot(self, client, monkeypatch):
+        """✓ Un usuario desactivado en otro worker deja de valer al subir la versión 'usuarios'"""
+        self._crear_ingeniero()
+        ing = app.test_client()
+        ing.post('/login', data={'username': 'ing', 'password': 'ing123'})
+        assert ing.get('/tickets/ingeniero').status_code == 200
+        assert user_cache.get('ing') is not None
+
+        # Otro worker: modifica la BD y sube la versión, sin tocar la caché de este proceso
+        with app.app_context():
+            from cache_versions import bump_version
+            Usuario.query.filter_by(username='ing').one().activo = False
+            bump_version(db, 'usuarios')
+            db.session.commit()
+        monkeypatch.setattr(user_cache, 'check_interval', 0)
+        assert ing.get('/tickets/ingeniero').status_code == 302
+
+    def test_indice_sin_version_no_vacia_permisos(self, client, monkeypatch):
+        """✓ Si falla la lectura de la versión se carga/mantiene el índice y se espacia el reintento"""
+        import permission_index as pi
+        self._crear_ingeniero()
+        llamadas = []
+
+        def _falla(db_, nombre):
+            llamadas.append(nombre)
+            raise RuntimeError('no existe cache_versions')
+
+        monkeypatch.setattr(pi, 'get_version', _falla)
+        with app.app_context():
+            role_id = Role.query.filter_by(name='support').first().id
+            permission_index.ensure_fresh()
+            assert permission_index.has_permission(role_id, 'tickets', 'view')
+            permission_index.ensure_fresh()
+            assert len(llamadas) == 1
+            assert Usuario.query.filter_by(username='ing').count() == 1  # la sesión sigue usable
+
+    def test_cambio_permisos_incrementa_version(self, client):
+        """✓ PUT de permisos de un rol sube la versión y refresca el índice"""
+        self._crear_ingeniero()
+        with app.app_context():
+            role_id = Role.query.filter_by(name='support').first().id
+            edit = Permission(module='tickets', action='edit')
+            db.session.add(edit)
+            db.session.commit()
+            perm_ids = [p.id for p in Permission.query.all()]
+
+        ing = app.test_client()
+        ing.post('/login', data={'username': 'ing', 'password': 'ing123'})
+        ing.get('/tickets/ingeniero')
+        version = permission_index.version
+        assert not user_cache.get('ing').has_permission('tickets', 'edit')
+
+        client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+        response = client.put(f'/api/roles/{role_id}/permissions', json={'permission_ids': perm_ids})
+        assert response.status_code == 200
+
+        ing.get('/tickets/ingeniero')
+        assert permission_index.version == version + 1
+        assert user_cache.get('ing').has_permission('tickets', 'edit')
+
+
+class TestRateLimiter:
+    """Tests del limitador de intentos con ventana deslizante"""
+
+    def _bloquea_tras_limite(self, store):
+        limiter = RateLimiter(store, limit=3, window=60, lockout=120)
+        now = 6000.0
+        assert limiter.hit('login:1.2.3.4', now=now) == (1, 0)
+        assert limiter.hit('login:1.2.3.4', now=now + 1) == (2, 0)
+        assert limiter.hit('login:1.2.3.4', now=now + 2)[1] == 120
+        assert limiter.retry_after('login:1.2.3.4', now=now + 3) == 119
+        assert limiter.retry_after('login:5.6.7.8', now=now + 3) == 0
+        limiter.reset('login:1.2.3.4')
+        assert limiter.retry_after('login:1.2.3.4', now=now + 3) == 0
+
+    def test_memoria(self):
+        """✓ Almacén en memoria: bloqueo, reset y límite de entradas"""
+        store = MemoryRateLimitStore(max_entries=2)
+        self._bloquea_tras_limite(store)
+        for i in range(5):
+            store.incr(f'k{i}', 1, 9999, 0)
+        assert len(store._data) == 2
+
+    def test_sqlite_compartido(self, tmp_path):
+        """✓ Dos procesos (dos engines) comparten el mismo contador"""
+        url = f"sqlite:///{tmp_path / 'rl.db'}"
+        self._bloquea_tras_limite(SQLRateLimitStore(engine=create_engine(url)))
+        a = RateLimiter(SQLRateLimitStore(engine=create_engine(url)), limit=2, window=60)
+        b = RateLimiter(SQLRateLimitStore(engine=create_engine(url)), limit=2, window=60)
+        assert a.hit('login:9.9.9.9', now=6000.0)[1] == 0
+        assert b.hit('login:9.9.9.9', now=6001.0)[1] > 0
+
+    def test_ventana_deslizante(self):
+        """✓ Los fallos de la ventana anterior pesan proporcionalmente"""
+        limiter = RateLimiter(MemoryRateLimitStore(), limit=10, window=60)
+        for _ in range(4):
+            limiter.hit('k', now=6030.0)
+        assert limiter.hit('k', now=6075.0)[0] == 4  # 1 + 4 * 0.75
+        assert limiter.hit('k', now=6300.0)[0] == 1
+
+
+    def test_login_no_se_salta_con_x_forwarded_for(self, client, monkeypatch):
+        """✓ Cambiar el primer valor de X-Forwarded-For no reinicia el contador ni falsea el registro"""
+        import sys
+        # Fuera de TESTING no arrancar hilos de trabajos ni del registro de accesos (escritura síncrona)
+        monkeypatch.setattr(job_queue, 'workers', 0)
+        monkeypatch.setattr(sys.modules['app'], 'ACCESS_LOG_MODE', 'sync')
+        monkeypatch.setitem(app.config, 'TESTING', False)
+        codigos = []
+        for i in range(6):
+            response = client.post('/login', data={'username': 'admin', 'password': 'mal'},
+                                   headers={'X-Forwarded-For': f'10.9.9.{i}, 192.0.2.7'})
+            codigos.append(response.status_code)
+        assert codigos[-1] == 429
+        with app.app_context():
+            login_limiter.reset('login:192.0.2.7')
+            ips = {ip for (ip,) in db.session.query(AccessLog.ip).filter(AccessLog.path == '/login')}
+            assert ips == {'192.0.2.7'}
+
+class TestDBPool:
+    """Tests de configuración y estado del pool de conexiones"""
+
+    def test_opciones_desde_entorno(self, monkeypatch):
+        """✓ DB_POOL_* se traducen a opciones del engine"""
+        monkeypatch.setenv('DB_POOL_SIZE', '8')
+        monkeypatch.setenv('DB_MAX_OVERFLOW', '2')
+        opts = engine_options_from_env('postgresql://u:p@db/x')
+        assert opts['poolclass'] is InstrumentedQueuePool
+        assert (opts['pool_size'], opts['max_overflow'], opts['pool_pre_ping']) == (8, 2, True)
+        assert engine_options_from_env('sqlite:///:memory:') == {}
+
+        monkeypatch.setenv('DB_POOL_MODE', 'pgbouncer')
+        opts = engine_options_from_env('postgresql+psycopg://u:p@pgbouncer/x')
+        assert opts['poolclass'] is NullPool
+        assert opts['connect_args']['prepare_threshold'] is None
+
+    def test_endpoint_pool(self, client):
+        """✓ /internal/pool sólo para admin y con contadores del worker"""
+        assert client.get('/internal/pool').status_code == 302
+        client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+        data = client.get('/internal/pool').get_json()
+        assert data['checkouts'] > 0
+        assert 'wait_max_ms' in data and 'pid' in data
+
+
+class TestMetrics:
+    """Tests del endpoint /metrics"""
+
+    def test_metricas_por_endpoint(self, client):
+        """✓ /metrics expone latencia, consultas SQL y render de plantillas"""
+        client.get('/login')
+        client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+        client.get('/api/productos')
+        response = client.get('/metrics')
+        assert response.status_code == 200
+        body = response.get_data(as_text=True)
+        assert 'http_request_duration_seconds_bucket{endpoint="get_productos"' in body
+        assert 'db_queries_per_request_count{endpoint="get_productos"}' in body
+        assert 'template_render_seconds_count{template="login.html"}' in body
+        assert 'http_requests_in_flight' in body
+
+    def test_consulta_fallida_no_deja_inicio_en_conexion(self):
+        """✓ Una sentencia que falla no deja su hora de inicio en la conexión del pool"""
+        from sqlalchemy import text
+        with app.app_context():
+            with db.engine.connect() as conn:
+                with pytest.raises(Exception):
+                    conn.execute(text('SELECT * FROM tabla_que_no_existe'))
+                conn.execute(text('SELECT 1'))
+                assert not conn.info.get('_metrics_query_start')
+
+
+class TestSQLProfiler:
+    """Tests del perfilador SQL y detector de N+1"""
+
+    def test_normalizar_sql(self):
+        """✓ Literales, parámetros y listas IN comparten forma"""
+        assert normalize_sql("SELECT * FROM t WHERE id = 5 AND n = 'x'") == 'SELECT * FROM t WHERE id = ? AND n = ?'
+        assert normalize_sql('SELECT a FROM t\n WHERE id IN (%(p1)s, %(p2)s)') == 'SELECT a FROM t WHERE id IN (?)'
+
+    def test_detecta_n_mas_1(self):
+        """✓ En modo dev marca sentencias repetidas y añade cabeceras"""
+        from types import SimpleNamespace
+        from flask import Flask
+        from sqlalchemy import text
+
+        mini = Flask('perfilado')
+        engine = create_engine('sqlite://')
+        profiler = SQLProfiler(mini, SimpleNamespace(engine=engine), mode='dev', n1_threshold=3)
+
+        @mini.route('/n1')
+        def n1():
+            with engine.connect() as conn:
+                for i in range(4):
+                    conn.execute(text('SELECT :i'), {'i': i})
+                conn.execute(text('SELECT 1 + 1'))
+            return 'ok'
+
+        response = mini.test_client().get('/n1')
+        assert response.headers['X-SQL-Queries'] == '5'
+        assert response.headers['X-SQL-N1'] == '1'
+        report = profiler.recent()[0]
+        assert report['endpoint'] == 'n1'
+        assert report['n_plus_one'][0]['count'] == 4
+
+    def test_consulta_fallida_no_falsea_tiempos(self):
+        """✓ Una sentencia que falla no deja inicio colgado ni cuenta en el informe"""
+        from types import SimpleNamespace
+        from flask import Flask
+        from sqlalchemy import text
+
+        mini = Flask('perfilado_error')
+        engine = create_engine('sqlite://')
+        profiler = SQLProfiler(mini, SimpleNamespace(engine=engine), mode='dev')
+        infos = []
+
+        @mini.route('/falla')
+        def falla():
+            with engine.connect() as conn:
+                try:
+                    conn.execute(text('SELECT * FROM tabla_que_no_existe'))
+                except Exception:
+                    pass
+                conn.execute(text('SELECT 1'))
+                infos.append(dict(conn.info))
+            return 'ok'
+
+        response = mini.test_client().get('/falla')
+        assert response.headers['X-SQL-Queries'] == '1'
+        assert not infos[0].get('_sqlprof_start')
+        assert profiler.recent()[0]['endpoint'] == 'falla'
+
+
+class TestLogging:
+    """Tests de la tubería de logging"""
+
+    def test_request_id_en_respuesta(self, client):
+        """✓ Se respeta X-Request-ID entrante y se genera si falta"""
+        assert client.get('/login', headers={'X-Request-ID': 'abc123'}).headers['X-Request-ID'] == 'abc123'
+        assert len(client.get('/login').headers['X-Request-ID']) == 32
+
+    def test_json_con_request_id(self):
+        """✓ El registro encolado lleva el request_id y sale como JSON"""
+        import logging
+        import queue
+        from flask import g
+        q = queue.SimpleQueue()
+        handler = RequestQueueHandler(q)
+        with app.test_request_context('/'):
+            g.request_id = 'rid-1'
+            handler.handle(logging.LogRecord('prueba', logging.INFO, __file__, 1, 'hola %s', ('mundo',), None))
+        data = json.loads(JsonFormatter().format(q.get_nowait()))
+        assert (data['msg'], data['request_id'], data['level']) == ('hola mundo', 'rid-1', 'INFO')
+
+    def test_rotacion_compartida(self, tmp_path):
+        """✓ Dos handlers sobre el mismo fichero rotan por tamaño sin perder líneas"""
+        import logging
+        ruta = str(tmp_path / 'app.log')
+        a = SharedRotatingFileHandler(ruta, max_bytes=200, when='none', backup_count=100)
+        b = SharedRotatingFileHandler(ruta, max_bytes=200, when='none', backup_count=100)
+        for i in range(40):
+            (a if i % 2 else b).emit(logging.LogRecord('x', logging.INFO, __file__, 1, 'linea %02d' % i, None, None))
+        a.close()
+        b.close()
+        lineas = []
+        for f in sorted(tmp_path.glob('app.log*')):
+            if not f.name.endswith('.lock'):
+                lineas.extend(f.read_text().splitlines())
+                assert f.stat().st_size <= 200
+        assert sorted(lineas) == ['linea %02d' % i for i in range(40)]
+
+
+class TestProductSearch:
+    """Tests de la búsqueda de productos (índice invertido en SQLite)"""
+
+    def _sembrar(self):
+        with app.app_context():
+            db.session.add_all([
+                Producto(nombre='Tornillo hexagonal', descripcion='Acero', precio=1, categoria='Tornillería'),
+                Producto(nombre='Tuerca', descripcion='Para tornillo hexagonal', precio=1, categoria='Tornillería'),
+                Producto(nombre='Cable eléctrico', descripcion='Cobre', precio=5, categoria='Eléctrico'),
+            ])
+            db.session.commit()
+
+    def test_prefijo_sin_acentos_y_ranking(self, client):
+        """✓ Coincide por prefijo, ignora acentos y ordena por relevancia"""
+        self._sembrar()
+        nombres = [p['nombre'] for p in client.get('/public/productos/buscar?q=torn hex').get_json()]
+        assert nombres == ['Tornillo hexagonal', 'Tuerca']
+        assert [p['nombre'] for p in client.get('/public/productos/buscar?q=electrico').get_json()] == ['Cable eléctrico']
+        assert client.get('/public/productos/buscar?q=zzz').get_json() == []
+        assert len(client.get('/public/productos/buscar?q=torn&limit=1').get_json()) == 1
+
+    def test_indice_se_actualiza(self, client):
+        """✓ Editar un producto invalida el índice en memoria"""
+        self._sembrar()
+        client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+        assert client.get('/api/productos/buscar?q=cobre').get_json()[0]['nombre'] == 'Cable eléctrico'
+        with app.app_context():
+            cable = Producto.query.filter_by(nombre='Cable eléctrico').first()
+            cable.descripcion = 'Aluminio'
+            db.session.commit()
+        assert client.get('/api/productos/buscar?q=cobre').get_json() == []
+        assert len(client.get('/api/productos/buscar?q=alum').get_json()) == 1
+
+
+class TestProductListing:
+    """Tests del listado paginado / proyectado de productos"""
+
+    def _sembrar(self, n=5):
+        from datetime import date
+        with app.app_context():
+            for i in range(n):
+                p = Producto(nombre=f'P{i}', descripcion='d', precio=10 + i, cantidad=i, categoria='C')
+                prov = Proveedor(nombre=f'Prov{i}')
+                pp = ProductoProveedor(producto=p, proveedor=prov, precio_proveedor=5 + i)
+                pp.historial_precios.append(HistorialPreciosProveedor(precio=4 + i, fecha_precio=date(2026, 1, 1)))
+                db.session.add(p)
+            db.session.commit()
+
+    def test_paginacion_y_campos(self, client):
+        """✓ limit/cursor recorren todo; fields limita las claves"""
+        client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+        self._sembrar()
+        vistos, url = [], '/api/productos?limit=2&fields=nombre,precio'
+        while url:
+            response = client.get(url)
+            assert response.headers['X-Total-Count'] == '5'
+            page = response.get_json()
+            assert all(set(p) == {'id', 'nombre', 'precio'} for p in page)
+            vistos.extend(p['nombre'] for p in page)
+            cursor = response.headers.get('X-Next-Cursor')
+            url = f'/api/productos?limit=2&fields=nombre,precio&cursor={cursor}' if cursor else None
+        assert vistos == [f'P{i}' for i in range(5)]
+        assert client.get('/api/productos?fields=nope').status_code == 400
+
+    def test_default_sin_relaciones_e_include(self, client):
+        """✓ Por defecto no hay proveedores; include los carga sin N+1"""
+        from sqlalchemy import event
+        client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+        self._sembrar()
+        assert 'proveedores' not in client.get('/api/productos').get_json()[0]
+
+        sentencias = []
+        with app.app_context():
+            engine = db.engine
+        contar = lambda *args: sentencias.append(args[2])
+        event.listen(engine, 'before_cursor_execute', contar)
+        try:
+            data = client.get('/api/productos?include=proveedores,historial').get_json()
+        finally:
+            event.remove(engine, 'before_cursor_execute', contar)
+        assert data[0]['proveedores'][0]['proveedor']['nombre'] == 'Prov0'
+        assert data[4]['proveedores'][0]['historial_precios'][0]['precio'] == 8
+        # productos + asignaciones + proveedores + historial (no una por fila)
+        assert len([s for s in sentencias if 'productos' in s or 'proveedor' in s]) <= 4
+
+    def test_publico_sin_include(self, client):
+        """✓ El listado público no expone proveedores"""
+        self._sembrar(2)
+        assert client.get('/public/productos?include=proveedores').status_code == 400
+        data = client.get('/public/productos?limit=1').get_json()
+        assert len(data) == 1 and 'fecha_creacion' not in data[0]
+
+
+class TestSerializers:
+    """Tests de las formas de serialización con carga anticipada"""
+
+    def _contar_sentencias(self, client, url):
+        from sqlalchemy import event
+        sentencias = []
+        with app.app_context():
+            engine = db.engine
+        contar = lambda *args: sentencias.append(args[2])
+        event.listen(engine, 'before_cursor_execute', contar)
+        try:
+            response = client.get(url)
+        finally:
+            event.remove(engine, 'before_cursor_execute', contar)
+        return response, sentencias
+
+    def test_hojas_ruta_consultas_constantes(self, client):
+        """✓ Las estaciones de todas las hojas se cargan en una consulta y salen ordenadas"""
+        client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+        with app.app_context():
+            maquina = Máquina(nombre='Torno 1')
+            for n in range(4):
+                hoja = HojaRuta(maquina=maquina, nombre=f'HR{n}', estado='activa')
+                for orden in (3, 1, 2):
+                    hoja.estaciones.append(EstacionTrabajo(nombre=f'E{orden}', operacion='op', orden=orden))
+                db.session.add(hoja)
+            db.session.commit()
+            maquina_id = maquina.id
+            hoja = HOJA_RUTA.prepare(HojaRuta.query).first()
+            assert [e['orden'] for e in HOJA_RUTA.dump(hoja)['estaciones']] == [1, 2, 3]
+
+        for url in (f'/hojas_ruta/{maquina_id}', '/hojas_ruta'):
+            response, sentencias = self._contar_sentencias(client, url)
+            assert response.status_code == 200
+            assert len([s for s in sentencias if 'FROM estaciones_trabajo' in s]) == 1
+
+    def test_tickets_sin_n_mas_1(self, client):
+        """✓ mis-tickets y el detalle cargan comentarios y autores en bloque"""
+        client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+        with client.session_transaction() as sess:
+            sess['ingeniero_user'] = 'admin'
+        with app.app_context():
+            admin = Usuario.query.filter_by(username='admin').first()
+            for n in range(3):
+                ticket = Ticket(numero_ticket=f'T-{n}', titulo='t', descripcion='d', nombre_solicitante='s',
+                                ingeniero_id=admin.id, estado='en_progreso')
+                for _ in range(2):
+                    ticket.comentarios.append(ComentarioTicket(ingeniero_id=admin.id, contenido='c'))
+                db.session.add(ticket)
+            db.session.commit()
+            ticket_id = ticket.id
+            assert TICKET_BANDEJA.columnar
+
+        response, sentencias = self._contar_sentencias(client, '/api/mis-tickets')
+        tickets = response.get_json()['tickets']
+        assert [t['comentarios_count'] for t in tickets] == [2, 2, 2]
+        assert len([s for s in sentencias if 'FROM comentarios_tickets' in s]) == 1
+
+        data = client.get(f'/api/tickets/{ticket_id}').get_json()['ticket']
+        assert data['ingeniero_nombre'] == 'admin'
+        assert [c['ingeniero_nombre'] for c in data['comentarios']] == ['admin', 'admin']
+
+
+class TestEstadisticas:
+    """Tests de los agregados incrementales y el ETag de /api/estadisticas"""
+
+    def _agregados(self):
+        return sorted((e.categoria, e.productos, e.suma_precio, e.valor_inventario, e.stock, e.bajo_stock)
+                      for e in EstadisticaCategoria.query.all())
+
+    def test_incremental_igual_a_recalculo(self, client):
+        """✓ Altas, cambios y bajas dejan los mismos agregados que un recálculo completo"""
+        with app.app_context():
+            productos = [Producto(nombre=f'P{i}', precio=10 + i, cantidad=i * 2, categoria='A' if i % 2 else None)
+                         for i in range(6)]
+            db.session.add_all(productos)
+            db.session.commit()
+            p = db.session.get(Producto, productos[1].id)
+            p.categoria = 'B'
+            p.cantidad = 1
+            db.session.delete(db.session.get(Producto, productos[2].id))
+            db.session.commit()
+            # Asignación sobre un objeto expirado (tras commit) sin leerlo antes
+            productos[3].precio = 99
+            db.session.commit()
+
+            incremental = self._agregados()
+            rebuild_estadisticas(db)
+            db.session.commit()
+            assert self._agregados() == incremental
+
+        data = client.get('/api/estadisticas').get_json()
+        assert data['total_productos'] == 5
+        assert data['productos_por_categoria'] == {'A': 2, 'B': 1, 'Sin categoría': 2}
+        assert data['producto_mas_caro']['precio'] == 99
+        assert data['productos_bajo_stock'] == 2
+        assert 'proveedores' not in data['producto_mas_barato']
+
+    def test_etag(self, client):
+        """✓ If-None-Match devuelve 304 hasta que cambian los productos"""
+        client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+        response = client.get('/api/estadisticas')
+        etag = response.headers['ETag']
+        assert client.get('/api/estadisticas', headers={'If-None-Match': etag}).status_code == 304
+
+        client.post('/api/productos', json={'nombre': 'Nuevo', 'precio': 5, 'cantidad': 1})
+        response = client.get('/api/estadisticas', headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        assert response.headers['ETag'] != etag
+        assert response.get_json()['total_productos'] == 1
+
+
+class TestHttpCache:
+    """Tests de ETag / Last-Modified / 304 en endpoints de lectura"""
+
+    def test_304_sin_ejecutar_la_vista(self, client):
+        """✓ Mientras no cambian los productos la respuesta condicional es 304 sin consultar productos"""
+        from sqlalchemy import event
+        response = client.get('/public/productos')
+        etag = response.headers['ETag']
+        assert response.headers['Cache-Control'].startswith('public, max-age=')
+
+        sentencias = []
+        with app.app_context():
+            engine = db.engine
+        contar = lambda *args: sentencias.append(args[2])
+        event.listen(engine, 'before_cursor_execute', contar)
+        try:
+            response = client.get('/public/productos', headers={'If-None-Match': etag})
+        finally:
+            event.remove(engine, 'before_cursor_execute', contar)
+        assert response.status_code == 304 and response.data == b''
+        assert not [s for s in sentencias if 'FROM productos' in s]
+
+        with app.app_context():
+            db.session.add(Producto(nombre='X', precio=1, cantidad=1, categoria='C'))
+            db.session.commit()
+        response = client.get('/public/productos', headers={'If-None-Match': etag})
+        assert response.status_code == 200 and len(response.get_json()) == 1
+        assert response.headers['ETag'] != etag
+
+    def test_asignacion_sin_cambios_no_invalida(self, client):
+        """✓ Un objeto en dirty sin cambios reales no sube la versión de su familia"""
+        from cache_versions import get_version
+        with app.app_context():
+            p = Producto(nombre='Y', precio=2, cantidad=1)
+            db.session.add(p)
+            db.session.commit()
+            version = get_version(db, 'productos')
+            p.precio = p.precio
+            db.session.add(Proveedor(nombre='Otro'))
+            db.session.commit()
+            assert get_version(db, 'productos') == version
+            p.precio = 3
+            db.session.commit()
+            assert get_version(db, 'productos') == version + 1
+
+    def test_familias_y_last_modified(self, client):
+        """✓ Cada endpoint sólo se invalida con su familia; If-Modified-Since también da 304"""
+        client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+        client.post('/api/proveedores', json={'nombre': 'Prov'})
+        response = client.get('/api/proveedores')
+        etag, last_modified = response.headers['ETag'], response.headers['Last-Modified']
+        assert response.headers['Cache-Control'] == 'private, no-cache'
+        assert client.get('/api/proveedores', headers={'If-Modified-Since': last_modified}).status_code == 304
+
+        client.post('/api/productos', json={'nombre': 'Nuevo', 'precio': 5, 'cantidad': 1})
+        assert client.get('/api/proveedores', headers={'If-None-Match': etag}).status_code == 304
+
+        client.get('/logout')
+        assert client.get('/api/proveedores', headers={'If-None-Match': etag}).status_code in (302, 401)
+
+
+class TestExportarProductos:
+    """Tests de la exportación de productos en streaming"""
+
+    def test_csv_columnas_y_gzip(self, client):
+        """✓ CSV con columnas por defecto o elegidas, gzip si el cliente lo acepta"""
+        import gzip
+        client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+        with app.app_context():
+            db.session.add_all([Producto(nombre=f'P{i}', precio=i, cantidad=i, categoria='C') for i in range(3)])
+            db.session.commit()
+
+        response = client.get('/api/productos/exportar')
+        assert response.is_streamed and 'Content-Encoding' not in response.headers
+        lineas = response.get_data(as_text=True).splitlines()
+        assert lineas[0] == 'id,nombre,descripcion,precio,cantidad,categoria,fecha_creacion'
+        assert len(lineas) == 4
+
+        response = client.get('/api/productos/exportar?columns=nombre,precio',
+                              headers={'Accept-Encoding': 'gzip'})
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert gzip.decompress(response.data).decode('utf-8').splitlines()[:2] == ['nombre,precio', 'P0,0.0']
+
+        ndjson = client.get('/api/productos/exportar?format=ndjson&columns=id').get_data(as_text=True)
+        assert [json.loads(l) for l in ndjson.splitlines()] == [{'id': 1}, {'id': 2}, {'id': 3}]
+        assert client.get('/api/productos/exportar?columns=nope').status_code == 400
+        assert client.get('/api/productos/exportar?format=xml').status_code == 400
+
+
+class TestJobs:
+    """Tests de los trabajos en segundo plano (exportación Excel)"""
+
+    @pytest.fixture(autouse=True)
+    def jobs_dir(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(job_queue, 'jobs_dir', str(tmp_path))
+
+    def test_exportar_excel_en_segundo_plano(self, client):
+        """✓ POST encola (202), el trabajo informa del progreso y el XLSX se descarga"""
+        from openpyxl import load_workbook
+        client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+        with app.app_context():
+            db.session.add_all([Producto(nombre=f'P{i}', precio=i, cantidad=i) for i in range(3)])
+            db.session.commit()
+
+        response = client.post('/api/productos/exportar-excel')
+        assert response.status_code == 202
+        job_id = response.get_json()['id']
+        assert client.get(f'/api/jobs/{job_id}').get_json()['estado'] == 'pendiente'
+        assert client.get(f'/api/jobs/{job_id}/descargar').status_code == 409
+
+        with app.app_context():
+            assert job_queue.run_pending() == 1
+        estado = client.get(f'/api/jobs/{job_id}').get_json()
+        assert estado['estado'] == 'completado' and estado['progreso'] == 100.0
+        assert estado['resultado']['productos'] == 3
+
+        response = client.get(estado['descarga_url'])
+        assert 'catalogo_productos.xlsx' in response.headers['Content-Disposition']
+        ws = load_workbook(BytesIO(response.data)).active
+        assert [c.value for c in ws['B']] == ['Nombre', 'P0', 'P1', 'P2']
+        assert ws['G2'].value == 'Sin imagen'
+
+    def test_pipeline_imagenes_en_orden(self, tmp_path):
+        """✓ Las imágenes se redimensionan en paralelo y llegan en el orden de entrada"""
+        from PIL import Image
+        from image_pipeline import ImagePipeline
+        for i in range(4):
+            Image.new('RGB', (400 + i, 300), 'red').save(tmp_path / f'{i}.png')
+        (tmp_path / 'rota.png').write_bytes(b'no es una imagen')
+        items = ['0.png', None, '1.png', 'rota.png', 'falta.png', '2.png', '3.png']
+
+        for processes in (0, 1):
+            pipeline = ImagePipeline(str(tmp_path), threads=3, processes=processes, window=2)
+            try:
+                resultados = list(pipeline.imap(items, lambda x: x, 200))
+            finally:
+                pipeline.shutdown()
+            assert [r[0] for r in resultados] == items
+            anchos = [Image.open(BytesIO(png)).size[0] for _, png, _ in resultados if png]
+            assert anchos == [200, 200, 200, 200]
+            assert resultados[1][1:] == (None, None) and resultados[4][1:] == (None, None)
+            assert resultados[3][2] is not None
+
+    def test_plazo_cuenta_desde_que_empieza(self, monkeypatch):
+        """✓ Las imágenes en cola detrás de descargas lentas no caducan sin intentarse"""
+        import time as _time
+        from PIL import Image
+        from image_pipeline import ImagePipeline
+        png = BytesIO()
+        Image.new('RGB', (300, 300), 'blue').save(png, format='PNG')
+
+        def _lenta(url, deadline):
+            _time.sleep(0.3)
+            return png.getvalue()
+
+        pipeline = ImagePipeline('.', threads=1, processes=0, window=4, timeout=0.5)
+        monkeypatch.setattr(pipeline, '_download', _lenta)
+        try:
+            resultados = list(pipeline.imap([f'http://img/{i}.png' for i in range(4)], lambda x: x, 64))
+        finally:
+            pipeline.shutdown()
+        assert [error for _, _, error in resultados] == [None] * 4
+
+    def test_reclamar_y_recuperar_abandonados(self, client):
+        """✓ Un trabajo sólo se reclama una vez; sin heartbeat vuelve a pendiente"""
+        with app.app_context():
+            job = job_queue.enqueue('exportar_excel', usuario='otro')
+            assert job_queue.claim() == job.id
+            assert job_queue.claim() is None
+
+            Job.query.filter_by(id=job.id).update({'heartbeat': datetime.utcnow() - timedelta(hours=1)})
+            db.session.commit()
+            assert job_queue.recover_stale() == 1
+            assert db.session.get(Job, job.id).estado == 'pendiente'
+
+        # Sólo el propietario o un admin ven el trabajo
+        client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+        assert client.get(f'/api/jobs/{job.id}').status_code == 200
+        assert client.get('/api/jobs/no-existe').status_code == 404
+
+
+class TestMiniaturas:
+    """Tests de la caché de miniaturas"""
+
+    @pytest.fixture
+    def cache(self, tmp_path, monkeypatch):
+        from thumbnails import ThumbnailCache
+        cache = ThumbnailCache(str(tmp_path / 'miniaturas'))
+        monkeypatch.setattr(thumbnails, 'root', cache.root)
+        return cache
+
+    def test_variantes_por_contenido_y_lru(self, cache, tmp_path):
+        """✓ Misma imagen -> mismas variantes; al superar el límite se expulsan las más antiguas"""
+        import os
+        from PIL import Image
+        Image.new('RGB', (1000, 500), 'blue').save(tmp_path / 'a.png')
+        (tmp_path / 'copia.png').write_bytes((tmp_path / 'a.png').read_bytes())
+
+        cache.pregenerate(str(tmp_path / 'a.png'))
+        digest = cache.file_digest(str(tmp_path / 'a.png'))
+        assert cache.file_digest(str(tmp_path / 'copia.png')) == digest
+        assert Image.open(cache.lookup(digest, 800, 'webp')).size == (800, 400)
+        assert cache.ensure(str(tmp_path / 'copia.png'), 64) == cache.path(digest, 64, 'webp')
+
+        viejo = cache.path(digest, 800, 'webp')
+        os.utime(viejo, (0, 0))
+        cache.max_bytes = sum(os.path.getsize(cache.path(digest, s, 'webp')) for s in (64, 200)) + 1
+        cache.store('f' * 64, 64, 'png', b'x')
+        assert not os.path.exists(viejo)
+        assert cache.lookup('f' * 64, 64, 'png') is not None
+
+    def test_subida_y_miniatura_por_url(self, client, cache):
+        """✓ Subir una imagen genera sus miniaturas y ?w= las sirve"""
+        import os
+        from PIL import Image
+        client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+        imagen = BytesIO()
+        Image.new('RGB', (300, 300), 'green').save(imagen, format='PNG')
+        imagen.seek(0)
+        response = client.post('/api/productos/upload-imagen', data={'imagen': (imagen, 'verde.png')},
+                               content_type='multipart/form-data')
+        assert response.status_code == 201
+        url = response.get_json()['url']
+        try:
+            assert sum(len(files) for _, _, files in os.walk(cache.root)) == 3
+
+            response = client.get(f'{url}?w=64', headers={'Accept': 'image/webp,*/*'})
+            assert response.mimetype == 'image/webp'
+            assert Image.open(BytesIO(response.data)).size == (64, 64)
+            assert client.get(f'{url}?w=64').mimetype == 'image/png'
+            assert client.get(f'{url}?w=65').status_code == 400
+        finally:
+            os.remove(os.path.join(app.config['UPLOAD_FOLDER'], os.path.basename(url)))
+
+
+class TestXlsxWriter:
+    """Tests del writer XLSX en modo write_only"""
+
+    def test_tickets_excel(self, client):
+        """✓ Mis tickets en Excel: conteo de comentarios y anchos calculados en SQL"""
+        from openpyxl import load_workbook
+        client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+        with client.session_transaction() as sess:
+            sess['ingeniero_user'] = 'admin'
+        with app.app_context():
+            admin = Usuario.query.filter_by(username='admin').first()
+            for n, estado in enumerate(('en_progreso', 'resuelto', 'nuevo')):
+                ticket = Ticket(numero_ticket=f'T-{n}', titulo='Título ' * (n + 1), descripcion='d',
+                                nombre_solicitante='s', ingeniero_id=admin.id, estado=estado,
+                                fecha_creacion=datetime(2026, 1, n + 1))
+                for _ in range(n):
+                    ticket.comentarios.append(ComentarioTicket(ingeniero_id=admin.id, contenido='c'))
+                db.session.add(ticket)
+            db.session.commit()
+
+        response = client.get('/api/tickets/descargar/excel')
+        assert response.status_code == 200
+        ws = load_workbook(BytesIO(response.data)).active
+        filas = list(ws.values)
+        assert filas[0] == ('Número', 'Título', 'Solicitante', 'Estado', 'Fecha Creación', 'Comentarios')
+        assert [(f[0], f[5]) for f in filas[1:]] == [('T-1', 1), ('T-0', 0)]
+        assert ws.column_dimensions['B'].width == len('Título Título ') + 2
+
+
+class TestImportarExcel:
+    """Tests de la importación masiva desde Excel"""
+
+    @pytest.fixture(autouse=True)
+    def dirs(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(job_queue, 'jobs_dir', str(tmp_path / 'jobs'))
+        monkeypatch.setattr(product_importer, 'upload_dir', str(tmp_path / 'importaciones'))
+
+    def _importar(self, client, url, **kwargs):
+        """POST que encola la importación, ejecuta el trabajo y devuelve el estado final"""
+        response = client.post(url, content_type='multipart/form-data', **kwargs)
+        assert response.status_code == 202
+        encolado = response.get_json()
+        with app.app_context():
+            assert job_queue.run_pending() == 1
+        assert client.get(f"/api/jobs/{encolado['id']}").get_json()['estado'] == 'completado'
+        return client.get(encolado['importacion_url']).get_json()
+
+    def _xlsx(self, filas):
+        from openpyxl import Workbook
+        wb = Workbook()
+        ws = wb.active
+        ws.append(['A', 'B', 'Clave', 'D', 'E', 'Producto'])
+        for clave, descripcion in filas:
+            ws.append([None, None, clave, None, None, descripcion])
+        data = BytesIO()
+        wb.save(data)
+        data.seek(0)
+        return data
+
+    def test_importar_resumen_y_reporte(self, client):
+        """✓ Crea, actualiza y omite en bloque; las filas inválidas van al CSV de errores"""
+        client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+        with app.app_context():
+            db.session.add_all([Producto(nombre='A1', descripcion='vieja', precio=3, cantidad=1),
+                                Producto(nombre='A2', descripcion='igual', precio=3, cantidad=1)])
+            db.session.commit()
+
+        filas = [('A1', 'nueva'), ('A2', 'igual'), ('N1', 'n1'), (None, 'sin clave'), ('N2', 'x'), ('N2', 'n2')]
+        resumen = self._importar(client, '/api/productos/importar-excel',
+                                 data={'file': (self._xlsx(filas), 'CLAVES.xlsx')})
+        assert resumen['estado'] == 'aplicada'
+        assert {k: resumen[k] for k in ('filas', 'creados', 'actualizados', 'sin_cambios', 'errores')} == \
+            {'filas': 6, 'creados': 2, 'actualizados': 1, 'sin_cambios': 2, 'errores': 1}
+
+        reporte = client.get(resumen['reporte_errores_url']).get_data(as_text=True).splitlines()
+        assert reporte == ['fila,clave,error', '5,,Falta Clave o Producto']
+
+        with app.app_context():
+            productos = {p.nombre: p.descripcion for p in Producto.query}
+            assert productos == {'A1': 'nueva', 'A2': 'igual', 'N1': 'n1', 'N2': 'n2'}
+            assert EstadisticaCategoria.query.filter_by(categoria='Importado').one().productos == 2
+
+    def test_dry_run_y_confirmar_por_bloques(self, client):
+        """✓ dry_run devuelve el diff sin tocar productos; confirmar aplica por bloques"""
+        from product_import import ProductImporter
+        client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+        with app.app_context():
+            db.session.add(Producto(nombre='P0', descripcion='d0', precio=1, cantidad=1))
+            db.session.commit()
+
+        filas = [(f'P{i % 5}', f'd{i}') for i in range(12)]
+        preview = self._importar(client, '/api/productos/importar-excel?dry_run=1',
+                                 data={'file': (self._xlsx(filas), 'CLAVES.xlsx')})
+        assert preview['estado'] == 'previsualizada'
+        assert preview['resumen'] == {'filas': 12, 'nuevo': 4, 'cambio': 1, 'igual': 0, 'duplicado': 7,
+                                      'invalido': 0}
+        muestra = {m['clave']: m for m in preview['muestra']}
+        assert set(muestra) == {'P0', 'P1', 'P2', 'P3', 'P4'}
+        assert muestra['P0']['accion'] == 'cambio' and muestra['P0']['descripcion_actual'] == 'd0'
+        with app.app_context():
+            assert Producto.query.count() == 1
+            importacion = db.session.get(ImportacionProductos, preview['id'])
+            ProductImporter(db, chunk_size=2).apply(importacion)
+            assert importacion.aplicado_hasta > 0 and importacion.estado == 'aplicada'
+            assert {p.nombre: p.descripcion for p in Producto.query} == \
+                {'P0': 'd10', 'P1': 'd11', 'P2': 'd7', 'P3': 'd8', 'P4': 'd9'}
+
+        assert client.post(preview['confirmar_url']).status_code == 409
+
+    def test_confirmar_reserva_la_importacion(self, client):
+        """✓ Una segunda confirmación no encola otro apply; sólo se relanza sin trabajo activo"""
+        client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+        preview = self._importar(client, '/api/productos/importar-excel?dry_run=1',
+                                 data={'file': (self._xlsx([('C1', 'c1'), ('C2', 'c2')]), 'CLAVES.xlsx')})
+        assert client.post(preview['confirmar_url']).status_code == 202
+        repetida = client.post(preview['confirmar_url'])
+        assert repetida.status_code == 409 and repetida.get_json()['estado'] == 'encolada'
+
+        with app.app_context():
+            # El trabajo falla antes de aplicar: sin trabajo activo se puede relanzar
+            Job.query.filter_by(tipo='importar_productos', estado='pendiente').one().estado = 'error'
+            db.session.commit()
+        relanzada = client.post(preview['confirmar_url'])
+        assert relanzada.status_code == 202
+        with app.app_context():
+            assert job_queue.run_pending() == 1
+            assert Producto.query.count() == 2
+        assert client.get(relanzada.get_json()['importacion_url']).get_json()['estado'] == 'aplicada'
+
+    def test_confirmar_o_descartar_con_trabajo_en_curso(self, client):
+        """✓ Sin dry_run la importación pasa por 'previsualizada' con su trabajo en curso: 409"""
+        client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+        response = client.post('/api/productos/importar-excel', data={'file': (self._xlsx([('D1', 'd1')]), 'CLAVES.xlsx')},
+                               content_type='multipart/form-data')
+        encolado = response.get_json()
+        importacion_id = encolado['importacion_id']
+        with app.app_context():
+            # El worker reclama el trabajo (aplicar=True) y termina el diff, aún sin aplicar
+            job = db.session.get(Job, encolado['id'])
+            job.estado = 'en_curso'
+            db.session.commit()
+            importacion = db.session.get(ImportacionProductos, importacion_id)
+            product_importer.stage(importacion, product_importer.upload_path(importacion_id))
+            product_importer.diff(importacion)
+            assert importacion.estado == 'previsualizada'
+
+        confirmar = client.post(f'/api/productos/importar-excel/{importacion_id}/confirmar')
+        assert confirmar.status_code == 409
+        assert confirmar.get_json()['error'] == 'La importación tiene un trabajo pendiente o en curso'
+        assert client.delete(f'/api/productos/importar-excel/{importacion_id}').status_code == 409
+        with app.app_context():
+            assert Job.query.count() == 1
+            assert db.session.get(ImportacionProductos, importacion_id).estado == 'previsualizada'
+            db.session.get(Job, encolado['id']).estado = 'error'
+            db.session.commit()
+        assert client.delete(f'/api/productos/importar-excel/{importacion_id}').status_code == 200
+        with app.app_context():
+            assert db.session.get(ImportacionProductos, importacion_id).estado == 'descartada'
+
+    def test_trabajo_reanuda_tras_caida(self, client, monkeypatch):
+        """✓ Un trabajo reencolado continúa el staging desde la última fila confirmada"""
+        from jobs import JobContext
+        from product_import import importar_job
+        client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+        filas = [(f'R{i}', f'd{i}') for i in range(10)]
+        response = client.post('/api/productos/importar-excel', data={'file': (self._xlsx(filas), 'CLAVES.xlsx')},
+                               content_type='multipart/form-data')
+        encolado = response.get_json()
+
+        with app.app_context():
+            # Primer intento: el worker cae tras confirmar el primer bloque
+            importacion = db.session.get(ImportacionProductos, encolado['importacion_id'])
+            leidas = []
+
+            def _cae(imp):
+                leidas.append(imp.filas_leidas)
+                raise RuntimeError('worker caído')
+
+            monkeypatch.setattr(product_importer, 'chunk_size', 4)
+            with pytest.raises(RuntimeError):
+                product_importer.stage(importacion, product_importer.upload_path(importacion.id), on_chunk=_cae)
+            assert leidas == [5] and importacion.estado == 'cargando'
+
+            job = db.session.get(Job, encolado['id'])
+            resultado = importar_job(JobContext(job_queue, job), product_importer)
+            assert resultado['estado'] == 'aplicada' and resultado['resumen']['creados'] == 10
+            assert Producto.query.count() == 10
+            assert not os.path.exists(product_importer.upload_path(importacion.id))
+
+    def test_limite_subida_por_endpoint(self, client):
+        """✓ La importación admite hojas de más de 5MB; las imágenes siguen limitadas"""
+        client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+        grande = b'x' * (6 * 1024 * 1024)
+        response = client.post('/api/productos/importar-excel', data={'file': (BytesIO(grande), 'grande.txt')},
+                               content_type='multipart/form-data')
+        assert response.status_code == 400  # rechazado por extensión, no por tamaño
+        response = client.post('/api/productos/upload-imagen', data={'imagen': (BytesIO(grande), 'foto.png')},
+                               content_type='multipart/form-data')
+        assert response.status_code == 413
+
+
+
+class TestImportProcesos:
+    """Tests del importador de procesos por bloques (tools/import_procesos.py)"""
+
+    @pytest.fixture
+    def ip(self):
+        import importlib.util
+        spec = importlib.util.spec_from_file_location(
+            'import_procesos', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tools', 'import_procesos.py'))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+
+    def test_hhmmss(self, ip):
+        """✓ Normaliza celdas de tiempo de openpyxl y textos sin pandas"""
+        from datetime import time
+        assert ip.hhmmss(time(1, 30)) == '01:30:00'
+        assert ip.hhmmss(timedelta(hours=26, seconds=5)) == '26:00:05'
+        assert ip.hhmmss(0.5) == '12:00:00'
+        assert ip.hhmmss(' 1:05 ') == '01:05:00'
+        assert ip.hhmmss('1 day, 02:00:00') == '26:00:00'
+        assert ip.hhmmss('') is None and ip.hhmmss('abc') is None and ip.hhmmss(None) is None
+
+    def test_bloques_en_streaming_y_carga(self, client, ip, tmp_path):
+        """✓ Recorre todas las hojas, gana el último bloque de cada clave y carga en bloque"""
+        from datetime import time
+        from openpyxl import Workbook
+        wb = Workbook()
+        ws = wb.active
+        ws.append([None, 'AS01', 'Soporte', 'grande'])
+        ws.append(['PROC.', 'C.T.', 'OPERACIÓN', 'T/E'])
+        ws.append(['1°', 'TORNO', 'CORTE', time(0, 10)])
+        ws.append(['2°', 'TORNO', 'CORTE', '0:05'])
+        ws.append([None, 'BY01', 'Base'])
+        ws.append([1, 'SOLDADURA', 'SOLDAR', None])
+        otra = wb.create_sheet('Revisión')
+        otra.append([None, 'as01', 'Soporte v2'])
+        otra.append(['1°', 'SOLDADURA', 'SOLDAR', '00:03:00'])
+        otra.append(['2°', 'TORNO', 'CORTE', None])
+        path = tmp_path / 'procesos.xlsx'
+        wb.save(path)
+
+        pasos = list(ip.iter_blocks(str(path)))
+        assert [(p.clave, p.block_id, p.orden) for p in pasos] == [('AS01', 0, 1), ('AS01', 0, 2), ('BY01', 0, 1)]
+        assert pasos[0].tiempo_estimado == '00:10:00' and pasos[0].nombre_clave == 'Soporte grande'
+        assert len(list(ip.iter_blocks(str(path), all_sheets=True))) == 5
+
+        from cache_versions import get_version
+        ip.import_file(str(path), None, overwrite=False, all_sheets=True)
+        with app.app_context():
+            assert get_version(db, 'claves_procesos') == 1
+            secuencias = {(c.clave.clave, c.orden, c.operacion, c.t_e) for c in ClaveProceso.query}
+            assert secuencias == {('AS01', 1, 'SOLDAR', '00:03:00'), ('AS01', 2, 'CORTE', None),
+                                  ('BY01', 1, 'SOLDAR', None)}
+            assert ProcesoCatalogo.query.count() == 2
+            assert db.session.query(ClaveProducto.nombre).filter_by(clave='AS01').scalar() == 'Soporte v2'
+
+
 if __name__ == '__main__':
     pytest.main([__file__, '-v', '--tb=short'])
@@ -0,0 +1,218 @@
+"""
+Miniaturas de imágenes de producto y de tickets, cacheadas en disco.
+
+- Tamaños fijos (SIZES, lado máximo en px): 64 (listados), 200 (tarjetas,
+  Excel) y 800 (detalle). Formato webp para la web y png para el Excel
+  (openpyxl no incrusta webp).
+- Direccionadas por contenido: <dir>/<sha256[:2]>/<sha256>-<px>.<fmt>, donde
+  sha256 es el del fichero original. Dos subidas de la misma imagen
+  comparten miniaturas, y una URL servida con ese nombre nunca cambia de
+  contenido (se puede cachear como inmutable).
+- Las imágenes remotas (imagen_url http...) se identifican por su URL: se
+  guarda URL -> sha256 durante `remote_ttl` horas para no volver a
+  descargarlas en cada exportación.
+- Límite de tamaño con expulsión LRU: cada acierto renueva el mtime del
+  fichero (como mucho una vez por TOUCH_INTERVAL) y, al superar `max_bytes`,
+  se borran las más antiguas hasta quedar en el 80 %.
+
+Se generan al subir la imagen (upload_imagen, subir_imagen_ticket) o, si
+no existen, en la primera petición /uploads/productos/<fichero>?w=<px> o en
+la primera exportación.
+"""
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from io import BytesIO
+
+logger = logging.getLogger(__name__)
+
+SIZES = (64, 200, 800)
+WEB_FORMAT = 'webp'
+FORMATS = {'webp': 'WEBP', 'png': 'PNG'}
+MIMETYPES = {'webp': 'image/webp', 'png': 'image/png'}
+# Segundos mínimos entre dos renovaciones del mtime de una misma miniatura
+TOUCH_INTERVAL = 3600
+REMOTE_DIR = '_remotas'
+
+
+def render_thumbnail(data, size, fmt):
+    """bytes de imagen -> bytes de la miniatura (puede ejecutarse en otro proceso)."""
+    from PIL import Image, ImageOps
+
+    img = Image.open(BytesIO(data))
+    img = ImageOps.exif_transpose(img)
+    img.thumbnail((size, size), Image.Resampling.LANCZOS)
+    if img.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+        img = img.convert('RGBA' if 'transparency' in img.info or img.mode == 'PA' else 'RGB')
+    out = BytesIO()
+    if fmt == 'webp':
+        img.save(out, format='WEBP', quality=82, method=4)
+    else:
+        img.save(out, format=FORMATS[fmt])
+    return out.getvalue()
+
+
+class ThumbnailCache(object):
+    """Miniaturas en disco direccionadas por contenido, con tamaño máximo (LRU)."""
+
+    def __init__(self, root, max_bytes=500 * 1024 * 1024, remote_ttl_hours=24):
+        self.root = os.path.abspath(root)
+        self.max_bytes = int(max_bytes)
+        self.remote_ttl = float(remote_ttl_hours) * 3600
+        self._lock = threading.Lock()
+        self._bytes = None          # tamaño total estimado (se calcula al primer store)
+        self._digests = {}          # (ruta, mtime, tamaño) -> sha256
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            os.getenv('THUMBNAIL_DIR', 'cache/miniaturas'),
+            max_bytes=int(os.getenv('THUMBNAIL_CACHE_MB', '500')) * 1024 * 1024,
+            remote_ttl_hours=float(os.getenv('THUMBNAIL_REMOTE_TTL_HOURS', '24'))
+        )
+
+    # ---- Claves ----------------------------------------------------------------
+
+    @staticmethod
+    def digest(data):
+        return hashlib.sha256(data).hexdigest()
+
+    def file_digest(self, path):
+        """sha256 del fichero, memorizado mientras no cambien mtime/tamaño."""
+        st = os.stat(path)
+        key = (path, st.st_mtime_ns, st.st_size)
+        digest = self._digests.get(key)
+        if digest is None:
+            h = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    h.update(chunk)
+            digest = h.hexdigest()
+            if len(self._digests) > 10000:
+                self._digests.clear()
+            self._digests[key] = digest
+        return digest
+
+    def remote_digest(self, url):
+        """sha256 de la última descarga de `url` si no ha caducado; si no, None."""
+        path = self._remote_path(url)
+        try:
+            if time.time() - os.path.getmtime(path) > self.remote_ttl:
+                return None
+            with open(path) as f:
+                return f.read().strip() or None
+        except OSError:
+            return None
+
+    def remember_remote(self, url, digest):
+        self._write(self._remote_path(url), digest.encode('ascii'))
+
+    # ---- Variantes -------------------------------------------------------------
+
+    def path(self, digest, size, fmt):
+        return os.path.join(self.root, digest[:2], f'{digest}-{size}.{fmt}')
+
+    def lookup(self, digest, size, fmt):
+        """Ruta de la variante si ya existe (y la marca como usada)."""
+        path = self.path(digest, size, fmt)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return None
+        if time.time() - mtime > TOUCH_INTERVAL:
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+        return path
+
+    def store(self, digest, size, fmt, data):
+        path = self.path(digest, size, fmt)
+        self._write(path, data)
+        self._account(len(data))
+        return path
+
+    def ensure(self, source_path, size, fmt=WEB_FORMAT):
+        """Ruta de la miniatura de un fichero local; la genera si no existe."""
+        digest = self.file_digest(source_path)
+        path = self.lookup(digest, size, fmt)
+        if path is None:
+            with open(source_path, 'rb') as f:
+                path = self.store(digest, size, fmt, render_thumbnail(f.read(), size, fmt))
+        return path
+
+    def pregenerate(self, source_path, fmt=WEB_FORMAT):
+        """Genera todas las variantes web de una imagen recién subida.
+
+        No falla la subida: si la imagen no se puede decodificar se registra y
+        se generarán (o fallarán) al pedirlas.
+        """
+        try:
+            digest = self.file_digest(source_path)
+            with open(source_path, 'rb') as f:
+                data = f.read()
+            for size in SIZES:
+                if self.lookup(digest, size, fmt) is None:
+                    self.store(digest, size, fmt, render_thumbnail(data, size, fmt))
+        except Exception as e:
+            logger.warning(f"[MINIATURAS] No se pudieron generar miniaturas de {source_path}: {e}")
+
+    # ---- Internos ----------------------------------------------------------------
+
+    def _remote_path(self, url):
+        return os.path.join(self.root, REMOTE_DIR, hashlib.sha1(url.encode('utf-8')).hexdigest())
+
+    def _write(self, path, data):
+        # Escritura atómica: otro worker nunca ve un fichero a medias
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            raise
+
+    def _variants(self):
+        for entry in os.scandir(self.root):
+            if not entry.is_dir() or entry.name == REMOTE_DIR:
+                continue
+            for f in os.scandir(entry.path):
+                if f.is_file() and not f.name.endswith('.tmp'):
+                    yield f
+
+    def _account(self, added):
+        with self._lock:
+            if self._bytes is None:
+                self._bytes = sum(f.stat().st_size for f in self._variants())
+            else:
+                self._bytes += added
+            if self._bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # Cada worker lleva su propia estimación: al desbordar se recorre el
+        # directorio (tamaño real) y se borran las menos usadas
+        ficheros = sorted(((f.stat().st_mtime, f.stat().st_size, f.path) for f in self._variants()))
+        total = sum(size for _, size, _ in ficheros)
+        objetivo = int(self.max_bytes * 0.8)
+        borrados = 0
+        for _, size, path in ficheros:
+            if total <= objetivo:
+                break
+            try:
+                os.unlink(path)
+                total -= size
+                borrados += 1
+            except OSError:
+                pass
+        self._bytes = total
+        if borrados:
+            logger.info(f"[MINIATURAS] {borrados} miniaturas expulsadas (LRU), {total // 1024} KiB en caché")
@@ -1,7 +1,10 @@
 import argparse
+import csv
 import os
+import re
 import sys
-from typing import Optional
+from datetime import datetime, time, timedelta
+from typing import Iterator, NamedTuple, Optional
 
 # Obtener la ruta del directorio raíz (padre de tools/)
 script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -13,109 +16,157 @@ print(f"Script dir: {script_dir}")
 print(f"Root dir: {root_dir}")
 print(f"Archivos en root: {os.listdir(root_dir)[:5]}")
 
-import pandas as pd
+from sqlalchemy import bindparam, func
 
 from app import app, db
+from cache_versions import bump_version
 from models import ProcesoCatalogo, ClaveProducto, ClaveProceso
 
 
 # --- Helpers --------------------------------------------------------------
 
-def hhmmss(val: Optional[str]) -> Optional[str]:
-    """Normalize a time-like value to HH:MM:SS; return None if empty/invalid."""
-    if val is None:
-        return None
-    text = str(val).strip()
-    if not text:
-        return None
-    try:
-        td = pd.to_timedelta(text)
-    except Exception:
-        return None
-    total_seconds = int(td.total_seconds())
+# H:MM[:SS[.fff]], opcionalmente precedido de "N day(s)" (formato de str(timedelta))
+_HHMMSS = re.compile(r"^(?:(\d+)\s*days?,?\s*)?(\d+):(\d{1,2})(?::(\d{1,2})(?:\.\d*)?)?$", re.IGNORECASE)
+
+
+def _format_seconds(total_seconds: int) -> str:
     h, r = divmod(total_seconds, 3600)
     m, s = divmod(r, 60)
     return f"{h:02d}:{m:02d}:{s:02d}"
 
 
-def parse_excel_blocks(path: str, sheet: Optional[str]) -> pd.DataFrame:
-    """Parse el Excel con formato de bloques repetidos por clave."""
-    import re
-    
+def hhmmss(val) -> Optional[str]:
+    """Normalize a time-like value to HH:MM:SS; return None if empty/invalid.
+
+    Accepts what openpyxl returns for time cells (time, timedelta, datetime),
+    Excel day fractions (float) and strings like "1:30", "01:30:00" or
+    "1 day, 02:00:00".
+    """
+    if val is None or isinstance(val, bool):
+        return None
+    if isinstance(val, timedelta):
+        return _format_seconds(int(val.total_seconds()))
+    if isinstance(val, datetime):
+        val = val.time()
+    if isinstance(val, time):
+        return _format_seconds(val.hour * 3600 + val.minute * 60 + val.second)
+    if isinstance(val, (int, float)):
+        if val != val or val < 0:  # NaN
+            return None
+        return _format_seconds(int(round(val * 86400)))
+    match = _HHMMSS.match(str(val).strip())
+    if not match:
+        return None
+    days, h, m, s = match.groups()
+    return _format_seconds(int(days or 0) * 86400 + int(h) * 3600 + int(m) * 60 + int(s or 0))
+
+
+class Paso(NamedTuple):
+    """Fila de datos de un bloque del Excel de procesos."""
+    clave: str
+    nombre_clave: Optional[str]
+    block_id: int  # n-ésima aparición de la clave en el libro (gana la última)
+    orden: int
+    centro_trabajo: str
+    operacion: str
+    tiempo_estimado: Optional[str]
+
+
+# Claves válidas: letras seguidas de números (AS01, BY01/BY02, etc.)
+CLAVE_PATTERN = re.compile(r'^[A-Z]{1,4}\d{1,3}(/[A-Z]{1,4}\d{1,3})?$', re.IGNORECASE)
+# Encabezados que se descartan al componer el nombre de la clave
+NOMBRE_EXCLUIDOS = frozenset(["PROC.", "C.T.", "OPERACIÓN", "T/E", "T/CT", "T/O", "T/TCT", "KG.BRUTO", "$ -"])
+
+
+def _celda(row: tuple, i: int) -> str:
+    """Texto de la celda i (vacío si no existe); enteros sin '.0'."""
+    if i >= len(row):
+        return ""
+    val = row[i]
+    if val is None:
+        return ""
+    if isinstance(val, float) and val.is_integer():
+        val = int(val)
+    return str(val).strip()
+
+
+def _iter_sheet_rows(path: str, sheet: Optional[str], all_sheets: bool) -> Iterator[tuple]:
+    """Filas (tuplas de valores) de la hoja elegida, o de todas, en streaming."""
     ext = os.path.splitext(path)[1].lower()
-    if ext in (".xlsx", ".xls"):
-        sheet_name = sheet if sheet else 0
-        df_raw = pd.read_excel(path, sheet_name=sheet_name, header=None)
+    if ext == ".xlsx":
+        import openpyxl
+
+        wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+        try:
+            if all_sheets:
+                hojas = wb.worksheets
+            else:
+                hojas = [wb[sheet] if sheet else wb.worksheets[0]]
+            for ws in hojas:
+                yield from ws.iter_rows(values_only=True)
+        finally:
+            wb.close()
+    elif ext == ".xls":
+        # openpyxl no lee el formato binario antiguo: pandas (+ xlrd) sólo para este caso
+        import pandas as pd
+
+        hojas = pd.read_excel(path, sheet_name=None if all_sheets else (sheet or 0), header=None, dtype=object)
+        for df_raw in (hojas.values() if all_sheets else [hojas]):
+            for row in df_raw.itertuples(index=False, name=None):
+                yield tuple(None if v != v else v for v in row)
     else:
-        df_raw = pd.read_csv(path, header=None)
-    
-    records = []
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            yield from csv.reader(f)
+
+
+def iter_blocks(path: str, sheet: Optional[str] = None, all_sheets: bool = False) -> Iterator[Paso]:
+    """Parsea el Excel con formato de bloques repetidos por clave.
+
+    Generador: lee la hoja fila a fila (openpyxl read_only), así que la
+    memoria no depende del tamaño del libro. Con all_sheets recorre todas las
+    hojas en orden; una clave repetida en otra hoja cuenta como un bloque más.
+    """
     current_clave = None
     current_nombre = None
     current_block_id = {}  # Contador de bloques por clave
     orden = 0
-    
-    # Patrón para detectar claves válidas: letras seguidas de números (AS01, BY01/BY02, etc.)
-    clave_pattern = re.compile(r'^[A-Z]{1,4}\d{1,3}(/[A-Z]{1,4}\d{1,3})?$', re.IGNORECASE)
-    
-    for idx, row in df_raw.iterrows():
+
+    for row in _iter_sheet_rows(path, sheet, all_sheets):
         # Columna B (índice 1) tiene claves como AS01, AS02, etc.
-        col_b = str(row.iloc[1] if len(row) > 1 else "").strip()
-        
+        col_b = _celda(row, 1)
+
         # Detectar fila de clave (debe coincidir con el patrón AS01, BY01, etc.)
-        if col_b and clave_pattern.match(col_b):
+        if col_b and len(col_b) <= 15 and col_b[0].isalpha() and CLAVE_PATTERN.match(col_b):
             # Es una clave nueva (o repetida)
             current_clave = col_b.upper()
-            # Incrementar el ID de bloque para esta clave
             current_block_id[current_clave] = current_block_id.get(current_clave, -1) + 1
-            # El nombre está en columnas posteriores (C, D, E, F aprox.)
-            # Intentar primero columna C (índice 2), si no hay datos seguir con D, E, F, etc.
+            # El nombre está en columnas posteriores (C hasta L, índices 2-11)
             nombre_parts = []
-            for i in range(2, 12):  # Columnas C hasta L (índices 2-11)
-                if i < len(row) and pd.notna(row.iloc[i]):
-                    val = str(row.iloc[i]).strip()
-                    # Descartar valores que sean códigos, encabezados comunes, o unnamed
-                    if val and val.upper() != current_clave and not val.startswith("Unnamed") and val.upper() not in ["PROC.", "C.T.", "OPERACIÓN", "T/E", "T/CT", "T/O", "T/TCT", "KG.BRUTO", "$ -"]:
-                        nombre_parts.append(val)
-            current_nombre = " ".join(nombre_parts).strip() if nombre_parts else None
+            for i in range(2, min(12, len(row))):
+                val = _celda(row, i)
+                if val and val.upper() != current_clave and val.upper() not in NOMBRE_EXCLUIDOS:
+                    nombre_parts.append(val)
+            current_nombre = " ".join(nombre_parts) or None
             orden = 0
             print(f"Detectada clave: {current_clave} - {current_nombre}")
             continue
-        
+
         # Detectar fila de encabezados (tiene "PROC." en columna A o "C.T." en columna B)
-        col_a = str(row.iloc[0] if len(row) > 0 else "").strip()
+        col_a = _celda(row, 0)
         if col_a == "PROC." or col_b == "C.T.":
             continue
-        
+
         # Detectar fila de datos (tiene 1°, 2°, 3°, 4°, 5° en columna A)
         if current_clave and col_a and (col_a.endswith("°") or (col_a.isdigit() and int(col_a) < 100)):
             orden += 1
-            ct = str(row.iloc[1] if len(row) > 1 else "").strip()  # C.T.
-            operacion = str(row.iloc[2] if len(row) > 2 else "").strip()  # OPERACIÓN
-            te = str(row.iloc[3] if len(row) > 3 else "").strip()  # T/E
-            
-            if ct and operacion and ct != "C.T.":
-                records.append({
-                    'clave': current_clave,
-                    'nombre_clave': current_nombre,
-                    'block_id': current_block_id.get(current_clave, 0),  # Identificador de bloque
-                    'orden': orden,
-                    'centro_trabajo': ct,
-                    'operacion': operacion,
-                    'tiempo_estimado': te if te and te != 'nan' else None,
-                })
-    
-    df = pd.DataFrame(records)
-    print(f"\nRegistros parseados: {len(df)}")
-    print(f"Claves únicas: {df['clave'].nunique() if len(df) > 0 else 0}")
-    if len(df) > 0:
-        print(f"Claves encontradas: {sorted(df['clave'].unique())}")
-        print(f"\nPrimeros 10 registros:")
-        print(df.head(10))
-    return df
+            ct = col_b  # C.T.
+            operacion = _celda(row, 2)  # OPERACIÓN
+            if ct and operacion:
+                yield Paso(current_clave, current_nombre, current_block_id[current_clave], orden, ct, operacion,
+                           hhmmss(row[3] if len(row) > 3 else None))  # T/E
 
 
-def normalize_columns(df: pd.DataFrame) -> pd.DataFrame:
+def normalize_columns(df: "pd.DataFrame") -> "pd.DataFrame":
     """Mapea nombres de columnas flexibles a nombres estándar."""
     mapping = {
         'clave': ['clave', 'CLAVE', 'Clave', 'PROC.', 'proc'],
@@ -146,132 +197,187 @@ def normalize_columns(df: pd.DataFrame) -> pd.DataFrame:
 
 # --- Import logic ---------------------------------------------------------
 
-def import_file(path: str, sheet: Optional[str], overwrite: bool, header_row: int = 0) -> None:
-    # Parsear el Excel con formato de bloques
-    df = parse_excel_blocks(path, sheet)
-    
-    if len(df) == 0:
+def import_file(path: str, sheet: Optional[str], overwrite: bool, header_row: int = 0,
+                all_sheets: bool = False) -> None:
+    # Última aparición de cada clave: un bloque posterior sustituye a los anteriores
+    bloques = {}  # clave -> (block_id, [Paso])
+    apariciones = {}  # clave -> filas por bloque
+    parseados = 0
+    for paso in iter_blocks(path, sheet, all_sheets):
+        parseados += 1
+        apariciones.setdefault(paso.clave, {}).setdefault(paso.block_id, 0)
+        apariciones[paso.clave][paso.block_id] += 1
+        block_id, pasos = bloques.get(paso.clave, (-1, None))
+        if paso.block_id != block_id:
+            bloques[paso.clave] = (paso.block_id, [paso])
+        else:
+            pasos.append(paso)
+
+    print(f"\nRegistros parseados: {parseados}")
+    print(f"Claves únicas: {len(bloques)}")
+    if not bloques:
         raise ValueError("No se encontraron datos válidos en el archivo")
+    print(f"Claves encontradas: {sorted(bloques)}")
 
-    required = {"clave", "orden", "centro_trabajo", "operacion"}
-    missing = required - set(df.columns)
-    if missing:
-        raise ValueError(f"Faltan columnas requeridas: {missing}\nColumnas disponibles: {list(df.columns)}")
-
-    # Detectar claves duplicadas (múltiples bloques)
-    if 'block_id' in df.columns:
-        max_block_per_clave = df.groupby('clave')['block_id'].max()
-        claves_duplicadas = max_block_per_clave[max_block_per_clave > 0]
-        if len(claves_duplicadas) > 0:
-            print(f"\n⚠ Claves duplicadas detectadas (se usará última aparición):")
-            for clave, max_block in claves_duplicadas.items():
-                count = df[df['clave'] == clave].groupby('block_id').size()
-                print(f"   {clave}: {max_block+1} apariciones - filas por bloque: {list(count)}")
-            
-            # Filtrar: mantener solo el último bloque de cada clave
-            df['_max_block'] = df.groupby('clave')['block_id'].transform('max')
-            df = df[df['block_id'] == df['_max_block']].copy()
-            df = df.drop(columns=['block_id', '_max_block'])
-            print(f"   Mantenidos {len(df)} registros de últimas apariciones")
-        else:
-            df = df.drop(columns=['block_id'])
-    
-    df = df.sort_values(["clave", "orden"])  # asegura orden correcto
-    
-    # Deduplicar procesos repetidos dentro de cada clave:
-    # Mantener solo la PRIMERA ocurrencia de cada combinación única (centro_trabajo, operacion)
-    df['_dedup_key'] = df['centro_trabajo'] + '|' + df['operacion']
-    df['_grupo_clave'] = df.groupby('clave', sort=False)['_dedup_key'].rank(method='first')
-    # Marcar como duplicado si la primera ocurrencia de esta (ct, op) en la clave no es esta fila
-    df['_es_duplicado'] = df.groupby(['clave', '_dedup_key']).cumcount() > 0
-    duplicados_eliminados = df['_es_duplicado'].sum()
+    claves_duplicadas = {c: n for c, n in apariciones.items() if len(n) > 1}
+    if claves_duplicadas:
+        print(f"\n⚠ Claves duplicadas detectadas (se usará última aparición):")
+        for clave, filas in claves_duplicadas.items():
+            print(f"   {clave}: {len(filas)} apariciones - filas por bloque: {list(filas.values())}")
+
+    # Deduplicar procesos repetidos dentro de cada clave: se mantiene la PRIMERA
+    # ocurrencia de cada (centro_trabajo, operacion) y se renumera el orden
+    records = []
+    duplicados_eliminados = 0
+    for clave in sorted(bloques):
+        vistos = set()
+        for paso in sorted(bloques[clave][1], key=lambda p: p.orden):
+            key = (paso.centro_trabajo, paso.operacion)
+            if key in vistos:
+                duplicados_eliminados += 1
+                continue
+            vistos.add(key)
+            records.append(paso._replace(orden=len(vistos))._asdict())
     if duplicados_eliminados > 0:
         print(f"\n⚠ Eliminados {duplicados_eliminados} procesos duplicados dentro de claves")
-        df = df[~df['_es_duplicado']].copy()
-    df = df.drop(columns=['_dedup_key', '_grupo_clave', '_es_duplicado'])
-    
-    # Reordenar orden después de deduplicar
-    df['orden'] = df.groupby('clave', sort=False).cumcount() + 1
-
-    # Agrupamos por clave para poder limpiar secuencia por clave si overwrite=True
-    grouped = df.groupby("clave", sort=False)
 
     with app.app_context():
-        for clave_code, gdf in grouped:
-            clave_code = str(clave_code).strip()
-            if not clave_code:
-                continue
+        load_records(records, overwrite)
+
+
+def _texto(val) -> Optional[str]:
+    """str limpio o None (vacío / NaN)."""
+    if val is None or val != val:  # NaN
+        return None
+    text = str(val).strip()
+    return text or None
+
+
+def _chunks(rows, size):
+    for i in range(0, len(rows), size):
+        yield rows[i:i + size]
+
+
+def load_records(records, overwrite: bool, chunk_size: int = 1000) -> None:
+    """Carga en bloque: claves, procesos del catálogo y secuencias.
+
+    En lugar de consultar el catálogo paso a paso y hacer commit por clave:
+
+    1. claves_producto: una consulta para las existentes, un INSERT
+       multi-fila para las nuevas y un UPDATE (executemany) de nombre/notas.
+    2. procesos_catalogo: los pares (centro_trabajo, operacion) distintos se
+       resuelven con una consulta; los que faltan se insertan en bloque.
+    3. clave_procesos: con overwrite, un único DELETE de las secuencias de
+       las claves del fichero; después un INSERT multi-fila por bloque de
+       `chunk_size`. Sin overwrite se omiten los pasos (clave, proceso) que
+       ya existen en vez de fallar por uq_clave_proceso_unico.
+
+    Todo en una transacción: o se importa el fichero completo o nada. Como
+    no pasa por el flush del ORM, incrementa la versión 'claves_procesos'
+    (ETag de /api/claves_procesos) en la misma transacción.
+    """
+    from sqlalchemy import select
+
+    session = db.session
+    claves_t = ClaveProducto.__table__
+    procesos_t = ProcesoCatalogo.__table__
+    pasos_t = ClaveProceso.__table__
+
+    pasos = []
+    claves = {}  # clave -> {'nombre', 'notas'} (primer valor no vacío)
+    for r in records:
+        clave = _texto(r.get("clave"))
+        ct = _texto(r.get("centro_trabajo"))
+        oper = _texto(r.get("operacion"))
+        if not clave or not ct or not oper:
+            continue
+        info = claves.setdefault(clave, {"nombre": None, "notas": None})
+        info["nombre"] = info["nombre"] or _texto(r.get("nombre_clave"))
+        info["notas"] = info["notas"] or _texto(r.get("notas_clave"))
+        pasos.append({
+            "clave": clave, "ct": ct, "oper": oper, "orden": int(r["orden"]),
+            "t_e": hhmmss(r.get("tiempo_estimado")), "notas": _texto(r.get("notas_paso")),
+        })
+    if not pasos:
+        return
 
-            # Upsert de clave
-            clave_obj = ClaveProducto.query.filter_by(clave=clave_code).first()
-            if not clave_obj:
-                clave_obj = ClaveProducto(clave=clave_code, activo=True)
-                db.session.add(clave_obj)
-                db.session.flush()
-
-            # Actualizar nombre/notas si vienen
-            nombre_clave = str(gdf.get("nombre_clave", pd.Series([None])).iloc[0] or "").strip()
-            notas_clave = str(gdf.get("notas_clave", pd.Series([None])).iloc[0] or "").strip()
-            if nombre_clave:
-                clave_obj.nombre = nombre_clave
-            if notas_clave:
-                clave_obj.notas = notas_clave
-
-            # Si overwrite, limpiar secuencia previa de esta clave
-            if overwrite:
-                deleted_count = ClaveProceso.query.filter_by(clave_id=clave_obj.id).delete()
-                # COMMIT inmediato para asegurar que DELETE se ejecuta antes de INSERT
-                db.session.commit()
-                # Limpiar sesión para evitar que SQLAlchemy reinserte objetos viejos
-                db.session.expire_all()
-                if deleted_count > 0:
-                    print(f"  Limpiadas {deleted_count} filas previas de {clave_code}")
-
-            # Cache local de procesos para esta corrida
-            proc_cache = {}
-
-            for _, row in gdf.iterrows():
-                ct = str(row["centro_trabajo"]).strip()
-                oper = str(row["operacion"]).strip()
-                orden = int(row["orden"])
-                t_e = hhmmss(row.get("tiempo_estimado"))
-                notas_paso = str(row.get("notas_paso") or "").strip() or None
-
-                if not ct or not oper:
-                    continue
-
-                key_proc = (ct.lower(), oper.lower())
-                proc_obj = proc_cache.get(key_proc)
-                if not proc_obj:
-                    # Deshabilitar autoflush para evitar conflictos con ClaveProceso pendientes
-                    with db.session.no_autoflush:
-                        proc_obj = ProcesoCatalogo.query.filter_by(centro_trabajo=ct, operacion=oper).first()
-                if not proc_obj:
-                    proc_obj = ProcesoCatalogo(
-                        centro_trabajo=ct,
-                        operacion=oper,
-                        nombre=oper,
-                        activo=True,
-                        tiempo_estimado=t_e,
-                    )
-                    db.session.add(proc_obj)
-                    db.session.flush()
-                proc_cache[key_proc] = proc_obj
-
-                cp = ClaveProceso(
-                    clave=clave_obj,
-                    proceso=proc_obj,
-                    orden=orden,
-                    centro_trabajo=ct,
-                    operacion=oper,
-                    t_e=t_e,
-                    notas=notas_paso,
-                )
-                db.session.add(cp)
-
-            # Commit por clave para evitar transacción gigante
-            db.session.commit()
-            print(f"✓ Importada clave {clave_code} con {len(gdf)} pasos")
+    try:
+        # 1. Claves
+        clave_ids = dict(session.execute(
+            select(claves_t.c.clave, claves_t.c.id).where(claves_t.c.clave.in_(list(claves)))
+        ).all())
+        nuevas = [{"clave": c, "nombre": i["nombre"], "notas": i["notas"], "activo": True,
+                   "fecha_creacion": datetime.utcnow()} for c, i in claves.items() if c not in clave_ids]
+        for bloque in _chunks(nuevas, chunk_size):
+            session.execute(claves_t.insert().values(bloque))
+        cambios = [{"_id": clave_ids[c], "nombre": i["nombre"], "notas": i["notas"]}
+                   for c, i in claves.items() if c in clave_ids and (i["nombre"] or i["notas"])]
+        if cambios:
+            # Sólo se pisan los campos que vienen en el fichero
+            session.execute(claves_t.update().where(claves_t.c.id == bindparam("_id")).values(
+                nombre=func.coalesce(bindparam("nombre"), claves_t.c.nombre),
+                notas=func.coalesce(bindparam("notas"), claves_t.c.notas),
+            ), cambios)
+        if nuevas:
+            clave_ids.update(session.execute(
+                select(claves_t.c.clave, claves_t.c.id).where(claves_t.c.clave.in_([n["clave"] for n in nuevas]))
+            ).all())
+
+        # 2. Procesos del catálogo (el de menor id si hay repetidos, como .first())
+        def _resolver():
+            cts = sorted({p["ct"] for p in pasos})
+            ids = {}
+            filas = session.execute(
+                select(procesos_t.c.id, procesos_t.c.centro_trabajo, procesos_t.c.operacion)
+                .where(procesos_t.c.centro_trabajo.in_(cts)).order_by(procesos_t.c.id)
+            )
+            for proc_id, ct, oper in filas:
+                ids.setdefault((ct, oper), proc_id)
+            return ids
+
+        proceso_ids = _resolver()
+        faltan = {}
+        for p in pasos:
+            key = (p["ct"], p["oper"])
+            if key not in proceso_ids and key not in faltan:
+                faltan[key] = {"centro_trabajo": p["ct"], "operacion": p["oper"], "nombre": p["oper"],
+                               "activo": True, "tiempo_estimado": p["t_e"], "fecha_creacion": datetime.utcnow()}
+        for bloque in _chunks(list(faltan.values()), chunk_size):
+            session.execute(procesos_t.insert().values(bloque))
+        if faltan:
+            proceso_ids = _resolver()
+            print(f"  {len(faltan)} procesos nuevos en el catálogo")
+
+        # 3. Secuencias
+        ids_fichero = [clave_ids[c] for c in claves]
+        existentes = set()
+        if overwrite:
+            borradas = session.execute(pasos_t.delete().where(pasos_t.c.clave_id.in_(ids_fichero))).rowcount
+            if borradas:
+                print(f"  Limpiadas {borradas} filas previas")
+        else:
+            existentes = set(session.execute(
+                select(pasos_t.c.clave_id, pasos_t.c.proceso_id).where(pasos_t.c.clave_id.in_(ids_fichero))
+            ).all())
+
+        filas = []
+        for p in pasos:
+            key = (clave_ids[p["clave"]], proceso_ids[(p["ct"], p["oper"])])
+            if key in existentes:
+                continue
+            existentes.add(key)
+            filas.append({"clave_id": key[0], "proceso_id": key[1], "orden": p["orden"], "centro_trabajo": p["ct"],
+                          "operacion": p["oper"], "t_e": p["t_e"], "notas": p["notas"]})
+        for bloque in _chunks(filas, chunk_size):
+            session.execute(pasos_t.insert().values(bloque))
+        # Las sentencias en bloque no pasan por el flush (track_changes): invalidar a mano
+        bump_version(db, "claves_procesos")
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    print(f"✓ Importadas {len(claves)} claves ({len(nuevas)} nuevas) con {len(filas)} pasos "
+          f"({len(pasos) - len(filas)} ya existentes)")
 
 
 # --- CLI ------------------------------------------------------------------
@@ -280,6 +386,7 @@ def main():
     parser = argparse.ArgumentParser(description="Importa claves y procesos desde CSV/Excel")
     parser.add_argument("--file", required=True, help="Ruta al CSV o Excel")
     parser.add_argument("--sheet", default=None, help="Nombre de hoja (solo Excel)")
+    parser.add_argument("--all-sheets", action="store_true", help="Recorre todas las hojas del libro")
     parser.add_argument("--header", type=int, default=0, help="Fila del encabezado (0=primera fila, 1=segunda, etc.)")
     parser.add_argument("--overwrite", action="store_true", help="Sobrescribe la secuencia existente de cada clave")
     args = parser.parse_args()
@@ -288,7 +395,7 @@ def main():
         print(f"No se encuentra el archivo: {args.file}", file=sys.stderr)
         sys.exit(1)
 
-    import_file(args.file, args.sheet, args.overwrite, args.header)
+    import_file(args.file, args.sheet, args.overwrite, args.header, all_sheets=args.all_sheets)
     print("Importación completada.")
 
 
@@ -0,0 +1,147 @@
+"""
+Caché del usuario en sesión.
+
+UserSnapshot es una foto inmutable del usuario (id, admin, rol y el
+conjunto de permisos como frozenset de (module, action)) que no depende de
+la sesión de SQLAlchemy, así que puede vivir entre peticiones. UserCache
+guarda esas fotos por username con un TTL; los endpoints que modifican
+usuarios o roles la invalidan. Los permisos salen del PermissionIndex y se
+marcan con su versión para refrescarlos cuando cambia la matriz de roles.
+
+La invalidación local sólo afecta al worker que atendió la petición; para
+que los demás no sigan sirviendo un usuario desactivado, degradado o
+borrado, esos endpoints llaman a mark_changed() (versión 'usuarios' de
+cache_versions, en la misma transacción). Cada entrada guarda la versión con
+la que se cacheó y deja de valer cuando ensure_fresh() ve otra, como mucho
+`check_interval` segundos después del commit.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from cache_versions import bump_version, get_version
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = 'usuarios'
+
+
+class RoleSnapshot(object):
+    """Datos mínimos del rol que usan las plantillas (`current_user.role.name`)."""
+    __slots__ = ('id', 'name')
+
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+
+
+class UserSnapshot(object):
+    """Usuario resuelto + permisos precalculados."""
+    __slots__ = ('id', 'username', 'correo', 'es_admin', 'activo', 'role', 'permissions', 'version')
+
+    def __init__(self, id, username, correo=None, es_admin=False, activo=True, role=None,
+                 permissions=frozenset(), version=None):
+        self.id = id
+        self.username = username
+        self.correo = correo
+        self.es_admin = bool(es_admin)
+        self.activo = bool(activo)
+        self.role = role
+        self.permissions = frozenset(permissions)
+        self.version = version
+
+    @classmethod
+    def from_user(cls, user, index=None):
+        role = user.role
+        if index is not None:
+            perms = index.for_role(user.role_id)
+        else:
+            perms = frozenset((p.module, p.action) for p in role.permissions) if role else frozenset()
+        return cls(
+            id=user.id,
+            username=user.username,
+            correo=user.correo,
+            es_admin=user.es_admin,
+            activo=user.activo,
+            role=RoleSnapshot(role.id, role.name) if role else None,
+            permissions=perms,
+            version=index.version if index is not None else None
+        )
+
+    def with_permissions(self, index):
+        """Copia del snapshot con los permisos de la versión actual del índice."""
+        return UserSnapshot(self.id, self.username, self.correo, self.es_admin, self.activo, self.role,
+                            permissions=index.for_role(self.role.id if self.role else None),
+                            version=index.version)
+
+    def has_permission(self, module, action):
+        if self.es_admin:
+            return True
+        return (module, action) in self.permissions
+
+
+class UserCache(object):
+    """Caché LRU con TTL de UserSnapshot por username (por proceso)."""
+
+    def __init__(self, ttl=30, max_entries=1000, db=None, check_interval=1.0):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.db = db
+        self.check_interval = max(0.0, float(check_interval))
+        self.version = None
+        self._checked_at = None
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def ensure_fresh(self):
+        """Lee la versión 'usuarios' (comprobación espaciada); las entradas de otra versión caducan."""
+        if self.db is None:
+            return
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        try:
+            self.version = get_version(self.db, VERSION_KEY)
+        except Exception as e:
+            # Se sigue con la última versión leída (el TTL acota la caché) y se reintenta más tarde
+            self.db.session.rollback()
+            logger.warning(f"[USUARIOS] No se pudo leer la versión de la caché de usuarios: {e}")
+
+    def mark_changed(self):
+        """Marca los usuarios como modificados en todos los workers (llamar antes del commit)."""
+        bump_version(self.db, VERSION_KEY)
+        self._checked_at = None
+
+    def get(self, username):
+        if self.ttl <= 0:
+            return None
+        with self._lock:
+            entry = self._data.get(username)
+            if entry is None:
+                return None
+            expires, version, snapshot = entry
+            if expires < time.monotonic() or version != self.version:
+                del self._data[username]
+                return None
+            self._data.move_to_end(username)
+            return snapshot
+
+    def set(self, username, snapshot):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._data[username] = (time.monotonic() + self.ttl, self.version, snapshot)
+            self._data.move_to_end(username)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def invalidate(self, username=None):
+        """Borra un usuario, o toda la caché si username es None."""
+        with self._lock:
+            if username is None:
+                self._data.clear()
+                self._checked_at = None
+            else:
+                self._data.pop(username, None)
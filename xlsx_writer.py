@@ -0,0 +1,119 @@
+"""
+Generación de XLSX con memoria constante.
+
+XlsxWriter usa el modo write_only de openpyxl: cada fila se serializa al
+añadirla, en lugar de guardar un objeto por celda hasta wb.save(). Por eso:
+
+- los anchos de columna se fijan al crear la hoja (no se pueden calcular
+  recorriendo las celdas al final); column_widths() los deriva de las
+  longitudes máximas, que el llamador obtiene con un MAX(LENGTH(...)) en SQL
+  o de anchos fijos;
+- la altura de una fila se indica al añadirla;
+- las imágenes se vuelcan a ficheros temporales y openpyxl las lee de disco
+  al guardar, en vez de tenerlas todas en memoria.
+
+El libro se guarda en un fichero (temporal o el de un trabajo) y
+send_xlsx() lo envía en streaming y lo borra al cerrar la respuesta.
+"""
+import os
+import shutil
+import tempfile
+
+from flask import send_file
+
+MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+HEADER_COLOR = '4472C4'
+MAX_WIDTH = 50
+
+
+def column_widths(headers, max_lengths, padding=2, maximum=MAX_WIDTH):
+    """Ancho por columna: el mayor entre encabezado y datos, más margen, con tope."""
+    return [min(max(len(h), n or 0) + padding, maximum) for h, n in zip(headers, max_lengths)]
+
+
+class XlsxWriter(object):
+    """Hoja única en modo write_only con encabezado con estilo."""
+
+    def __init__(self, title, headers, widths, tmp_dir=None):
+        from openpyxl import Workbook
+        from openpyxl.cell import WriteOnlyCell
+        from openpyxl.styles import Alignment, Font, PatternFill
+        from openpyxl.utils import get_column_letter
+
+        self.tmp_dir = tmp_dir
+        self._images_dir = None
+        self._images = 0
+        self.wb = Workbook(write_only=True)
+        self.ws = self.wb.create_sheet(title)
+        for idx, width in enumerate(widths, start=1):
+            self.ws.column_dimensions[get_column_letter(idx)].width = width
+
+        fill = PatternFill(start_color=HEADER_COLOR, end_color=HEADER_COLOR, fill_type='solid')
+        font = Font(bold=True, color='FFFFFF')
+        alignment = Alignment(horizontal='center', vertical='center')
+        cabecera = []
+        for header in headers:
+            cell = WriteOnlyCell(self.ws, value=header)
+            cell.fill, cell.font, cell.alignment = fill, font, alignment
+            cabecera.append(cell)
+        self.ws.append(cabecera)
+        self.row = 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def append(self, values, height=None):
+        """Añade una fila y devuelve su número (1 = encabezado)."""
+        self.row += 1
+        if height is not None:
+            self.ws.row_dimensions[self.row].height = height
+        self.ws.append(values)
+        return self.row
+
+    def add_image(self, data, anchor, width=None, height=None):
+        """Incrusta una imagen (bytes) anclada en la celda `anchor` (p. ej. 'G5')."""
+        from openpyxl.drawing.image import Image as XLImage
+
+        if self._images_dir is None:
+            self._images_dir = tempfile.mkdtemp(prefix='xlsx_img_', dir=self.tmp_dir)
+        self._images += 1
+        path = os.path.join(self._images_dir, f'{self._images}.img')
+        with open(path, 'wb') as f:
+            f.write(data)
+        img = XLImage(path)
+        if width is not None:
+            img.width = width
+        if height is not None:
+            img.height = height
+        self.ws.add_image(img, anchor)
+
+    def save(self, path=None):
+        """Guarda el libro en `path` (o en un temporal) y devuelve la ruta."""
+        if path is None:
+            fd, path = tempfile.mkstemp(suffix='.xlsx', dir=self.tmp_dir)
+            os.close(fd)
+        try:
+            self.wb.save(path)
+        finally:
+            self.close()
+        return path
+
+    def close(self):
+        if self._images_dir is not None:
+            shutil.rmtree(self._images_dir, ignore_errors=True)
+            self._images_dir = None
+
+
+def send_xlsx(writer, download_name):
+    """Guarda `writer` en un temporal y lo envía como descarga (se borra al terminar)."""
+    path = writer.save()
+    try:
+        response = send_file(path, mimetype=MIMETYPE, as_attachment=True, download_name=download_name)
+    except Exception:
+        os.unlink(path)
+        raise
+    response.call_on_close(lambda: os.unlink(path))
+    return response